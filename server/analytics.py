@@ -0,0 +1,370 @@
+"""Vetted analytical queries over the hourly flood dataset, run by embedded DuckDB.
+
+Analysts pick a query by name and pass parameters; the SQL text is fixed
+here and every value is bound as a DuckDB parameter, so no caller-supplied
+text reaches the SQL. DuckDB reads the parquet files itself, so the API
+process never holds the full frame: results stream back as NDJSON, one
+line per Arrow batch.
+
+Every query is bounded by an Hour range [start, end) and optionally by a
+set of Grid_IDs. Both filters are pushed down into the parquet scan:
+
+ - Hour and Grid_ID are compared against row-group min/max statistics, so
+   row groups outside the range are never decoded. Grid_ID filters add the
+   min/max of the requested ids, since DuckDB cannot derive them from a
+   list lookup;
+ - on a directory of hive partitions month=YYYY-MM (see `partition` below)
+   the month range also prunes whole files before they are opened.
+
+`python analytics.py partition --data <parquet> --out <dir>` rewrites the
+builder's single file into that layout, sorted by Grid_ID then Hour inside
+each month so row-group Grid_ID ranges stay narrow.
+
+NDJSON lines:
+    {"type": "header", "query": ..., "columns": [...], "types": [...], "params": {...}}
+    {"type": "rows", "n": 5000, "data": {"Grid_ID": [...], ...}}    (columnar, repeated)
+    {"type": "end", "rows": ..., "elapsed_ms": ...}
+or a final {"type": "error", "error": ...} if the query fails mid-stream.
+
+Configuration (env vars):
+ - ANALYTICS_THREADS         DuckDB threads per query (default 2)
+ - ANALYTICS_MEMORY_MB       DuckDB memory limit per query (default 512)
+ - ANALYTICS_TIMEOUT_S       queries are interrupted after this long (default 30)
+ - ANALYTICS_MAX_ROWS        cap on the limit parameter (default 100000)
+ - ANALYTICS_BATCH_ROWS      rows per streamed line (default 5000)
+ - ANALYTICS_MAX_CONCURRENT  queries running at once per process (default 4)
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+import pandas as pd
+
+# DuckDB threads per query
+THREADS = int(os.getenv("ANALYTICS_THREADS", "2"))
+# DuckDB memory limit per query, in MB (larger sorts / aggregations spill to disk)
+MEMORY_MB = int(os.getenv("ANALYTICS_MEMORY_MB", "512"))
+# Queries still running after this many seconds are interrupted
+TIMEOUT_S = float(os.getenv("ANALYTICS_TIMEOUT_S", "30"))
+# Largest accepted limit parameter
+MAX_ROWS = int(os.getenv("ANALYTICS_MAX_ROWS", "100000"))
+# Rows per streamed NDJSON line
+BATCH_ROWS = int(os.getenv("ANALYTICS_BATCH_ROWS", "5000"))
+# Queries running at once in this process; more are refused with Busy
+MAX_CONCURRENT = int(os.getenv("ANALYTICS_MAX_CONCURRENT", "4"))
+# Most Grid_IDs accepted in one query
+MAX_GRID_IDS = 10000
+RISK_LEVELS = ("Low", "Medium", "High")
+
+_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT)
+
+
+class Busy(RuntimeError):
+    """MAX_CONCURRENT queries are already running."""
+
+
+class Param:
+    def __init__(self, name: str, kind: str, default: Any = None, required: bool = False, help: str = ""):
+        self.name = name
+        self.kind = kind  # timestamp | int | level | grid_ids
+        self.default = default
+        self.required = required
+        self.help = help
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "type": self.kind, "required": self.required, "default": self.default, "help": self.help}
+
+
+class Query:
+    def __init__(self, name: str, description: str, sql: str, params: List[Param]):
+        self.name = name
+        self.description = description
+        self.sql = sql  # {source} and {where} are filled in by render(); values are $name parameters
+        self.params = params
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "description": self.description, "params": [p.describe() for p in self.params]}
+
+
+_RANGE = [
+    Param("start", "timestamp", required=True, help="first Hour included (ISO 8601)"),
+    Param("end", "timestamp", required=True, help="first Hour excluded (ISO 8601)"),
+    Param("grid_ids", "grid_ids", help="restrict to these Grid_IDs"),
+]
+
+
+def _limit(default: int) -> Param:
+    return Param("limit", "int", default=default, help=f"rows returned (max {MAX_ROWS})")
+
+
+def _class_counts() -> str:
+    return ", ".join(f"count(*) FILTER (WHERE Flood_Risk = '{lvl}') AS {lvl.lower()}_hours" for lvl in RISK_LEVELS)
+
+
+QUERIES: Dict[str, Query] = {q.name: q for q in [
+    Query(
+        "top_risk_grids",
+        "Grids with the most hours at a risk level in the range, e.g. most High hours in July",
+        "SELECT Grid_ID, count(*) FILTER (WHERE Flood_Risk = $level) AS level_hours, count(*) AS hours, "
+        "max(Rain_mm) AS max_rain_mm FROM {source} WHERE {where} "
+        "GROUP BY Grid_ID ORDER BY level_hours DESC, Grid_ID LIMIT $limit",
+        _RANGE + [Param("level", "level", default="High", help="risk class counted"), _limit(50)],
+    ),
+    Query(
+        "grid_hours",
+        "Hourly dynamic features and risk of the given grids",
+        "SELECT Grid_ID, Hour, Rain_mm, Rain_Past3h, Drain_Water_Level, Soil_Moisture, Score, Flood_Risk "
+        "FROM {source} WHERE {where} ORDER BY Grid_ID, Hour LIMIT $limit",
+        [p if p.name != "grid_ids" else Param("grid_ids", "grid_ids", required=True, help=p.help) for p in _RANGE]
+        + [_limit(MAX_ROWS)],
+    ),
+    Query(
+        "risk_by_hour_of_day",
+        "Grid-hours per risk class for each hour of the day",
+        f"SELECT hour(Hour) AS hour_of_day, {_class_counts()}, avg(Rain_mm) AS mean_rain_mm "
+        "FROM {source} WHERE {where} GROUP BY hour_of_day ORDER BY hour_of_day LIMIT $limit",
+        _RANGE + [_limit(24)],
+    ),
+    Query(
+        "daily_risk",
+        "Grid-hours per risk class for each day",
+        f"SELECT CAST(Hour AS DATE) AS day, {_class_counts()}, avg(Rain_mm) AS mean_rain_mm, max(Rain_mm) AS max_rain_mm "
+        "FROM {source} WHERE {where} GROUP BY day ORDER BY day LIMIT $limit",
+        _RANGE + [_limit(MAX_ROWS)],
+    ),
+    Query(
+        "wettest_hours",
+        "Grid-hours with the most rain over the past 3 hours",
+        "SELECT Grid_ID, Hour, Rain_mm, Rain_Past3h, Drain_Water_Level, Flood_Risk "
+        "FROM {source} WHERE {where} ORDER BY Rain_Past3h DESC, Grid_ID, Hour LIMIT $limit",
+        _RANGE + [_limit(100)],
+    ),
+]}
+
+
+def _timestamp(name: str, value: Any) -> datetime.datetime:
+    try:
+        ts = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an ISO 8601 timestamp")
+    if pd.isna(ts):
+        raise ValueError(f"{name} must be an ISO 8601 timestamp")
+    # dataset Hours are naive wall-clock times; keep the caller's wall-clock time
+    return ts.tz_localize(None).to_pydatetime() if ts.tzinfo is not None else ts.to_pydatetime()
+
+
+def bind(query: Query, raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Validated parameter values of query from raw; ValueError on unknown, missing or malformed ones."""
+    known = {p.name for p in query.params}
+    unknown = sorted(set(raw) - known)
+    if unknown:
+        raise ValueError(f"Unknown parameters for {query.name}: {unknown}")
+    values: Dict[str, Any] = {}
+    for p in query.params:
+        value = raw.get(p.name)
+        if value is None:
+            if p.required:
+                raise ValueError(f"{p.name} is required")
+            values[p.name] = p.default
+            continue
+        if p.kind == "timestamp":
+            values[p.name] = _timestamp(p.name, value)
+        elif p.kind == "int":
+            try:
+                n = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{p.name} must be an integer")
+            if not 1 <= n <= MAX_ROWS:
+                raise ValueError(f"{p.name} must be between 1 and {MAX_ROWS}")
+            values[p.name] = n
+        elif p.kind == "level":
+            if value not in RISK_LEVELS:
+                raise ValueError(f"{p.name} must be one of {list(RISK_LEVELS)}")
+            values[p.name] = value
+        elif p.kind == "grid_ids":
+            if isinstance(value, str):
+                value = [v for v in value.split(",") if v.strip()]
+            try:
+                ids = sorted({int(v) for v in value})
+            except (TypeError, ValueError):
+                raise ValueError(f"{p.name} must be a list of integers")
+            if not ids or len(ids) > MAX_GRID_IDS:
+                raise ValueError(f"{p.name} must list 1 to {MAX_GRID_IDS} Grid_IDs")
+            values[p.name] = ids
+    if "start" in values and values["end"] <= values["start"]:
+        raise ValueError("end must be after start")
+    return values
+
+
+def _quote(text: str) -> str:
+    return "'" + text.replace("'", "''") + "'"
+
+
+def source(data_path: str) -> Tuple[str, bool]:
+    """(FROM clause, hive-partitioned by month) of the dataset at data_path."""
+    if os.path.isdir(data_path):
+        pattern = os.path.join(data_path, "**", "*.parquet")
+        by_month = any(d.startswith("month=") for d in os.listdir(data_path))
+        return f"read_parquet({_quote(pattern)}, hive_partitioning = true)", by_month
+    return f"read_parquet({_quote(data_path)})", False
+
+
+def render(query: Query, values: Dict[str, Any], data_path: str) -> Tuple[str, Dict[str, Any]]:
+    """(SQL, DuckDB parameters) for the bound values."""
+    from_clause, partitioned = source(data_path)
+    params = {k: v for k, v in values.items() if k in ("start", "end", "level", "limit")}
+    where = ["Hour >= $start", "Hour < $end"]
+    if partitioned:
+        # month=YYYY-MM directories outside the range are never opened
+        params["start_month"] = values["start"].strftime("%Y-%m")
+        params["end_month"] = (values["end"] - datetime.timedelta(microseconds=1)).strftime("%Y-%m")
+        where.append("month BETWEEN $start_month AND $end_month")
+    ids = values.get("grid_ids")
+    if ids is not None:
+        params.update(grid_ids=ids, grid_min=ids[0], grid_max=ids[-1])
+        where.append("Grid_ID BETWEEN $grid_min AND $grid_max AND list_contains($grid_ids, Grid_ID)")
+    return query.sql.format(source=from_clause, where=" AND ".join(where)), params
+
+
+def _connect():
+    import duckdb
+
+    con = duckdb.connect(":memory:")
+    con.execute(f"SET threads = {int(THREADS)}")
+    con.execute(f"SET memory_limit = '{int(MEMORY_MB)}MB'")
+    return con
+
+
+def _columns(batch) -> Dict[str, list]:
+    """Columnar JSON-ready lists of an Arrow batch: ISO times, NaN as null."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    data = {}
+    for name, col in zip(batch.schema.names, batch.columns):
+        if pa.types.is_timestamp(col.type):
+            # whole seconds: %S of a finer unit prints the fraction too
+            col = pc.strftime(pc.cast(col, pa.timestamp("s"), safe=False), format="%Y-%m-%dT%H:%M:%S")
+        elif pa.types.is_date(col.type):
+            col = pc.strftime(col, format="%Y-%m-%d")
+        elif pa.types.is_floating(col.type):
+            col = pc.if_else(pc.is_nan(col), pa.scalar(None, col.type), col)
+        data[name] = col.to_pylist()
+    return data
+
+
+def _jsonable(values: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v.isoformat() if isinstance(v, datetime.datetime) else v for k, v in values.items()}
+
+
+def run(data_path: str, name: str, raw: Dict[str, Any]) -> Iterator[bytes]:
+    """Start query name and return an iterator of NDJSON lines.
+
+    Validation and query start happen here, so KeyError (unknown query), ValueError
+    (parameters), Busy and DuckDB errors are raised before the first line; failures while
+    streaming end the stream with an error line. Closing the iterator stops the query.
+    """
+    query = QUERIES[name]
+    values = bind(query, raw)
+    sql, params = render(query, values, data_path)
+    if not os.path.exists(data_path):
+        raise FileNotFoundError(f"Dataset not found: {data_path}")
+    if not _SLOTS.acquire(blocking=False):
+        raise Busy(f"{MAX_CONCURRENT} analytics queries are already running")
+    started = time.perf_counter()
+    con = None
+    timer = None
+    try:
+        con = _connect()
+        timer = threading.Timer(TIMEOUT_S, con.interrupt)
+        timer.daemon = True
+        timer.start()
+        result = con.execute(sql, params)
+        # to_arrow_reader replaced fetch_record_batch in DuckDB 1.4
+        reader = result.to_arrow_reader(BATCH_ROWS) if hasattr(result, "to_arrow_reader") else result.fetch_record_batch(BATCH_ROWS)
+    except BaseException:
+        if timer is not None:
+            timer.cancel()
+        if con is not None:
+            con.close()
+        _SLOTS.release()
+        raise
+    return _stream(query, values, con, timer, reader, started)
+
+
+def _stream(query: Query, values, con, timer, reader, started) -> Iterator[bytes]:
+    rows = 0
+    try:
+        yield (json.dumps({
+            "type": "header", "query": query.name, "columns": reader.schema.names,
+            "types": [str(t) for t in reader.schema.types], "params": _jsonable(values),
+        }) + "\n").encode()
+        try:
+            for batch in reader:
+                if batch.num_rows == 0:
+                    continue
+                rows += batch.num_rows
+                yield (json.dumps({"type": "rows", "n": batch.num_rows, "data": _columns(batch)}) + "\n").encode()
+        except Exception as ex:
+            timed_out = time.perf_counter() - started >= TIMEOUT_S
+            print(f"[Analytics] {query.name} failed after {rows} rows: {ex}")
+            error = f"Query exceeded {TIMEOUT_S:g}s" if timed_out else str(ex)
+            yield (json.dumps({"type": "error", "error": error, "rows": rows}) + "\n").encode()
+            return
+        yield (json.dumps({"type": "end", "rows": rows,
+                           "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}) + "\n").encode()
+    finally:
+        timer.cancel()
+        con.close()
+        _SLOTS.release()
+
+
+def catalog() -> List[Dict[str, Any]]:
+    return [q.describe() for q in QUERIES.values()]
+
+
+def partition(data_path: str, out_dir: str, row_group_rows: int = 100_000):
+    """Rewrite the dataset as hive partitions month=YYYY-MM, sorted by Grid_ID and Hour."""
+    if os.path.exists(out_dir) and os.listdir(out_dir):
+        raise SystemExit(f"{out_dir} is not empty")
+    con = _connect()
+    try:
+        from_clause, _ = source(data_path)
+        con.execute(
+            f"COPY (SELECT *, strftime(Hour, '%Y-%m') AS month FROM {from_clause} ORDER BY Grid_ID, Hour) "
+            f"TO {_quote(out_dir)} (FORMAT parquet, PARTITION_BY (month), ROW_GROUP_SIZE {int(row_group_rows)})"
+        )
+    finally:
+        con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vetted DuckDB queries over the flood dataset.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    part = sub.add_parser("partition", help="rewrite the dataset as month=YYYY-MM hive partitions")
+    part.add_argument("--data", required=True, help="parquet file or directory")
+    part.add_argument("--out", required=True, help="output directory (must be empty)")
+    part.add_argument("--row-group-rows", type=int, default=100_000)
+    q = sub.add_parser("query", help="run a vetted query and print its NDJSON")
+    q.add_argument("name", choices=sorted(QUERIES))
+    q.add_argument("--data", required=True, help="parquet file or partitioned directory")
+    q.add_argument("--param", action="append", default=[], metavar="NAME=VALUE")
+    args = parser.parse_args()
+    if args.command == "partition":
+        t0 = time.perf_counter()
+        partition(args.data, args.out, args.row_group_rows)
+        print(f"[Analytics] Partitioned {args.data} into {args.out} in {time.perf_counter() - t0:.1f}s")
+        return
+    raw = dict(p.split("=", 1) for p in args.param)
+    for line in run(args.data, args.name, raw):
+        print(line.decode(), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,18 @@
-from fastapi import FastAPI, HTTPException, Form, File, UploadFile
+from fastapi import FastAPI, HTTPException, Form, File, UploadFile, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, conlist
-from typing import List, Optional
+from typing import Dict, List, Optional
 from fastapi.middleware.cors import CORSMiddleware
-import joblib
 import os
 import numpy as np
 import pandas as pd
 import traceback
+import asyncio
+import json
 import datetime
+import time
+import threading
 from dateutil import parser as dtparser
 from ultralytics import YOLO
 import cv2
@@ -22,17 +27,84 @@ except Exception:
         lookup_grid_id = None  # type: ignore
         grid_index_available = lambda: False  # type: ignore
 
+try:
+    from .prediction_cache import from_env as prediction_cache_from_env  # type: ignore
+except Exception:
+    from prediction_cache import from_env as prediction_cache_from_env  # type: ignore
 
-BASE_DIR = os.path.dirname(__file__)
-MODEL_PATH = os.path.join(BASE_DIR, 'model', 'flood_model.pkl')
-SCALER_PATH = os.path.join(BASE_DIR, 'scaler', 'scaler.pkl')
-ENCODER_PATH = os.path.join(BASE_DIR, 'encoder', 'label_encoder.pkl')
-DATA_PATH = os.path.join(BASE_DIR, 'dataset', 'delhi_flood_dataset_demo.parquet')
-_DATA_DF = None
+try:
+    from . import metrics  # type: ignore
+    from .artifacts import BundleManager, SERVED_VERSION  # type: ignore
+except Exception:
+    import metrics  # type: ignore
+    from artifacts import BundleManager, SERVED_VERSION  # type: ignore
+
+try:
+    from .dataset_index import FEATURES, NS_PER_HOUR, time_columns  # type: ignore
+    from . import nowcast  # type: ignore
+except Exception:
+    from dataset_index import FEATURES, NS_PER_HOUR, time_columns  # type: ignore
+    import nowcast  # type: ignore
 
+try:
+    from . import tiles  # type: ignore
+    from . import regions  # type: ignore
+    from . import grid_hierarchy  # type: ignore
+    from . import image_io  # type: ignore
+    from . import uploads  # type: ignore
+    from . import detection_log  # type: ignore
+    from . import flood_runtime  # type: ignore
+    from . import scenarios  # type: ignore
+    from . import risk_stream  # type: ignore
+    from . import profiling  # type: ignore
+    from . import analytics  # type: ignore
+except Exception:
+    import tiles  # type: ignore
+    import regions  # type: ignore
+    import grid_hierarchy  # type: ignore
+    import image_io  # type: ignore
+    import uploads  # type: ignore
+    import detection_log  # type: ignore
+    import flood_runtime  # type: ignore
+    import scenarios  # type: ignore
+    import risk_stream  # type: ignore
+    import profiling  # type: ignore
+    import analytics  # type: ignore
 
-app = FastAPI(title="DelhiFlow - Prediction API")
 
+BASE_DIR = os.path.dirname(__file__)
+MODEL_PATH = os.getenv("FLOOD_MODEL_PATH", os.path.join(BASE_DIR, 'model', 'flood_model.pkl'))
+SCALER_PATH = os.getenv("FLOOD_SCALER_PATH", os.path.join(BASE_DIR, 'scaler', 'scaler.pkl'))
+ENCODER_PATH = os.getenv("FLOOD_ENCODER_PATH", os.path.join(BASE_DIR, 'encoder', 'label_encoder.pkl'))
+DATA_PATH = os.getenv("FLOOD_DATA_PATH", os.path.join(BASE_DIR, 'dataset', 'delhi_flood_dataset_demo.parquet'))
+# NumPy export of the three pickles (flood_runtime.py); served instead of them when present and current ("" disables)
+RUNTIME_PATH = os.getenv("FLOOD_RUNTIME_PATH", os.path.join(BASE_DIR, 'model', 'flood_model.npz'))
+# Rule-score first stage calibrated by cascade.py; clear Low/High rows skip the model when present and current ("" disables)
+CASCADE_PATH = os.getenv("FLOOD_CASCADE_PATH", os.path.join(BASE_DIR, 'model', 'cascade.json'))
+# Admin endpoints require this token in X-Admin-Token; when unset they only accept local clients
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Rendered risk tiles are cached here as {version}/{hour}/{z}/{x}/{y}.png
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", os.path.join(BASE_DIR, 'tile_cache'))
+# Ward polygons for /regions/risk and where their Grid_ID overlap matrix is cached
+REGIONS_PATH = os.getenv("REGIONS_PATH", os.path.join(BASE_DIR, 'dataset', 'wards.geojson'))
+REGIONS_MAPPING_PATH = os.getenv("REGIONS_MAPPING_PATH", os.path.join(BASE_DIR, 'dataset', 'wards_mapping.npz'))
+# Attach a Server-Timing header to every response (otherwise only when the client sends X-Server-Timing: 1)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that records serialization time as the json_encode stage."""
+
+    def render(self, content) -> bytes:
+        with metrics.stage("json_encode"):
+            return super().render(content)
+
+
+app = FastAPI(title="DelhiFlow - Prediction API", default_response_class=TimedJSONResponse)
+
+# Added before CORS so CORS wraps it: a 413 must carry Access-Control-Allow-Origin, or browsers
+# report an opaque network error instead of "file too large". No middleware reads the body first.
+app.add_middleware(uploads.UploadLimitMiddleware, max_bytes=uploads.MAX_UPLOAD_BYTES)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # dev only
@@ -41,6 +113,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+def _route_label(request: Request) -> str:
+    """Route template for metric labels, e.g. /potholes/detect rather than raw paths.
+
+    Routes from included routers may report their path without the router prefix,
+    so the prefix is recovered from the leading segments of the actual URL path.
+    """
+    route = request.scope.get("route")
+    template = getattr(route, "path", None)
+    if not template:
+        return "unmatched"
+    actual = [p for p in request.url.path.split("/") if p]
+    n_prefix = len(actual) - len([p for p in template.split("/") if p])
+    if n_prefix <= 0:
+        return template
+    return "/" + "/".join(actual[:n_prefix]) + template
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    token, obs = metrics.begin_request()
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - t0
+        metrics.end_request(token, obs, _route_label(request), request.method, status, elapsed)
+    if SERVER_TIMING or request.headers.get("x-server-timing") == "1":
+        response.headers["Server-Timing"] = metrics.server_timing(obs, elapsed)
+    return response
+
+
+@app.middleware("http")
+async def report_model_version(request: Request, call_next):
+    # Endpoints that pin an artifact bundle record its version here; others report the active one.
+    holder = {}
+    token = SERVED_VERSION.set(holder)
+    try:
+        response = await call_next(request)
+    finally:
+        SERVED_VERSION.reset(token)
+    response.headers["X-Model-Version"] = holder.get("version") or BUNDLES.current().version
+    return response
+
 # Mount potholes router
 try:
     from .potholes import router as potholes_router  # when running as package
@@ -94,70 +212,200 @@ class LocationTimeRequest(BaseModel):
     day_of_week: Optional[int] = None
 
 
-def load_artifacts():
-	"""Load model, scaler and label encoder from disk."""
-	try:
-		model = joblib.load(MODEL_PATH)
-	except Exception:
-		model = None
-	try:
-		scaler = joblib.load(SCALER_PATH)
-	except Exception:
-		scaler = None
-	try:
-		le = joblib.load(ENCODER_PATH)
-	except Exception:
-		le = None
-	return model, scaler, le
+class TimelineRequest(BaseModel):
+    # Grids to forecast: Grid_IDs and/or [latitude, longitude] points (e.g. along a route)
+    grid_ids: Optional[List[int]] = None
+    points: Optional[List[conlist(float, min_length=2, max_length=2)]] = None
+    start: Optional[str] = None  # first hour of the series; defaults to the current hour
+    hours: int = 24
+
+
+class RainField(BaseModel):
+    # Small lon/lat raster of rainfall totals (mm over the window); rows north to south, columns west to east
+    bbox: conlist(float, min_length=4, max_length=4)  # minx, miny, maxx, maxy
+    values: List[List[float]]
+
+
+class ScenarioRequest(BaseModel):
+    # Exactly one rainfall source: citywide total, per-ward totals, or a raster
+    total_mm: Optional[float] = None
+    ward_mm: Optional[Dict[str, float]] = None  # ward id (REGIONS_PATH) -> total mm
+    field: Optional[RainField] = None
+    default_mm: float = 0.0  # grids outside the listed wards / raster
+    profile: Optional[List[float]] = None  # relative share per hour; even by default
+    start: Optional[str] = None  # first hour; defaults to the current hour
+    hours: int = 3
+    # Optional citywide overrides; otherwise each grid's dataset value for the hour
+    drain_water_level: Optional[float] = None
+    soil_moisture: Optional[float] = None
+    include_grid: bool = False  # add the full grid x hour risk as base64 uint8 arrays
+
+
+class ProfileRequest(BaseModel):
+    # Route paths to profile, e.g. "/predict_location_time" or "/potholes/detect"; default every thread
+    routes: Optional[List[str]] = None
+    seconds: float = 10  # window; the session stops itself after it
+    interval_ms: float = 5  # stack sampling period
+    memory: bool = False  # also trace allocations with tracemalloc
+    top: int = 30  # frames / allocation sites listed
+
+
+class AnalyticsQuery(BaseModel):
+    # Parameters of the vetted query, e.g. {"start": "2025-07-01", "end": "2025-08-01", "level": "High"}
+    params: Dict[str, object] = {}
+
+
+class NowcastTick(BaseModel):
+    # Columnar batch of observations: one entry per update in each list
+    grid_ids: List[int]
+    timestamp: Optional[str] = None  # hour of the whole tick; defaults to now
+    timestamps: Optional[List[str]] = None  # or one timestamp per update
+    rain_mm: Optional[List[Optional[float]]] = None  # null = not reported
+    drain_water_level: Optional[List[Optional[float]]] = None
+    soil_moisture: Optional[List[Optional[float]]] = None
+    rescore: bool = True
+
+
+def _on_bundle_swap(old, new):
+	global NOWCAST
+	# Cached predictions are keyed by version, so old entries can never be served; free them now.
+	PREDICTION_CACHE.clear()
+	TILE_CACHE.drop_versions(keep=new.version)
+	with _HOUR_GENERATION_LOCK:
+		for key in [k for k in _HOUR_GENERATION if k[0] != new.version]:
+			del _HOUR_GENERATION[key]
+	# Keep live observations across a swap when the grid set is unchanged; they get rescored on the next tick.
+	static = new.index.features[new.index.starts] if new.index is not None else None
+	if static is None or NOWCAST is None or not NOWCAST.refresh_static(new.index.grid_ids, static[:, 0], static[:, 1]):
+		NOWCAST = nowcast.from_bundle(new, capacity=NOWCAST_CAPACITY)
+	# push what the new model changes to live map clients
+	if RISK_STREAM.subscribers:
+		threading.Thread(target=_publish_risk, name="risk-stream-swap", daemon=True).start()
+
+
+PREDICTION_CACHE = prediction_cache_from_env()
+TILE_CACHE = tiles.TileCache(TILE_CACHE_DIR)
+BUNDLES = BundleManager(
+	{"model_path": MODEL_PATH, "scaler_path": SCALER_PATH, "encoder_path": ENCODER_PATH, "data_path": DATA_PATH,
+	 "runtime_path": RUNTIME_PATH, "cascade_path": CASCADE_PATH},
+	on_swap=_on_bundle_swap,
+	drain_timeout_s=float(os.getenv("ARTIFACT_DRAIN_TIMEOUT_S", "60")),
+)
+# Poll artifact files and hot-swap on change (seconds; 0 disables)
+BUNDLES.watch(float(os.getenv("ARTIFACT_WATCH_S", "0")))
+# Hours of observations kept per grid by the nowcast ring buffers
+NOWCAST_CAPACITY = int(os.getenv("NOWCAST_CAPACITY_H", "24"))
+NOWCAST = nowcast.from_bundle(BUNDLES.current(), capacity=NOWCAST_CAPACITY)
 
 
-MODEL, SCALER, LE = load_artifacts()
+def _cache_metrics():
+	st = PREDICTION_CACHE.stats()
+	lines = []
+	for name, kind in (("hits", "counter"), ("misses", "counter"), ("waits", "counter"), ("evictions", "counter"), ("size", "gauge")):
+		metric = f"delhiflow_prediction_cache_{name}" + ("_total" if kind == "counter" else "")
+		lines += [f"# TYPE {metric} {kind}", f"{metric} {st[name]}"]
+	return lines
+
+
+metrics.register_collector(_cache_metrics)
 
 
 @app.get("/health")
 def health():
-	return {"status": "ok", "model_loaded": MODEL is not None}
+	bundle = BUNDLES.current()
+	return {"status": "ok", "model_loaded": bundle.model is not None, "model_version": bundle.version}
 
 
-def transform_and_predict(df_array: np.ndarray):
-	"""Expect df_array shape (n, 9) in the same column order as GridInput fields.
-	This function scales the continuous features using the saved scaler and returns predictions and probs.
+def _require_admin(request: Request):
+	if ADMIN_TOKEN:
+		if request.headers.get("x-admin-token") != ADMIN_TOKEN:
+			raise HTTPException(status_code=403, detail="Invalid admin token")
+	elif request.client is None or request.client.host not in ("127.0.0.1", "::1"):
+		raise HTTPException(status_code=403, detail="Admin endpoints are local-only unless ADMIN_TOKEN is set")
+
+
+@app.post("/admin/reload")
+def admin_reload(request: Request, force: bool = False, wait: bool = False):
+	"""Rebuild model, scaler, encoder and dataset index in the background and swap them in.
+
+	Requests already running finish on the bundle they started with. Without force,
+	nothing happens when the files on disk are unchanged.
 	"""
-	if SCALER is None or MODEL is None or LE is None:
-		raise RuntimeError("Model artifacts not available on server.")
+	_require_admin(request)
+	started = BUNDLES.reload(force=force, wait=wait)
+	return {"started": started, **BUNDLES.status()}
 
-	# continuous columns indices assuming order: Elevation, Road_Density, Rain_mm, Rain_Past3h, Drain_Water_Level, Soil_Moisture
-	cont_idx = [0,1,2,3,4,5]
 
-	cont = df_array[:, cont_idx].astype(float)
-	cont_scaled = SCALER.transform(cont)
+@app.get("/admin/artifacts")
+def admin_artifacts(request: Request):
+	"""Active bundle version, reload state and bundles still draining."""
+	_require_admin(request)
+	return BUNDLES.status()
 
-	# time features cyclical encoding
-	hour = df_array[:,6].astype(float)
-	month = df_array[:,7].astype(float)
-	dow = df_array[:,8].astype(float)
 
-	hour_sin = np.sin(2 * np.pi * hour / 24)
-	hour_cos = np.cos(2 * np.pi * hour / 24)
-	month_sin = np.sin(2 * np.pi * month / 12)
-	month_cos = np.cos(2 * np.pi * month / 12)
-	dow_sin = np.sin(2 * np.pi * dow / 7)
-	dow_cos = np.cos(2 * np.pi * dow / 7)
+@app.get("/metrics")
+def prometheus_metrics():
+	"""Prometheus text exposition of stage latencies, batch sizes, cache and load metrics."""
+	return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-	time_feats = np.stack([hour_sin, hour_cos, month_sin, month_cos, dow_sin, dow_cos], axis=1)
 
-	X = np.concatenate([cont_scaled, time_feats], axis=1)
+@app.get("/cache/stats")
+def cache_stats():
+	"""Hit/miss counters of the prediction and tile caches, detection log and risk stream counters."""
+	return {
+		"prediction_cache": PREDICTION_CACHE.stats(), "tile_cache": TILE_CACHE.stats(),
+		"detection_log": detection_log.shared().stats(), "risk_stream": RISK_STREAM.stats(),
+		"model_version": BUNDLES.current().version,
+	}
 
-	preds = MODEL.predict(X)
-	probs = MODEL.predict_proba(X).max(axis=1)
-	labels = LE.inverse_transform(preds)
 
+def transform_and_predict(df_array: np.ndarray, bundle=None):
+	"""Expect df_array shape (n, 9) in the same column order as GridInput fields.
+	This function scales the continuous features using the saved scaler and returns predictions and probs.
+	Uses the given artifact bundle, or the active one.
+	"""
+	preds, probs, labels = predict_arrays(df_array, bundle)
 	results = []
 	for p, prob, lab in zip(preds.tolist(), probs.tolist(), labels.tolist()):
 		results.append({"class": int(p), "label": str(lab), "confidence": float(round(prob*100,2))})
 	return results
 
 
+def predict_arrays(df_array: np.ndarray, bundle=None):
+	"""Array form of transform_and_predict: (class ids, max probability, labels).
+	Used by batch scoring paths that should not build one dict per row.
+	"""
+	bundle = bundle or BUNDLES.current()
+	if not bundle.ready:
+		raise RuntimeError("Model artifacts not available on server.")
+
+	metrics.observe_batch(len(df_array))
+	with metrics.stage("transform_and_predict"):
+		return _predict_arrays(df_array, bundle)
+
+
+def _predict_arrays(df_array: np.ndarray, bundle):
+	if bundle.cascade is not None:
+		# clear Low/High rows are answered by the rule score; the rest go to the model
+		preds, probs = bundle.cascade.predict(df_array, lambda rows: _model_arrays(rows, bundle), dtype=bundle.model.classes_.dtype)
+	else:
+		preds, probs = _model_arrays(df_array, bundle)
+	labels = bundle.le.inverse_transform(preds)
+	return preds, probs, labels
+
+
+def _model_arrays(df_array: np.ndarray, bundle):
+	# scaled continuous features + cyclical time encoding (shared with the runtime export)
+	X = flood_runtime.design_matrix(df_array, bundle.scaler)
+
+	# One pass over the forest: predict() is classes_[argmax(predict_proba())], so derive it here
+	proba = bundle.model.predict_proba(X)
+	best = proba.argmax(axis=1)
+	preds = bundle.model.classes_.take(best)
+	probs = proba[np.arange(len(best)), best]
+	return preds, probs
+
+
 @app.post("/prect")
 def predict_multi(request: MultiGridRequest):
 	"""Predict flood risk for one or more grids.
@@ -175,16 +423,18 @@ def predict_multi(request: MultiGridRequest):
 			raise HTTPException(status_code=400, detail="No grids provided")
 
 		# prepare numpy array
-		rows = []
-		for g in request.grids:
-			rows.append([
-				g.Elevation, g.Road_Density, g.Rain_mm, g.Rain_Past3h,
-				g.Drain_Water_Level, g.Soil_Moisture, g.hour_of_day, g.month, g.day_of_week
-			])
-		arr = np.array(rows)
-
-		results = transform_and_predict(arr)
-		return {"results": results}
+		with metrics.stage("feature_assembly"):
+			rows = []
+			for g in request.grids:
+				rows.append([
+					g.Elevation, g.Road_Density, g.Rain_mm, g.Rain_Past3h,
+					g.Drain_Water_Level, g.Soil_Moisture, g.hour_of_day, g.month, g.day_of_week
+				])
+			arr = np.array(rows)
+
+		with BUNDLES.acquire() as bundle:
+			results = transform_and_predict(arr, bundle)
+		return {"results": results, "model_version": bundle.version}
 	except HTTPException:
 		raise
 	except Exception as ex:
@@ -192,16 +442,8 @@ def predict_multi(request: MultiGridRequest):
 		raise HTTPException(status_code=500, detail={"error": str(ex), "trace": tb})
 
 def load_dataset():
-    global _DATA_DF
-    if _DATA_DF is None:
-        if os.path.exists(DATA_PATH):
-            try:
-                _DATA_DF = pd.read_parquet(DATA_PATH)
-            except Exception:
-                _DATA_DF = None
-        else:
-            _DATA_DF = None
-    return _DATA_DF
+    """Dataset of the active artifact bundle (None when the parquet is missing)."""
+    return BUNDLES.current().df
 
 
 def derive_features_from_location(lat: float, lng: float):
@@ -301,7 +543,8 @@ def predict_location(request: LocationRequest):
             pass
         
         # Derive environmental features from location
-        features = derive_features_from_location(request.latitude, request.longitude)
+        with metrics.stage("feature_assembly"):
+            features = derive_features_from_location(request.latitude, request.longitude)
         
         # Use current time if not provided
         now = datetime.datetime.now()
@@ -328,8 +571,11 @@ def predict_location(request: LocationRequest):
             grid_input.Rain_Past3h, grid_input.Drain_Water_Level, grid_input.Soil_Moisture,
             grid_input.hour_of_day, grid_input.month, grid_input.day_of_week
         ]]
-        arr = np.array(rows)
-        results = transform_and_predict(arr)
+        # Features are a pure function of (lat, lon, current month), so the feature row
+        # itself is the cache key for this endpoint.
+        with BUNDLES.acquire() as bundle:
+            key = ("features",) + tuple(float(v) for v in rows[0]) + (bundle.version,)
+            prediction = PREDICTION_CACHE.get_or_compute(key, lambda: transform_and_predict(np.array(rows), bundle)[0])
         
         return {
             "location": {
@@ -342,7 +588,8 @@ def predict_location(request: LocationRequest):
                 "month": month, 
                 "day_of_week": day_of_week
             },
-            "prediction": results[0] if results else None
+            "prediction": prediction,
+            "model_version": bundle.version
         }
         
     except HTTPException:
@@ -352,6 +599,61 @@ def predict_location(request: LocationRequest):
         raise HTTPException(status_code=500, detail={"error": str(ex), "trace": tb})
 
 
+def _score_grid_time(bundle, grid_id, hour, month, dow, feats_loc=None):
+    """Select the dataset row for a grid and time bucket and run the model on it.
+
+    Returns {"used_row", "prediction", "missing"} where missing lists the features
+    that were absent from the dataset row and filled from defaults (or feats_loc).
+    """
+    index = bundle.index
+    with metrics.stage("dataset_select"):
+        # Match month and hour-of-day; if multiple days exist, take the first for that month,
+        # else fall back to the grid's first row (see DatasetIndex.row_for).
+        pos = index.row_for(int(grid_id), int(month), int(hour))
+        if pos is None:
+            raise HTTPException(status_code=404, detail=f"No dataset rows for Grid_ID={grid_id}")
+        row = dict(zip(FEATURES, index.features[pos].tolist()))
+        row_hour = pd.Timestamp(index.hours[pos])
+    missing = []
+
+    # Build input features: prefer dataset values when present; otherwise fallback to simple heuristics
+    def val_or_default(name, default):
+        v = row.get(name)
+        if v is None or np.isnan(v):
+            missing.append(name)
+            return default
+        return float(v)
+
+    with metrics.stage("feature_assembly"):
+        Elevation = val_or_default("Elevation", feats_loc["Elevation"] if feats_loc else 210.0)
+        Road_Density = val_or_default("Road_Density", feats_loc["Road_Density"] if feats_loc else 0.5)
+        Rain_mm = val_or_default("Rain_mm", feats_loc["Rain_mm"] if feats_loc else 5.0)
+        Rain_Past3h = val_or_default("Rain_Past3h", feats_loc["Rain_Past3h"] if feats_loc else Rain_mm)
+        Drain_Water_Level = val_or_default("Drain_Water_Level", feats_loc["Drain_Water_Level"] if feats_loc else 0.8)
+        Soil_Moisture = val_or_default("Soil_Moisture", feats_loc["Soil_Moisture"] if feats_loc else 0.4)
+
+        # Build model array and predict
+        arr = np.array([[
+            Elevation, Road_Density, Rain_mm, Rain_Past3h, Drain_Water_Level, Soil_Moisture,
+            int(hour), int(month), int(dow)
+        ]])
+    results = transform_and_predict(arr, bundle)
+
+    return {
+        "used_row": {
+            "Hour": row_hour.isoformat(),
+            "Elevation": Elevation,
+            "Road_Density": Road_Density,
+            "Rain_mm": Rain_mm,
+            "Rain_Past3h": Rain_Past3h,
+            "Drain_Water_Level": Drain_Water_Level,
+            "Soil_Moisture": Soil_Moisture,
+        },
+        "prediction": results[0] if results else None,
+        "missing": missing,
+    }
+
+
 @app.post("/predict_location_time")
 def predict_location_time(payload: LocationTimeRequest):
     """Dataset-driven prediction using location + time to select the correct grid row.
@@ -385,7 +687,8 @@ def predict_location_time(payload: LocationTimeRequest):
                 raise HTTPException(status_code=400, detail="Coordinates out of expected region for Delhi grid")
             if not grid_index_available():
                 raise HTTPException(status_code=400, detail="Grid geometry index not available on server for spatial lookup. Provide grid_id directly or add dataset/grid_index.geojson")
-            gid = lookup_grid_id(float(lat), float(lon))  # type: ignore
+            with metrics.stage("grid_lookup"):
+                gid = lookup_grid_id(float(lat), float(lon))  # type: ignore
             if gid is None:
                 raise HTTPException(status_code=404, detail="No grid cell found for provided coordinates")
             grid_id = gid
@@ -409,70 +712,653 @@ def predict_location_time(payload: LocationTimeRequest):
             month = month if month is not None else now.month
             dow = dow if dow is not None else now.weekday()
 
-        # Dataset has an 'Hour' timestamp column per grid; choose the same month and hour
-        # We'll match month and hour-of-day; if multiple days exist, take the first for that month.
-        df_grid = df[df["Grid_ID"] == int(grid_id)]
-        if df_grid.empty:
-            raise HTTPException(status_code=404, detail=f"No dataset rows for Grid_ID={grid_id}")
+        with BUNDLES.acquire() as bundle:
+            if bundle.index is None:
+                raise HTTPException(status_code=500, detail="Dataset not available on server")
+            # Dataset lookup + model call are deterministic per (grid, time bucket, artifacts),
+            # so they are served from the prediction cache.
+            key = (int(grid_id), int(hour), int(month), int(dow), bundle.version)
+            scored = PREDICTION_CACHE.get_or_compute(key, lambda: _score_grid_time(bundle, grid_id, hour, month, dow))
+
+            # The cached entry fills dataset gaps with fixed defaults; when the caller gave a
+            # location, gaps are filled from location heuristics instead, which is per-request.
+            if scored["missing"] and lat is not None and lon is not None:
+                feats_loc = derive_features_from_location(float(lat), float(lon))
+                scored = _score_grid_time(bundle, grid_id, hour, month, dow, feats_loc)
+
+        return {
+            "grid_id": int(grid_id),
+            "used_row": scored["used_row"],
+            "time_used": {"hour_of_day": int(hour), "month": int(month), "day_of_week": int(dow)},
+            "prediction": scored["prediction"],
+            "model_version": bundle.version,
+        }
+    except HTTPException:
+        raise
+    except Exception as ex:
+        tb = traceback.format_exc()
+        raise HTTPException(status_code=500, detail={"error": str(ex), "trace": tb})
+
+# Longest series /predict_timeline will return, in hours
+MAX_TIMELINE_HOURS = int(os.getenv("MAX_TIMELINE_HOURS", "168"))
+# Ordering used to find the peak hour; labels not listed rank below Low
+RISK_SEVERITY = {"Low": 0, "Medium": 1, "High": 2}
 
-        # Ensure Hour is datetime
-        if not np.issubdtype(df_grid["Hour"].dtype, np.datetime64):
-            try:
-                df_grid = df_grid.assign(Hour=pd.to_datetime(df_grid["Hour"]))
-            except Exception:
-                pass
 
-        # Filter by month and hour
-        df_sel = df_grid[(df_grid["Hour"].dt.month == int(month)) & (df_grid["Hour"].dt.hour == int(hour))]
-        if df_sel.empty:
-            # Fallback: just first row of this grid
-            df_sel = df_grid.head(1)
+def _timeline_rows(index, grid_pos, abs_hours):
+    """(G*T, 9) model rows for every grid x hour, plus the (G, T) exact-match mask.
 
-        row = df_sel.iloc[0]
+    Dataset gaps are filled with the same defaults as _score_grid_time; time features
+    come from the requested hours, not from the row that was selected.
+    """
+    with metrics.stage("dataset_select"):
+        rows, exact = index.rows_at(grid_pos, abs_hours)
+        feats = index.features[rows.ravel()]
+    with metrics.stage("feature_assembly"):
+        defaults = np.array([210.0, 0.5, 5.0, np.nan, 0.8, 0.4])
+        feats = np.where(np.isnan(feats), defaults, feats)
+        # Rain_Past3h falls back to Rain_mm
+        feats[:, 3] = np.where(np.isnan(feats[:, 3]), feats[:, 2], feats[:, 3])
+        hod, month, dow = time_columns(abs_hours)
+        n_grids = len(grid_pos)
+        time_feats = np.column_stack([np.tile(hod, n_grids), np.tile(month, n_grids), np.tile(dow, n_grids)]).astype(float)
+        return np.concatenate([feats, time_feats], axis=1), exact
+
+
+@app.post("/predict_timeline")
+def predict_timeline(payload: TimelineRequest):
+    """Hourly risk series for one or many grids, scored in a single model call.
+
+    Request JSON:
+    {"grid_ids": [101, 102], "start": "2025-07-01T00:00:00", "hours": 72}
+    {"points": [[28.61, 77.20], [28.63, 77.22]], "hours": 24}   // e.g. points along a route
 
-        # Build input features: prefer dataset values when present; otherwise fallback to simple heuristics
-        def val_or_default(name, default):
-            v = row.get(name)
+    Response (columnar; class/confidence are one list per grid, one entry per hour):
+    {"hours": [...], "labels": ["High", "Low", "Medium"], "grid_ids": [...],
+     "class": [[...]], "confidence": [[...]], "peak": {"hour": [...], "class": [...], "confidence": [...]},
+     "exact_hours": [...], "model_version": "..."}
+
+    Each hour uses the dataset row with that exact timestamp when present, otherwise the
+    same (month, hour-of-day) bucket as /predict_location_time. The peak is the first hour
+    with the most severe class, ties broken by confidence.
+    """
+    if not 1 <= payload.hours <= MAX_TIMELINE_HOURS:
+        raise HTTPException(status_code=400, detail=f"hours must be between 1 and {MAX_TIMELINE_HOURS}")
+    if not payload.grid_ids and not payload.points:
+        raise HTTPException(status_code=400, detail="Provide grid_ids and/or points")
+    try:
+        start = nowcast.to_hours([payload.start or datetime.datetime.now()])[0]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid start timestamp format")
+
+    try:
+        requested = list(payload.grid_ids or [])
+        point_grid_ids = None
+        if payload.points:
+            if not grid_index_available():
+                raise HTTPException(status_code=400, detail="Grid geometry index not available on server for spatial lookup. Provide grid_ids directly or add dataset/grid_index.geojson")
+            with metrics.stage("grid_lookup"):
+                point_grid_ids = [lookup_grid_id(float(lat), float(lon)) for lat, lon in payload.points]  # type: ignore
+            requested += [g for g in point_grid_ids if g is not None]
+
+        with BUNDLES.acquire() as bundle:
+            index = bundle.index
+            if index is None:
+                raise HTTPException(status_code=500, detail="Dataset not available on server")
+            # keep first occurrence order so a route reads start to end
+            ids = np.array(list(dict.fromkeys(int(g) for g in requested)), dtype=np.int64)
+            pos = np.array([-1 if p is None else p for p in map(index.grid_position, ids)], dtype=np.int64)
+            unknown = ids[pos < 0].tolist()
+            ids, pos = ids[pos >= 0], pos[pos >= 0]
+            if len(ids) == 0:
+                raise HTTPException(status_code=404, detail="No dataset rows for the requested grids")
+
+            abs_hours = start + np.arange(payload.hours, dtype=np.int64)
+            X, exact = _timeline_rows(index, pos, abs_hours)
+            classes, probs, labels = predict_arrays(X, bundle)
+            label_names = [str(c) for c in bundle.le.classes_]
+
+        shape = (len(ids), payload.hours)
+        classes = np.asarray(classes, dtype=np.int64).reshape(shape)
+        conf = np.round(np.asarray(probs, dtype=float) * 100, 2).reshape(shape)
+        severity = np.array([RISK_SEVERITY.get(name, -1) for name in label_names])[classes]
+        peak = np.argmax(severity * 1000 + conf, axis=1)
+        rows = np.arange(len(ids))
+
+        result = {
+            "start": str(np.datetime64(int(start) * NS_PER_HOUR, "ns").astype("datetime64[s]")),
+            "hours": [str(h) for h in (abs_hours * NS_PER_HOUR).astype("datetime64[ns]").astype("datetime64[s]")],
+            "labels": label_names,
+            "grid_ids": ids.tolist(),
+            "class": classes.tolist(),
+            "confidence": conf.tolist(),
+            "peak": {
+                "hour": [str(h) for h in (abs_hours[peak] * NS_PER_HOUR).astype("datetime64[ns]").astype("datetime64[s]")],
+                "class": classes[rows, peak].tolist(),
+                "confidence": conf[rows, peak].tolist(),
+            },
+            "exact_hours": exact.sum(axis=1).tolist(),
+            "unknown_grid_ids": unknown,
+            "model_version": bundle.version,
+        }
+        if point_grid_ids is not None:
+            result["point_grid_ids"] = point_grid_ids
+        return result
+    except HTTPException:
+        raise
+    except Exception as ex:
+        tb = traceback.format_exc()
+        raise HTTPException(status_code=500, detail={"error": str(ex), "trace": tb})
+
+
+@app.post("/nowcast/ingest")
+def nowcast_ingest(tick: NowcastTick):
+    """Apply streaming rain/sensor observations and rescore only the grids they touch.
+
+    Request JSON (columnar, null = not reported):
+    {"grid_ids": [12, 13], "timestamp": "2025-07-01T14:00:00",
+     "rain_mm": [4.2, null], "drain_water_level": [1.1, 0.9], "soil_moisture": null}
+
+    Response: counts of accepted/rejected updates, number of grids rescored and the
+    Grid_IDs whose risk class changed.
+    """
+    store = NOWCAST
+    if store is None:
+        raise HTTPException(status_code=500, detail="Dataset not available on server")
+    n = len(tick.grid_ids)
+    for name in ("timestamps", "rain_mm", "drain_water_level", "soil_moisture"):
+        values = getattr(tick, name)
+        if values is not None and len(values) != n:
+            raise HTTPException(status_code=400, detail=f"'{name}' must have one entry per grid_id ({n})")
+    try:
+        if tick.timestamps is not None:
+            hours = nowcast.to_hours(tick.timestamps)
+        else:
+            hours = nowcast.to_hours([tick.timestamp or datetime.datetime.now()])[0]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid timestamp format")
+
+    try:
+        with metrics.stage("nowcast_ingest"):
+            stats = store.ingest(
+                tick.grid_ids, hours,
+                rain_mm=None if tick.rain_mm is None else np.array(tick.rain_mm, dtype=float),
+                drain_level=None if tick.drain_water_level is None else np.array(tick.drain_water_level, dtype=float),
+                soil_moisture=None if tick.soil_moisture is None else np.array(tick.soil_moisture, dtype=float),
+            )
+        result = {**stats, "rescored": 0, "changed_grid_ids": []}
+        if tick.rescore:
+            with BUNDLES.acquire() as bundle:
+                scored = store.rescore(lambda rows: predict_arrays(rows, bundle))
+            # live risk overrides the dataset forecast on tiles/regions for the hours just scored
+            for h in scored.pop("scored_hours"):
+                _invalidate_hour(bundle.version, h)
+            result.update(scored)
+            result["model_version"] = bundle.version
+            if scored.get("changed_grid_ids") and RISK_STREAM.subscribers:
+                _publish_risk()
+        return result
+    except HTTPException:
+        raise
+    except Exception as ex:
+        tb = traceback.format_exc()
+        raise HTTPException(status_code=500, detail={"error": str(ex), "trace": tb})
+
+
+@app.get("/nowcast/risk")
+def nowcast_risk(grid_ids: Optional[str] = None):
+    """Live risk from ingested observations, columnar.
+
+    grid_ids: optional comma-separated Grid_IDs; defaults to every grid with observations.
+    Entries marked stale have observations newer than their last score (ingested with rescore=false).
+    """
+    store = NOWCAST
+    if store is None:
+        raise HTTPException(status_code=500, detail="Dataset not available on server")
+    ids = None
+    if grid_ids:
+        try:
+            ids = [int(g) for g in grid_ids.split(",") if g.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="grid_ids must be comma-separated integers")
+    return {"ticks": store.ticks, **store.snapshot(ids)}
+
+
+# --- City-wide risk per hour (tiles, regions) ---
+def _hour_labels(bundle, hour):
+    """Risk label per grid in bundle.index.grid_ids order for one hour.
+
+    The dataset forecast (same row selection as /predict_timeline), overridden by live
+    nowcast risk for grids scored at that hour. Cached until the hour is invalidated.
+    """
+    def compute():
+        index = bundle.index
+        labels = np.full(len(index.grid_ids), "", dtype=object)
+        if len(index.grid_ids):
+            X, _ = _timeline_rows(index, np.arange(len(index.grid_ids)), np.array([hour], dtype=np.int64))
+            labels[:] = predict_arrays(X, bundle)[2]
+        store = NOWCAST
+        if store is not None:
+            p = store.positions(index.grid_ids)
+            live = p >= 0
+            live[live] = store.scored_hour[p[live]] == hour
+            labels[live] = store.risk_label[p[live]]
+        return labels
+
+    # the generation is read before compute() reads NOWCAST: a result computed from the state
+    # before an invalidation is stored under the old generation, which nobody asks for again
+    key = ("hour_labels", bundle.version, int(hour), _hour_generation(bundle.version, hour))
+    return PREDICTION_CACHE.get_or_compute(key, compute)
+
+
+def _labels_for(bundle, hour, grid_ids):
+    """_hour_labels re-ordered to grid_ids; "" for grids not in the dataset."""
+    index = bundle.index
+    labels = _hour_labels(bundle, hour)
+    out = np.full(len(grid_ids), "", dtype=object)
+    if len(index.grid_ids):
+        pos = np.clip(np.searchsorted(index.grid_ids, grid_ids), 0, len(index.grid_ids) - 1)
+        known = index.grid_ids[pos] == grid_ids
+        out[known] = labels[pos[known]]
+    return out
+
+
+def _hour_key(hour) -> str:
+    return str(np.datetime64(int(hour) * NS_PER_HOUR, "ns").astype("datetime64[h]"))
+
+
+def _hour_iso(hour) -> str:
+    return str(np.datetime64(int(hour) * NS_PER_HOUR, "ns").astype("datetime64[s]"))
+
+
+# Generation of each (version, hour)'s city-wide risk, part of every cache key derived from it;
+# _invalidate_hour bumps it so computations still in flight cannot repopulate the current key
+_HOUR_GENERATION: Dict[tuple, int] = {}
+_HOUR_GENERATION_LOCK = threading.Lock()
+
+
+def _hour_generation(version, hour) -> int:
+    return _HOUR_GENERATION.get((version, int(hour)), 0)
+
+
+def _invalidate_hour(version, hour):
+    """Forget everything derived from one hour's city-wide risk."""
+    with _HOUR_GENERATION_LOCK:
+        gen = _hour_generation(version, hour)
+        _HOUR_GENERATION[(version, int(hour))] = gen + 1
+        # under the lock, so no tile of the old generation is written after the directory is moved away
+        TILE_CACHE.invalidate_hour(version, _hour_key(hour))
+    PREDICTION_CACHE.discard(("hour_labels", version, int(hour), gen))
+    PREDICTION_CACHE.discard(("hierarchy_risk", version, int(hour), gen))
+
+
+# --- Risk map tiles ---
+# Zoom levels pre-rendered for the current hour at startup, e.g. "10-13" (empty disables)
+TILE_PREWARM_ZOOMS = os.getenv("TILE_PREWARM_ZOOMS", "")
+# Upper bound on tiles rendered by one prewarm run
+MAX_PREWARM_TILES = int(os.getenv("MAX_PREWARM_TILES", "20000"))
+_TILE_RENDERER = None
+
+
+def _tile_renderer():
+    global _TILE_RENDERER
+    if _TILE_RENDERER is None:
+        _TILE_RENDERER = tiles.from_grid_index()
+    return _TILE_RENDERER
+
+
+def _render_tile(bundle, renderer, hour, z, x, y) -> bytes:
+    gen = _hour_generation(bundle.version, hour)
+    colors = tiles.colors_for_labels(_labels_for(bundle, hour, renderer.grid_ids))
+    with metrics.stage("tile_render"):
+        png = renderer.render(z, x, y, colors) or tiles.empty_png()
+    # a tile rendered from labels the hour has since invalidated must not land in its fresh directory
+    with _HOUR_GENERATION_LOCK:
+        if _hour_generation(bundle.version, hour) == gen:
+            TILE_CACHE.put(bundle.version, _hour_key(hour), z, x, y, png)
+    return png
+
+
+def _parse_zooms(spec: str) -> List[int]:
+    """Zoom levels from a spec such as "10-13" or "10,12"."""
+    zooms = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        zooms += range(int(lo), int(hi or lo) + 1)
+    if any(z < 0 or z > tiles.MAX_ZOOM for z in zooms):
+        raise ValueError(f"zoom levels must be between 0 and {tiles.MAX_ZOOM}")
+    return sorted(set(zooms))
+
+
+def _prewarm_tiles(hour, zooms) -> int:
+    """Render every tile over the grid extent at the given zooms in a background thread.
+
+    Stops early if the model version changes mid-run. Returns the number of tiles queued.
+    """
+    renderer = _tile_renderer()
+    if renderer is None or renderer.bounds is None:
+        return 0
+    jobs = [(z, x, y) for z in zooms for x, y in tiles.tiles_covering(z, renderer.bounds)][:MAX_PREWARM_TILES]
+    version = BUNDLES.current().version
+
+    def run():
+        t0 = time.perf_counter()
+        done = 0
+        for z, x, y in jobs:
+            with BUNDLES.acquire() as bundle:
+                if bundle.version != version or bundle.index is None:
+                    break
+                if not os.path.exists(TILE_CACHE.path(version, _hour_key(hour), z, x, y)):
+                    _render_tile(bundle, renderer, hour, z, x, y)
+                done += 1
+        print(f"[TILES] Prewarmed {done}/{len(jobs)} tiles for {_hour_key(hour)} in {time.perf_counter() - t0:.1f}s")
+
+    threading.Thread(target=run, name="tile-prewarm", daemon=True).start()
+    return len(jobs)
+
+
+@app.get("/tiles/{z}/{x}/{y}.png")
+def risk_tile(z: int, x: int, y: int, hour: Optional[str] = None):
+    """XYZ PNG tile of per-grid flood risk for one hour (default: the current hour).
+
+    Uses the same per-hour dataset selection as /predict_timeline; grids with live
+    nowcast scores for that hour show those instead. Tiles are cached on disk per
+    model version and hour, so repeat requests are served as static files.
+    """
+    if not tiles.valid_tile(z, x, y):
+        raise HTTPException(status_code=400, detail="Invalid tile coordinates")
+    try:
+        h = nowcast.to_hours([hour or datetime.datetime.now()])[0]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid hour format")
+    headers = {"Cache-Control": "public, max-age=60"}
+
+    with BUNDLES.acquire() as bundle:
+        cached = TILE_CACHE.get(bundle.version, _hour_key(h), z, x, y)
+        if cached is not None:
+            return Response(cached, media_type="image/png", headers={**headers, "X-Tile-Cache": "hit"})
+        renderer = _tile_renderer()
+        if renderer is None:
+            raise HTTPException(status_code=400, detail="Grid geometry index not available on server. Add dataset/grid_index.geojson")
+        if bundle.index is None:
+            raise HTTPException(status_code=500, detail="Dataset not available on server")
+        try:
+            png = _render_tile(bundle, renderer, h, z, x, y)
+        except Exception as ex:
+            tb = traceback.format_exc()
+            raise HTTPException(status_code=500, detail={"error": str(ex), "trace": tb})
+    return Response(png, media_type="image/png", headers={**headers, "X-Tile-Cache": "miss"})
+
+
+@app.post("/admin/tiles/prewarm")
+def admin_prewarm_tiles(request: Request, zooms: str = "10-13", hour: Optional[str] = None):
+    """Pre-render tiles over the whole grid for one hour (default: current) at the given zooms."""
+    _require_admin(request)
+    try:
+        zoom_list = _parse_zooms(zooms)
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+    try:
+        h = nowcast.to_hours([hour or datetime.datetime.now()])[0]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid hour format")
+    queued = _prewarm_tiles(h, zoom_list)
+    return {"hour": _hour_iso(h), "zooms": zoom_list, "queued": queued, "model_version": BUNDLES.current().version}
+
+
+@app.post("/admin/detections/compact")
+def admin_compact_detections(request: Request):
+    """Move the detection write-ahead log into parquet partitions now instead of at the next interval."""
+    _require_admin(request)
+    log = detection_log.shared()
+    moved = log.compact()
+    return {"compacted_records": moved, **log.stats()}
+
+
+@app.post("/admin/profile/start")
+def admin_profile_start(payload: ProfileRequest, request: Request):
+    """Start a bounded sampling-profiler (and optionally tracemalloc) session in this worker.
+
+    Request JSON: {"routes": ["/predict_location_time"], "seconds": 30, "interval_ms": 5, "memory": true}
+    Read the result with POST /admin/profile/stop (ends it early) or GET /admin/profile once it has
+    finished; GET /admin/profile/collapsed returns the flamegraph input as text.
+    """
+    _require_admin(request)
+    if not 0 < payload.seconds <= profiling.MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {profiling.MAX_SECONDS}]")
+    if not 1 <= payload.interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    try:
+        endpoints = profiling.endpoint_codes(app.routes, payload.routes or [])
+        session = profiling.start(endpoints, payload.seconds, payload.interval_ms / 1000.0, payload.memory, max(1, payload.top))
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+    except RuntimeError as ex:
+        raise HTTPException(status_code=409, detail=str(ex))
+    print(f"[PROFILE] Started for {payload.seconds}s on {payload.routes or 'all threads'} (memory={payload.memory})")
+    return session.status()
+
+
+@app.post("/admin/profile/stop")
+def admin_profile_stop(request: Request):
+    """Stop the running session (or return the last one) with its samples and allocation sites."""
+    _require_admin(request)
+    session = profiling.current()
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return session.stop()
+
+
+@app.get("/admin/profile")
+def admin_profile(request: Request):
+    """Progress of the running session, or the result of the last one."""
+    _require_admin(request)
+    session = profiling.current()
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return session.status() if session.running else session.stop()
+
+
+@app.get("/admin/profile/collapsed")
+def admin_profile_collapsed(request: Request):
+    """Collapsed stacks ("frame;frame;frame count" lines) for flamegraph.pl or speedscope."""
+    _require_admin(request)
+    session = profiling.current()
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return PlainTextResponse(session.collapsed())
+
+
+if TILE_PREWARM_ZOOMS:
+    threading.Thread(
+        target=lambda: _prewarm_tiles(nowcast.to_hours([datetime.datetime.now()])[0], _parse_zooms(TILE_PREWARM_ZOOMS)),
+        name="tile-prewarm-start", daemon=True,
+    ).start()
+
+
+# --- Ward aggregation ---
+_REGION_MAPPING = None
+_REGION_LOCK = threading.Lock()
+
+
+def _region_mapping():
+    """Grid -> ward overlap matrix, built from REGIONS_PATH on first use."""
+    global _REGION_MAPPING
+    with _REGION_LOCK:
+        if _REGION_MAPPING is None and os.path.exists(REGIONS_PATH) and grid_index_available():
             try:
-                if v is None or (isinstance(v, float) and np.isnan(v)):
-                    return default
-                return float(v)
+                from .grid_index import get_grid_gdf  # type: ignore
             except Exception:
-                return default
+                from grid_index import get_grid_gdf  # type: ignore
+            _REGION_MAPPING = regions.load_or_build(REGIONS_PATH, REGIONS_MAPPING_PATH, get_grid_gdf())
+        return _REGION_MAPPING
 
-        # If lat/lon were provided, use heuristic derivation for elevation/road density when dataset has NaN
-        if lat is not None and lon is not None:
-            feats_loc = derive_features_from_location(float(lat), float(lon))
-        else:
-            feats_loc = None
 
-        Elevation = val_or_default("Elevation", feats_loc["Elevation"] if feats_loc else 210.0)
-        Road_Density = val_or_default("Road_Density", feats_loc["Road_Density"] if feats_loc else 0.5)
-        Rain_mm = val_or_default("Rain_mm", feats_loc["Rain_mm"] if feats_loc else 5.0)
-        Rain_Past3h = val_or_default("Rain_Past3h", feats_loc["Rain_Past3h"] if feats_loc else Rain_mm)
-        Drain_Water_Level = val_or_default("Drain_Water_Level", feats_loc["Drain_Water_Level"] if feats_loc else 0.8)
-        Soil_Moisture = val_or_default("Soil_Moisture", feats_loc["Soil_Moisture"] if feats_loc else 0.4)
+@app.get("/regions/risk")
+def region_risk(hour: Optional[str] = None, region_ids: Optional[str] = None):
+    """Per-ward risk summary for one hour (default: the current hour), columnar.
+
+    region_ids: optional comma-separated ward ids to return.
+    Cells split across wards count towards each ward by the area they have there.
+    max_label is the most severe class of any cell touching the ward; high_share is
+    the area-weighted share of High among scored cells.
+    """
+    try:
+        h = nowcast.to_hours([hour or datetime.datetime.now()])[0]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid hour format")
+    try:
+        mapping = _region_mapping()
+        if mapping is None:
+            raise HTTPException(status_code=400, detail="Ward polygons or grid geometry not available on server. Add dataset/wards.geojson and dataset/grid_index.geojson")
+        with BUNDLES.acquire() as bundle:
+            if bundle.index is None:
+                raise HTTPException(status_code=500, detail="Dataset not available on server")
+            labels = _labels_for(bundle, h, mapping.grid_ids)
+        levels = sorted(RISK_SEVERITY, key=RISK_SEVERITY.get)
+        severity = np.array([RISK_SEVERITY.get(label, -1) for label in labels], dtype=np.int64)
+        with metrics.stage("region_aggregate"):
+            summary = regions.severity_columns(mapping.summarize(severity, high=RISK_SEVERITY["High"], at_risk=RISK_SEVERITY["Medium"]), levels)
+        rows = np.arange(mapping.n_regions)
+        if region_ids:
+            wanted = {r.strip() for r in region_ids.split(",") if r.strip()}
+            rows = np.array([i for i, r in enumerate(mapping.region_ids) if r in wanted], dtype=np.int64)
+        return {
+            "hour": _hour_iso(h),
+            "region_id": [mapping.region_ids[i] for i in rows],
+            "region_name": [mapping.region_names[i] for i in rows],
+            **{k: [v[i] for i in rows] for k, v in summary.items()},
+            "model_version": bundle.version,
+        }
+    except HTTPException:
+        raise
+    except Exception as ex:
+        tb = traceback.format_exc()
+        raise HTTPException(status_code=500, detail={"error": str(ex), "trace": tb})
+
+
+# --- Multi-resolution grid ---
+# Upper bound on cells returned by /grid/cells; the level is coarsened until the bbox fits
+GRID_MAX_CELLS = int(os.getenv("GRID_MAX_CELLS", "2000"))
+_GRID_HIERARCHY = None
 
-        # Build model array and predict
-        arr = np.array([[
-            Elevation, Road_Density, Rain_mm, Rain_Past3h, Drain_Water_Level, Soil_Moisture,
-            int(hour), int(month), int(dow)
-        ]])
-        results = transform_and_predict(arr)
 
+def _grid_hierarchy():
+    global _GRID_HIERARCHY
+    if _GRID_HIERARCHY is None and grid_index_available():
+        try:
+            from .grid_index import get_grid_gdf  # type: ignore
+        except Exception:
+            from grid_index import get_grid_gdf  # type: ignore
+        _GRID_HIERARCHY = grid_hierarchy.from_grid_gdf(get_grid_gdf())
+    return _GRID_HIERARCHY
+
+
+def _grid_centroids(grid_ids):
+    """(lon, lat) of the base cell of each sorted Grid_ID (NaN without geometry), or None without a grid index."""
+    hier = _grid_hierarchy()
+    if hier is None:
+        return None
+    b = hier.levels[0].bounds
+    lon = np.full(len(grid_ids), np.nan)
+    lat = np.full(len(grid_ids), np.nan)
+    if len(hier.grid_ids):
+        pos = np.clip(np.searchsorted(hier.grid_ids, grid_ids), 0, len(hier.grid_ids) - 1)
+        known = hier.grid_ids[pos] == grid_ids
+        lon[known] = (b[pos[known], 0] + b[pos[known], 2]) / 2
+        lat[known] = (b[pos[known], 1] + b[pos[known], 3]) / 2
+    return lon, lat
+
+
+def _hierarchy_static(bundle, hier):
+    """Per level: (mean Elevation, total Road_Density) of the base cells in each cell."""
+    def compute():
+        index = bundle.index
+        static = np.full((len(hier.grid_ids), 2), np.nan)
+        if len(index.grid_ids):
+            pos = np.clip(np.searchsorted(index.grid_ids, hier.grid_ids), 0, len(index.grid_ids) - 1)
+            known = index.grid_ids[pos] == hier.grid_ids
+            static[known] = index.features[index.starts[pos[known]]][:, :2]
+        return [(hier.aggregate(k, static[:, 0], "mean"), hier.aggregate(k, static[:, 1], "sum")) for k in range(hier.n_levels)]
+
+    return PREDICTION_CACHE.get_or_compute(("hierarchy_static", bundle.version), compute)
+
+
+def _hierarchy_risk(bundle, hier, hour):
+    def compute():
+        labels = _labels_for(bundle, hour, hier.grid_ids)
+        severity = np.array([RISK_SEVERITY.get(label, -1) for label in labels], dtype=np.int64)
+        return [hier.aggregate_risk(k, severity, high=RISK_SEVERITY["High"]) for k in range(hier.n_levels)]
+
+    key = ("hierarchy_risk", bundle.version, int(hour), _hour_generation(bundle.version, hour))
+    return PREDICTION_CACHE.get_or_compute(key, compute)
+
+
+@app.get("/grid/cells")
+def grid_cells(bbox: Optional[str] = None, zoom: Optional[float] = None, hour: Optional[str] = None,
+               max_cells: int = GRID_MAX_CELLS, parent: Optional[int] = None):
+    """Grid cells with aggregated features and risk at a level chosen for the view, columnar.
+
+    bbox: "minx,miny,maxx,maxy" in lon/lat (default: whole city). zoom: web map zoom; the
+    level is never finer than cells ~4 px wide at that zoom. The finest remaining level with
+    at most max_cells cells in the bbox is used. parent: return the children of one cell
+    instead (ids from a coarser response).
+
+    Level 0 cells are the dataset's Grid_IDs; coarser cells have stable lattice ids, see
+    grid_hierarchy. max_label / high_share summarise the base cells for the hour.
+    """
+    try:
+        view = [float(v) for v in bbox.split(",")] if bbox else None
+    except ValueError:
+        view = []
+    if view is not None and len(view) != 4:
+        raise HTTPException(status_code=400, detail="bbox must be minx,miny,maxx,maxy")
+    if not 1 <= max_cells <= 10 * GRID_MAX_CELLS:
+        raise HTTPException(status_code=400, detail=f"max_cells must be between 1 and {10 * GRID_MAX_CELLS}")
+    try:
+        h = nowcast.to_hours([hour or datetime.datetime.now()])[0]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid hour format")
+
+    try:
+        hier = _grid_hierarchy()
+        if hier is None:
+            raise HTTPException(status_code=400, detail="Grid geometry index not available on server. Add dataset/grid_index.geojson")
+        if parent is not None:
+            try:
+                level, pos = hier.children(parent)
+            except KeyError:
+                raise HTTPException(status_code=404, detail=f"Unknown parent cell {parent}")
+        else:
+            min_level = hier.level_for_zoom(zoom) if zoom is not None else 0
+            level = hier.level_for(view, max_cells, min_level=min_level)
+            pos = hier.in_bbox(level, view)[:max_cells]
+
+        with BUNDLES.acquire() as bundle:
+            if bundle.index is None:
+                raise HTTPException(status_code=500, detail="Dataset not available on server")
+            elevation, road_density = _hierarchy_static(bundle, hier)[level]
+            risk = _hierarchy_risk(bundle, hier, h)[level]
+
+        lv = hier.levels[level]
+        levels = np.array([None] + sorted(RISK_SEVERITY, key=RISK_SEVERITY.get), dtype=object)
+        parents = hier.parent_ids(level, pos)
         return {
-            "grid_id": int(grid_id),
-            "used_row": {
-                "Hour": row["Hour"].isoformat() if hasattr(row["Hour"], "isoformat") else str(row["Hour"]),
-                "Elevation": Elevation,
-                "Road_Density": Road_Density,
-                "Rain_mm": Rain_mm,
-                "Rain_Past3h": Rain_Past3h,
-                "Drain_Water_Level": Drain_Water_Level,
-                "Soil_Moisture": Soil_Moisture,
-            },
-            "time_used": {"hour_of_day": int(hour), "month": int(month), "day_of_week": int(dow)},
-            "prediction": results[0] if results else None,
+            "level": level,
+            "levels": hier.n_levels,
+            "hour": _hour_iso(h),
+            "cell_id": lv.ids[pos].tolist(),
+            "parent_id": parents.tolist() if parents is not None else None,
+            "bounds": np.round(lv.bounds[pos], 6).tolist(),
+            "base_cells": lv.counts[pos].tolist(),
+            "elevation_mean": [None if np.isnan(v) else round(float(v), 2) for v in elevation[pos]],
+            "road_density": [None if np.isnan(v) else round(float(v), 2) for v in road_density[pos]],
+            "max_label": levels[risk["max_severity"][pos] + 1].tolist(),
+            "high_share": [None if np.isnan(v) else round(float(v), 4) for v in risk["high_share"][pos]],
+            "model_version": bundle.version,
         }
     except HTTPException:
         raise
@@ -480,21 +1366,324 @@ def predict_location_time(payload: LocationTimeRequest):
         tb = traceback.format_exc()
         raise HTTPException(status_code=500, detail={"error": str(ex), "trace": tb})
 
+
+# --- Rainfall scenarios ---
+# Upper bound on grid x hour cells scored by one /scenario/rainfall request
+MAX_SCENARIO_CELLS = int(os.getenv("MAX_SCENARIO_CELLS", "2000000"))
+
+
+def _scenario_totals(payload, grid_ids):
+    """Per-grid rainfall total (mm over the window) for the scenario's rainfall source."""
+    sources = [payload.total_mm is not None, payload.ward_mm is not None, payload.field is not None]
+    if sum(sources) != 1:
+        raise HTTPException(status_code=400, detail="Provide exactly one of total_mm, ward_mm or field")
+    if payload.total_mm is not None:
+        if payload.total_mm < 0:
+            raise HTTPException(status_code=400, detail="total_mm must be non-negative")
+        return np.full(len(grid_ids), float(payload.total_mm))
+    if payload.ward_mm is not None:
+        mapping = _region_mapping()
+        if mapping is None:
+            raise HTTPException(status_code=400, detail="Ward polygons or grid geometry not available on server. Add dataset/wards.geojson and dataset/grid_index.geojson")
+        if any(v < 0 for v in payload.ward_mm.values()):
+            raise HTTPException(status_code=400, detail="ward_mm values must be non-negative")
+        try:
+            return scenarios.ward_totals(mapping, grid_ids, payload.ward_mm, payload.default_mm)
+        except ValueError as ex:
+            raise HTTPException(status_code=400, detail=str(ex))
+    centroids = _grid_centroids(grid_ids)
+    if centroids is None:
+        raise HTTPException(status_code=400, detail="Grid geometry index not available on server. Add dataset/grid_index.geojson")
+    lon, lat = centroids
+    try:
+        # grids without geometry compare False everywhere and get default_mm
+        return scenarios.field_totals(lon, lat, payload.field.bbox, payload.field.values, payload.default_mm)
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+
+
+@app.post("/scenario/rainfall")
+def scenario_rainfall(payload: ScenarioRequest):
+    """What-if risk for every grid under a hypothetical storm, scored in one model call.
+
+    Request JSON (one rainfall source):
+    {"total_mm": 80, "hours": 3, "start": "2025-07-01T14:00:00", "profile": [1, 2, 1]}
+    {"ward_mm": {"12": 120, "13": 60}, "default_mm": 10, "hours": 6}
+    {"field": {"bbox": [76.8, 28.4, 77.4, 28.9], "values": [[40, 60], [20, 90]]}, "include_grid": true}
+
+    Totals are spread over the hours by profile and replace Rain_mm; Rain_Past3h is the
+    scenario rain of the hour and the two before it. Other features come from the dataset
+    selection /predict_timeline uses, unless drain_water_level / soil_moisture are given.
+
+    Response: per-hour class counts (one column per label), High share and the hour with
+    most High grids, the number of grids whose worst hour reaches each label, a per-ward
+    summary when ward polygons are available, and with include_grid the (grids x hours)
+    class index and confidence as base64 uint8 arrays in grid-major order.
+    """
+    if not 1 <= payload.hours <= MAX_TIMELINE_HOURS:
+        raise HTTPException(status_code=400, detail=f"hours must be between 1 and {MAX_TIMELINE_HOURS}")
+    try:
+        weights = scenarios.hourly_weights(payload.hours, payload.profile)
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+    try:
+        start = nowcast.to_hours([payload.start or datetime.datetime.now()])[0]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid start timestamp format")
+
+    try:
+        with BUNDLES.acquire() as bundle:
+            index = bundle.index
+            if index is None:
+                raise HTTPException(status_code=500, detail="Dataset not available on server")
+            grid_ids = index.grid_ids
+            n_grids = len(grid_ids)
+            if n_grids * payload.hours > MAX_SCENARIO_CELLS:
+                raise HTTPException(status_code=400, detail=f"{n_grids} grids x {payload.hours} hours exceeds MAX_SCENARIO_CELLS ({MAX_SCENARIO_CELLS})")
+
+            with metrics.stage("scenario_rain"):
+                totals = _scenario_totals(payload, grid_ids)
+                rain, past3 = scenarios.rain_series(totals, weights)
+            abs_hours = start + np.arange(payload.hours, dtype=np.int64)
+            X, _ = _timeline_rows(index, np.arange(n_grids), abs_hours)
+            X[:, 2] = rain.ravel()
+            X[:, 3] = past3.ravel()
+            if payload.drain_water_level is not None:
+                X[:, 4] = payload.drain_water_level
+            if payload.soil_moisture is not None:
+                X[:, 5] = payload.soil_moisture
+            classes, probs, labels = predict_arrays(X, bundle)
+            label_names = [str(c) for c in bundle.le.classes_]
+
+        shape = (n_grids, payload.hours)
+        classes = np.asarray(classes, dtype=np.int64).reshape(shape)
+        with metrics.stage("scenario_summary"):
+            summary, worst = scenarios.summarize(classes, label_names, RISK_SEVERITY)
+            result = {
+                "start": _hour_iso(start),
+                "hours": [_hour_iso(h) for h in abs_hours],
+                "labels": label_names,
+                "grids": n_grids,
+                "rain_total_mm": {
+                    "mean": round(float(totals.mean()), 3) if n_grids else None,
+                    "max": round(float(totals.max()), 3) if n_grids else None,
+                },
+                **summary,
+                "model_version": bundle.version,
+            }
+            if summary["peak_hour_index"] is not None:
+                result["peak_hour"] = result["hours"][summary["peak_hour_index"]]
+            mapping = _region_mapping()
+            if mapping is not None:
+                pos = mapping.align(grid_ids)
+                severity = np.where(pos >= 0, worst[np.maximum(pos, 0)], -1) if n_grids else np.full(len(pos), -1)
+                levels = sorted(RISK_SEVERITY, key=RISK_SEVERITY.get)
+                ward = regions.severity_columns(mapping.summarize(severity, high=RISK_SEVERITY["High"], at_risk=RISK_SEVERITY["Medium"]), levels)
+                result["wards"] = {"region_id": mapping.region_ids, "region_name": mapping.region_names, **ward}
+            if payload.include_grid:
+                conf = np.asarray(probs, dtype=float).reshape(shape) * 100
+                result["grid"] = scenarios.encode_grid(grid_ids, classes, conf)
+        return result
+    except HTTPException:
+        raise
+    except Exception as ex:
+        tb = traceback.format_exc()
+        raise HTTPException(status_code=500, detail={"error": str(ex), "trace": tb})
+
+
+# --- Analytics queries ---
+# Parquet file or directory (month=YYYY-MM partitions from `analytics.py partition`) queried by /analytics
+ANALYTICS_DATA_PATH = os.getenv("ANALYTICS_DATA_PATH", DATA_PATH)
+
+
+@app.get("/analytics/queries")
+def analytics_queries():
+    """The vetted queries accepted by POST /analytics/query/{name}, with their parameters."""
+    return {"queries": analytics.catalog(), "max_rows": analytics.MAX_ROWS}
+
+
+@app.post("/analytics/query/{name}")
+def analytics_query(name: str, payload: AnalyticsQuery):
+    """Run a vetted DuckDB query over the dataset files and stream the result as NDJSON.
+
+    Only the partitions and row groups matching the Hour range and Grid_IDs are scanned;
+    the dataset is never loaded into this process. See analytics.py for the line format.
+    """
+    if name not in analytics.QUERIES:
+        raise HTTPException(status_code=404, detail=f"Unknown query '{name}'; see /analytics/queries")
+    try:
+        lines = analytics.run(ANALYTICS_DATA_PATH, name, payload.params)
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+    except analytics.Busy as ex:
+        raise HTTPException(status_code=429, detail=str(ex))
+    except FileNotFoundError as ex:
+        raise HTTPException(status_code=503, detail=str(ex))
+    except Exception as ex:
+        tb = traceback.format_exc()
+        raise HTTPException(status_code=500, detail={"error": str(ex), "trace": tb})
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+
+# --- Live risk push ---
+# Seconds between checks for hour rollover and changed risk while clients are subscribed
+RISK_STREAM_POLL_S = float(os.getenv("RISK_STREAM_POLL_S", "30"))
+# Concurrent /ws/risk connections accepted
+RISK_STREAM_MAX_CLIENTS = int(os.getenv("RISK_STREAM_MAX_CLIENTS", "1000"))
+RISK_STREAM = risk_stream.RiskBroadcaster()
+_RISK_TICKER = None
+_RISK_PUBLISH_LOCK = threading.Lock()
+_RISK_WS_CONNECTIONS = 0  # open /ws/risk sockets, subscribed or not
+_RISK_WS_LOCK = threading.Lock()
+
+
+def _publish_risk():
+    """Push current-hour risk changes to /ws/risk subscribers."""
+    # serialised so concurrent publishes cannot deliver an older diff after a newer one
+    with _RISK_PUBLISH_LOCK, BUNDLES.acquire() as bundle:
+        if bundle.index is None or not bundle.ready:
+            return
+        hour = nowcast.to_hours([datetime.datetime.now()])[0]
+        labels = _hour_labels(bundle, hour)
+        with metrics.stage("risk_stream_publish"):
+            RISK_STREAM.publish(bundle.index.grid_ids, labels, _hour_iso(hour), bundle.version)
+
+
+def _start_risk_ticker():
+    global _RISK_TICKER
+    if _RISK_TICKER is not None or RISK_STREAM_POLL_S <= 0:
+        return
+
+    def loop():
+        while True:
+            time.sleep(RISK_STREAM_POLL_S)
+            if RISK_STREAM.subscribers:
+                try:
+                    _publish_risk()
+                except Exception as ex:
+                    print(f"[STREAM] Publish failed: {ex}")
+
+    _RISK_TICKER = threading.Thread(target=loop, name="risk-stream-ticker", daemon=True)
+    _RISK_TICKER.start()
+
+
+def _subscription_grid_ids(msg) -> np.ndarray:
+    """Grid_IDs of a subscribe message: {"grid_ids": [...]} or {"bbox": [minx, miny, maxx, maxy]} (lon/lat)."""
+    if not isinstance(msg, dict) or ("grid_ids" in msg) == ("bbox" in msg):
+        raise ValueError("Send exactly one of grid_ids or bbox")
+    if "grid_ids" in msg:
+        try:
+            return np.array([int(g) for g in msg["grid_ids"]], dtype=np.int64)
+        except (TypeError, ValueError):
+            raise ValueError("grid_ids must be a list of integers")
+    try:
+        minx, miny, maxx, maxy = (float(v) for v in msg["bbox"])
+    except (TypeError, ValueError):
+        raise ValueError("bbox must be [minx, miny, maxx, maxy]")
+    index = BUNDLES.current().index
+    if index is None:
+        raise ValueError("Dataset not available on server")
+    centroids = _grid_centroids(index.grid_ids)
+    if centroids is None:
+        raise ValueError("Grid geometry index not available on server. Subscribe by grid_ids or add dataset/grid_index.geojson")
+    lon, lat = centroids
+    inside = (lon >= minx) & (lon <= maxx) & (lat >= miny) & (lat <= maxy)
+    return index.grid_ids[inside]
+
+
+@app.websocket("/ws/risk")
+async def risk_ws(websocket: WebSocket):
+    """Current-hour risk pushed as it changes, for the cells a client subscribes to.
+
+    Client -> server (any time; replaces the subscription):
+    {"grid_ids": [101, 102]}   or   {"bbox": [77.0, 28.5, 77.1, 28.6]}   // lon/lat, cells by centroid
+
+    Server -> client (JSON text):
+    {"type": "snapshot", "hour": "...", "grid_ids": [...], "label": [...], "unknown_grid_ids": [...], "model_version": "..."}
+    {"type": "delta", "hour": "...", "grid_ids": [...], "label": [...], "model_version": "..."}   // changed cells only
+    {"type": "hour", "hour": "...", "model_version": "..."}   // rollover, before that hour's deltas
+    {"type": "error", "detail": "..."}
+
+    Risk is the /tiles and /regions/risk view of the hour: the dataset forecast overridden by
+    live nowcast scores. Changes are pushed after nowcast ingests, model swaps and, every
+    RISK_STREAM_POLL_S seconds, when the hour rolls over. A client that falls behind gets a
+    new snapshot instead of the deltas it missed.
+    """
+    global _RISK_WS_CONNECTIONS
+    # the slot is taken before accept() so concurrent handshakes cannot all pass the check
+    with _RISK_WS_LOCK:
+        admitted = _RISK_WS_CONNECTIONS < RISK_STREAM_MAX_CLIENTS
+        if admitted:
+            _RISK_WS_CONNECTIONS += 1
+    if not admitted:
+        await websocket.accept()
+        await websocket.close(code=1013, reason="Too many risk stream clients")
+        return
+    try:
+        await websocket.accept()
+        await _serve_risk_ws(websocket)
+    finally:
+        with _RISK_WS_LOCK:
+            _RISK_WS_CONNECTIONS -= 1
+
+
+async def _serve_risk_ws(websocket: WebSocket):
+    sub = risk_stream.Subscriber(asyncio.get_running_loop())
+    _start_risk_ticker()
+
+    async def receive():
+        while True:
+            text = await websocket.receive_text()
+            try:
+                try:
+                    msg = json.loads(text)
+                except ValueError:
+                    raise ValueError("Messages must be JSON")
+                ids = await run_in_threadpool(_subscription_grid_ids, msg)
+            except ValueError as ex:
+                sub._put(json.dumps({"type": "error", "detail": str(ex)}))
+                continue
+            RISK_STREAM.subscribe(sub, ids)
+            await run_in_threadpool(_publish_risk)
+            sub._put(risk_stream.RESYNC)
+
+    async def send():
+        while True:
+            item = await sub.get()
+            await websocket.send_text(RISK_STREAM.snapshot(sub) if item is risk_stream.RESYNC else item)
+
+    tasks = [asyncio.ensure_future(receive()), asyncio.ensure_future(send())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not isinstance(task.exception(), (WebSocketDisconnect, type(None))):
+                print(f"[STREAM] Connection closed: {task.exception()}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        RISK_STREAM.unsubscribe(sub)
+
+
 # --- Pothole detection endpoint ---
 # Try to load a dedicated pothole model if available, otherwise reuse YOLO model
 POTHOLE_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'model', 'potholes.pt')
 POTHOLE_MODEL = None
+POTHOLE_MODEL_VERSION = None
+_t0 = time.perf_counter()
 try:
     if os.path.exists(POTHOLE_MODEL_PATH):
         POTHOLE_MODEL = YOLO(POTHOLE_MODEL_PATH)
+        POTHOLE_MODEL_VERSION = detection_log.model_version(POTHOLE_MODEL_PATH)
         print(f"[MODEL] Loaded pothole model from {POTHOLE_MODEL_PATH}")
     else:
         # Fallback to general model if specific pothole model not found
         POTHOLE_MODEL = YOLO(MODEL_PATH)
+        POTHOLE_MODEL_VERSION = detection_log.model_version(MODEL_PATH)
         print(f"[MODEL] Pothole model not found, falling back to {MODEL_PATH}")
 except Exception as e:
     POTHOLE_MODEL = None
     print(f"[MODEL] Failed to load pothole model: {e}")
+metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - _t0, artifact="app_pothole")
 
 
 @app.post('/analyze_issue')
@@ -511,19 +1700,21 @@ async def analyze_issue(lat: float = Form(None), lon: float = Form(None), file:
     if POTHOLE_MODEL is None:
         raise HTTPException(status_code=500, detail='Pothole model not available on server')
 
-    # Read file bytes
-    data = await file.read()
+    # The upload is already spooled to a temp file by the form parser; never load it whole
+    uploads.check_size(file, uploads.MAX_IMAGE_BYTES if content_type.startswith('image/') else uploads.MAX_UPLOAD_BYTES)
 
-    # For images - load using cv2.imdecode
+    # For images - decode near the detector input size (see image_io)
     if content_type.startswith('image/'):
-        np_arr = np.frombuffer(data, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        if img is None:
+        try:
+            with metrics.stage("image_decode"):
+                img = image_io.decode(file.file, target=640)
+        except ValueError:
             raise HTTPException(status_code=400, detail='Could not decode image')
 
         # Run inference
         try:
-            results = POTHOLE_MODEL(img)
+            with metrics.stage("yolo_inference"):
+                results = POTHOLE_MODEL(img.bgr, imgsz=640)
         except Exception as e:
             print(f"[ANALYZE] Model inference failed: {e}")
             raise HTTPException(status_code=500, detail='Model inference failed')
@@ -541,25 +1732,23 @@ async def analyze_issue(lat: float = Form(None), lon: float = Form(None), file:
             # Consider 'pothole' label or class id 0 as pothole (fallback)
             if str(label).lower() == 'pothole' or cls == 0:
                 pothole_detected = True
-                x1, y1, x2, y2 = map(float, box.xyxy[0]) if hasattr(box, 'xyxy') else (0,0,0,0)
+                x1, y1, x2, y2 = map(float, img.to_original(box.xyxy[0].cpu().numpy())[0]) if hasattr(box, 'xyxy') else (0,0,0,0)
                 pothole_boxes.append({'bbox': [x1, y1, x2, y2], 'confidence': conf, 'class': cls, 'label': label})
+        detection_log.shared().append("analyze_issue", "ultralytics", POTHOLE_MODEL_VERSION, [b['bbox'] for b in pothole_boxes],
+                                       [b['confidence'] for b in pothole_boxes], img.width, img.height, lat=lat, lon=lon)
 
     else:
         # For videos: save temporarily and analyze first frame
         try:
-            tmp_path = os.path.join(os.path.dirname(__file__), 'temp_upload')
-            os.makedirs(tmp_path, exist_ok=True)
-            tmp_file = os.path.join(tmp_path, file.filename)
-            with open(tmp_file, 'wb') as f:
-                f.write(data)
-            cap = cv2.VideoCapture(tmp_file)
-            ret, frame = cap.read()
-            cap.release()
-            os.remove(tmp_file)
+            with uploads.spooled_path(file) as tmp_file:
+                cap = cv2.VideoCapture(tmp_file)
+                ret, frame = cap.read()
+                cap.release()
             if not ret or frame is None:
                 raise HTTPException(status_code=400, detail='Could not read video frame')
 
-            results = POTHOLE_MODEL(frame)
+            with metrics.stage("yolo_inference"):
+                results = POTHOLE_MODEL(frame)
             detections = results[0].boxes
             pothole_detected = False
             pothole_boxes = []
@@ -572,6 +1761,8 @@ async def analyze_issue(lat: float = Form(None), lon: float = Form(None), file:
                     pothole_detected = True
                     x1, y1, x2, y2 = map(float, box.xyxy[0]) if hasattr(box, 'xyxy') else (0,0,0,0)
                     pothole_boxes.append({'bbox': [x1, y1, x2, y2], 'confidence': conf, 'class': cls, 'label': label})
+            detection_log.shared().append("analyze_issue_video", "ultralytics", POTHOLE_MODEL_VERSION, [b['bbox'] for b in pothole_boxes],
+                                           [b['confidence'] for b in pothole_boxes], frame.shape[1], frame.shape[0], lat=lat, lon=lon)
 
   
         except HTTPException:
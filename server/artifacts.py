@@ -0,0 +1,263 @@
+"""Versioned flood-model artifact bundles with zero-downtime reload.
+
+An ArtifactBundle holds everything a prediction needs (model, scaler, label
+encoder, dataset and its index) under one version string. Requests pin the
+bundle they start with via `BundleManager.acquire()`, so a reload never mixes
+a new model with an old scaler mid-request.
+
+`reload()` builds the next bundle on a background thread, swaps it in with a
+single reference assignment, then waits for requests still holding the old
+bundle to finish before dropping it. A file watcher can trigger the same
+reload when the artifact files change on disk.
+"""
+from __future__ import annotations
+
+import contextvars
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+try:
+    from . import metrics  # type: ignore
+    from . import flood_runtime  # type: ignore
+    from . import cascade  # type: ignore
+    from .dataset_index import DatasetIndex  # type: ignore
+except Exception:
+    import metrics  # type: ignore
+    import flood_runtime  # type: ignore
+    import cascade  # type: ignore
+    from dataset_index import DatasetIndex  # type: ignore
+
+# Holder set per request by app.py so responses can report the bundle they used.
+SERVED_VERSION: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("delhiflow_served_version", default=None)
+
+
+def fingerprint(paths) -> str:
+    """Short hash of the size and mtime of each path; changes whenever a file is replaced."""
+    h = hashlib.sha1()
+    for p in paths:
+        try:
+            st = os.stat(p)
+            h.update(f"{p}:{st.st_size}:{st.st_mtime_ns};".encode())
+        except OSError:
+            h.update(f"{p}:missing;".encode())
+    return h.hexdigest()[:12]
+
+
+class ArtifactBundle:
+    def __init__(self, version: str, model, scaler, le, df: Optional[pd.DataFrame], index: Optional[DatasetIndex]):
+        self.version = version
+        self.model = model
+        self.scaler = scaler
+        self.le = le
+        self.df = df
+        self.index = index
+        self.runtime = "sklearn"  # or "numpy" when served from the flood_runtime export
+        self.cascade = None  # cascade.Cascade when rule-score first-stage scoring is calibrated for this model
+        self.loaded_at = time.time()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None and self.scaler is not None and self.le is not None
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _enter(self):
+        with self._cond:
+            self._in_flight += 1
+
+    def _exit(self):
+        with self._cond:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._cond.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Block until no request holds this bundle; False if the timeout expired first."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._in_flight == 0, timeout=timeout)
+
+    def release(self):
+        """Drop references to the heavy objects once the bundle is retired."""
+        self.model = self.scaler = self.le = self.df = self.index = None
+
+
+def _load(path):
+    import joblib  # only needed (with sklearn) when serving the pickles
+
+    try:
+        return joblib.load(path)
+    except Exception:
+        return None
+
+
+def _version(model_path: str, scaler_path: str, encoder_path: str, data_path: str, runtime_path: Optional[str] = None,
+             cascade_path: Optional[str] = None) -> str:
+    paths = [model_path, scaler_path, encoder_path, data_path]
+    for optional in (runtime_path, cascade_path):
+        if optional:
+            paths.append(optional)
+    return fingerprint(paths)
+
+
+def load_bundle(model_path: str, scaler_path: str, encoder_path: str, data_path: str,
+                runtime_path: Optional[str] = None, cascade_path: Optional[str] = None) -> ArtifactBundle:
+    """Load model, scaler, label encoder and dataset from disk and index the dataset.
+
+    When runtime_path holds a flood_runtime export of the same pickles, the model is
+    served from it and the pickles (and scikit-learn) are never loaded. When cascade_path
+    holds thresholds calibrated for this model, predictions go through the cascade.
+    """
+    version = _version(model_path, scaler_path, encoder_path, data_path, runtime_path, cascade_path)
+    t0 = time.perf_counter()
+    runtime = flood_runtime.load_if_current(runtime_path, (model_path, scaler_path, encoder_path)) if runtime_path else None
+    if runtime is not None:
+        model, scaler, le = runtime.model, runtime.scaler, runtime.le
+    else:
+        model, scaler, le = _load(model_path), _load(scaler_path), _load(encoder_path)
+    metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - t0, artifact="flood")
+
+    df = index = None
+    if os.path.exists(data_path):
+        t0 = time.perf_counter()
+        try:
+            df = pd.read_parquet(data_path)
+            index = DatasetIndex(df)
+            df = index.df
+        except Exception as ex:
+            print(f"[ARTIFACTS] Failed to load dataset '{data_path}': {ex}")
+            df = index = None
+        metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - t0, artifact="dataset")
+    bundle = ArtifactBundle(version, model, scaler, le, df, index)
+    if runtime is not None:
+        bundle.runtime = "numpy"
+    if cascade_path and os.path.exists(cascade_path) and bundle.ready:
+        pickles = (model_path, scaler_path, encoder_path)
+        source = runtime.source if runtime is not None else flood_runtime.source_digest(pickles)
+        bundle.cascade = cascade.load_if_current(cascade_path, source, le)
+    return bundle
+
+
+class BundleManager:
+    def __init__(self, paths: Dict[str, str], on_swap: Optional[Callable[[ArtifactBundle, ArtifactBundle], None]] = None,
+                 drain_timeout_s: float = 60.0):
+        self.paths = dict(paths)
+        self.on_swap = on_swap
+        self.drain_timeout_s = drain_timeout_s
+        self._current = load_bundle(**self.paths)
+        self._reload_lock = threading.Lock()
+        self._reloading = False
+        self._draining: List[ArtifactBundle] = []
+        self.last_error: Optional[str] = None
+        self.last_reload_at: Optional[float] = None
+        self._watcher: Optional[threading.Thread] = None
+
+    def current(self) -> ArtifactBundle:
+        return self._current
+
+    @contextmanager
+    def acquire(self):
+        """Pin the current bundle for the duration of a request."""
+        while True:
+            bundle = self._current
+            bundle._enter()
+            # a swap between the read and the pin may already be draining this bundle; once it
+            # is still current after the pin, drain() is guaranteed to wait for us
+            if bundle is self._current:
+                break
+            bundle._exit()
+        holder = SERVED_VERSION.get()
+        if holder is not None:
+            holder["version"] = bundle.version
+        try:
+            yield bundle
+        finally:
+            bundle._exit()
+
+    def disk_version(self) -> str:
+        return _version(**self.paths)
+
+    def reload(self, force: bool = False, wait: bool = False) -> bool:
+        """Start building a new bundle in the background. Returns False if one is already building."""
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        self._reloading = True
+        t = threading.Thread(target=self._do_reload, args=(force,), name="artifact-reload", daemon=True)
+        t.start()
+        if wait:
+            t.join()
+        return True
+
+    def _do_reload(self, force: bool):
+        try:
+            if not force and self.disk_version() == self._current.version:
+                return
+            new = load_bundle(**self.paths)
+            if not new.ready:
+                # never swap a working bundle for a broken one (e.g. file replaced mid-copy)
+                self.last_error = f"bundle {new.version} incomplete; keeping {self._current.version}"
+                print(f"[ARTIFACTS] {self.last_error}")
+                return
+            old, self._current = self._current, new
+            self.last_error = None
+            self.last_reload_at = time.time()
+            print(f"[ARTIFACTS] Swapped bundle {old.version} -> {new.version}")
+            if self.on_swap:
+                self.on_swap(old, new)
+            self._draining.append(old)
+            if not old.drain(self.drain_timeout_s):
+                print(f"[ARTIFACTS] Bundle {old.version} still has {old.in_flight} requests after {self.drain_timeout_s}s")
+            else:
+                old.release()
+            self._draining.remove(old)
+        except Exception as ex:
+            self.last_error = str(ex)
+            print(f"[ARTIFACTS] Reload failed: {ex}")
+        finally:
+            self._reloading = False
+            self._reload_lock.release()
+
+    def watch(self, interval_s: float):
+        """Poll the artifact files and reload when their fingerprint changes."""
+        if self._watcher is not None or interval_s <= 0:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval_s)
+                try:
+                    if self.disk_version() != self._current.version:
+                        self.reload()
+                except Exception as ex:
+                    print(f"[ARTIFACTS] Watcher error: {ex}")
+
+        self._watcher = threading.Thread(target=loop, name="artifact-watcher", daemon=True)
+        self._watcher.start()
+        print(f"[ARTIFACTS] Watching artifact files every {interval_s}s")
+
+    def status(self) -> dict:
+        cur = self._current
+        return {
+            "version": cur.version,
+            "ready": cur.ready,
+            "runtime": cur.runtime,
+            "cascade": cur.cascade.stats() if cur.cascade is not None else None,
+            "dataset_rows": cur.index.n_rows if cur.index is not None else 0,
+            "loaded_at": cur.loaded_at,
+            "in_flight": cur.in_flight,
+            "reloading": self._reloading,
+            "draining": [{"version": b.version, "in_flight": b.in_flight} for b in list(self._draining)],
+            "disk_version": self.disk_version(),
+            "last_reload_at": self.last_reload_at,
+            "last_error": self.last_error,
+            "watching": self._watcher is not None,
+        }
@@ -0,0 +1,215 @@
+"""Async load generator for a locally running DelhiFlow server.
+
+Replays a weighted mix of client-like traffic at a target request rate
+(open loop: arrivals are scheduled on a Poisson clock and are not slowed
+down by a struggling server, so queueing shows up as latency):
+
+ - map_refresh:  POST /prect with a viewport-sized batch of grid rows
+ - route_lookup: origin + destination POST /predict_location_time, falling
+                 back to /predict_location like PredictTest.jsx does
+ - photo_upload: POST /potholes/detect with a photo from --photos (or
+                 synthetic road images when no fixture directory is given)
+
+Reports achieved throughput, error rates and latency percentiles per scenario.
+
+Usage (server started separately, e.g. `uvicorn app:app --workers 4`):
+    python -m benchmarks.loadgen --rps 50 --duration 60 --mix map_refresh=5,route_lookup=4,photo_upload=1
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+# Bounding box used for random points; matches the Delhi region accepted by the API.
+DELHI_BBOX = (76.84, 28.41, 77.35, 28.88)  # (min lon, min lat, max lon, max lat)
+DEFAULT_MIX = "map_refresh=5,route_lookup=4,photo_upload=1"
+
+
+def _rand_point(rng: random.Random):
+    return rng.uniform(DELHI_BBOX[1], DELHI_BBOX[3]), rng.uniform(DELHI_BBOX[0], DELHI_BBOX[2])
+
+
+def _load_photos(photo_dir: str, n_synthetic: int = 4) -> List[tuple]:
+    """(filename, bytes, content_type) tuples from a fixture dir, or synthetic JPEGs."""
+    photos = []
+    if photo_dir:
+        for path in sorted(glob.glob(os.path.join(photo_dir, "*"))):
+            ext = os.path.splitext(path)[1].lower()
+            ctype = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}.get(ext)
+            if ctype:
+                with open(path, "rb") as f:
+                    photos.append((os.path.basename(path), f.read(), ctype))
+        if not photos:
+            raise SystemExit(f"No images found in {photo_dir}")
+        return photos
+    import cv2
+    from benchmarks.synthetic import road_image
+
+    for i, (w, h) in enumerate([(1280, 720), (1920, 1080), (4000, 3000), (3024, 4032)][:n_synthetic]):
+        ok, enc = cv2.imencode(".jpg", road_image(w, h, seed=i))
+        photos.append((f"synthetic_{w}x{h}.jpg", enc.tobytes(), "image/jpeg"))
+    return photos
+
+
+class Scenarios:
+    def __init__(self, client, rng: random.Random, photos: List[tuple], viewport_rows: int):
+        self.client = client
+        self.rng = rng
+        self.photos = photos
+        self.viewport_rows = viewport_rows
+        self.now = time.localtime()
+
+    async def map_refresh(self):
+        n = self.viewport_rows
+        nrng = np.random.default_rng(self.rng.getrandbits(32))
+        grids = [{
+            "Elevation": float(e), "Road_Density": float(r), "Rain_mm": float(rm), "Rain_Past3h": float(rm * 2.5),
+            "Drain_Water_Level": float(dw), "Soil_Moisture": float(sm),
+            "hour_of_day": self.now.tm_hour, "month": self.now.tm_mon, "day_of_week": self.now.tm_wday,
+        } for e, r, rm, dw, sm in zip(nrng.uniform(190, 250, n), nrng.gamma(2.0, 3500.0, n),
+                                      nrng.uniform(0, 50, n), nrng.uniform(0, 2, n), nrng.uniform(0, 1, n))]
+        return [await self.client.post("/prect", json={"grids": grids})]
+
+    async def _point(self, lat, lon):
+        ts = time.strftime("%Y-%m-%dT%H:%M:%S")
+        r = await self.client.post("/predict_location_time", json={"latitude": lat, "longitude": lon, "timestamp": ts})
+        if r.status_code >= 400:
+            r2 = await self.client.post("/predict_location", json={"latitude": lat, "longitude": lon})
+            return [r, r2]
+        return [r]
+
+    async def route_lookup(self):
+        out = []
+        for _ in range(2):  # origin, destination
+            out += await self._point(*_rand_point(self.rng))
+        return out
+
+    async def photo_upload(self):
+        name, data, ctype = self.rng.choice(self.photos)
+        return [await self.client.post("/potholes/detect", files={"image": (name, data, ctype)})]
+
+
+def _parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _pct(values: List[float], q: float) -> float:
+    return round(float(np.percentile(values, q)) * 1000, 2) if values else None
+
+
+async def run(args) -> Dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    mix = _parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    photos = _load_photos(args.photos) if "photo_upload" in mix else []
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    dropped = 0
+    sem = asyncio.Semaphore(args.max_in_flight)
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+
+    async with httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout, limits=limits) as client:
+        scenarios = Scenarios(client, rng, photos, args.viewport_rows)
+
+        async def one(name: str):
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    responses = await getattr(scenarios, name)()
+                    # a fallback that succeeded still counts as success
+                    code = str(responses[-1].status_code)
+                except Exception as ex:
+                    code = type(ex).__name__
+                latencies[name].append(time.perf_counter() - t0)
+                statuses[name][code] += 1
+
+        tasks = []
+        start = time.perf_counter()
+        next_at = start
+        while next_at - start < args.duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if sem.locked() and args.drop_when_saturated:
+                dropped += 1
+            else:
+                tasks.append(asyncio.ensure_future(one(rng.choices(names, weights)[0])))
+            next_at += rng.expovariate(args.rps)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    report = {"target_rps": args.rps, "duration_s": round(elapsed, 2), "dropped": dropped, "scenarios": {}}
+    total = ok = 0
+    all_lat: List[float] = []
+    for name in names:
+        lat = latencies.get(name, [])
+        st = dict(statuses.get(name, {}))
+        n = sum(st.values())
+        n_ok = sum(v for k, v in st.items() if k.isdigit() and int(k) < 400)
+        total += n
+        ok += n_ok
+        all_lat += lat
+        report["scenarios"][name] = {
+            "requests": n,
+            "achieved_rps": round(n / elapsed, 2) if elapsed else None,
+            "error_rate": round(1 - n_ok / n, 4) if n else None,
+            "statuses": st,
+            "latency_ms": {"p50": _pct(lat, 50), "p90": _pct(lat, 90), "p99": _pct(lat, 99), "max": _pct(lat, 100)},
+        }
+    report["overall"] = {
+        "requests": total,
+        "achieved_rps": round(total / elapsed, 2) if elapsed else None,
+        "error_rate": round(1 - ok / total, 4) if total else None,
+        "latency_ms": {"p50": _pct(all_lat, 50), "p90": _pct(all_lat, 90), "p99": _pct(all_lat, 99), "max": _pct(all_lat, 100)},
+    }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a realistic request mix against a local DelhiFlow server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rps", type=float, default=20.0, help="Target arrival rate (scenarios per second)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate arrivals for")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted scenarios, e.g. map_refresh=5,route_lookup=4,photo_upload=1")
+    parser.add_argument("--photos", help="Directory of images for photo_upload (synthetic images if omitted)")
+    parser.add_argument("--viewport-rows", type=int, default=256, help="Grid rows per map refresh")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Cap on concurrent scenarios")
+    parser.add_argument("--drop-when-saturated", action="store_true", help="Drop arrivals instead of queueing when at the cap")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="Also write the JSON report here")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
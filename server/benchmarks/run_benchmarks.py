@@ -0,0 +1,272 @@
+"""Offline benchmark suite for the flood and pothole hot paths.
+
+Builds synthetic fixtures (see benchmarks/synthetic.py) in a temp directory,
+points app.py at them through its env overrides and measures:
+
+ - grid_index.lookup_grid_id
+ - predict_location_time (cold cache and hot-cell workload)
+ - POST /prect at batch sizes 1 .. 100k
+ - POST /potholes/detect with the detector stub
+ - dataset_creation.create_grid and sample_dem_average
+ - potholes._cv2_fallback on 720p and 12 MP frames
+
+Results (throughput, latency percentiles, peak traced allocation) are written
+as JSON. Pass --compare <old.json> to flag regressions against a previous run.
+
+Usage (from server/):
+    python -m benchmarks.run_benchmarks --out bench.json
+    python -m benchmarks.run_benchmarks --quick --compare bench.json
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+from benchmarks import synthetic  # noqa: E402
+
+
+def _peak_alloc(fn: Callable[[], object]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def measure(name: str, fn: Callable[[], object], reps: int, items: int = 1, warmup: int = 2,
+            params: Optional[dict] = None, setup: Optional[Callable[[], None]] = None) -> Dict:
+    """Time reps calls of fn (each processing `items` items) and summarize."""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    times = []
+    for _ in range(reps):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    if setup:
+        setup()
+    peak = _peak_alloc(fn)
+    t = np.asarray(times)
+    res = {
+        "name": name,
+        "params": params or {},
+        "reps": reps,
+        "items_per_call": items,
+        "throughput_per_s": round(items * reps / float(t.sum()), 3) if t.sum() > 0 else None,
+        "latency_ms": {
+            "mean": round(float(t.mean()) * 1000, 4),
+            "p50": round(float(np.percentile(t, 50)) * 1000, 4),
+            "p90": round(float(np.percentile(t, 90)) * 1000, 4),
+            "p99": round(float(np.percentile(t, 99)) * 1000, 4),
+            "max": round(float(t.max()) * 1000, 4),
+        },
+        "peak_alloc_mb": round(peak / 1e6, 3),
+    }
+    lat = res["latency_ms"]
+    print(f"[BENCH] {name:<40} {str(params or ''):<28} p50={lat['p50']:.3f}ms p99={lat['p99']:.3f}ms "
+          f"thr={res['throughput_per_s']}/s peak={res['peak_alloc_mb']}MB")
+    return res
+
+
+def _reps_for(n_items: int, budget_items: int, lo: int = 3, hi: int = 200) -> int:
+    return int(max(lo, min(hi, budget_items // max(1, n_items))))
+
+
+def bench_lookup(results: List[Dict], fx: synthetic.Fixture, rng, reps: int):
+    import grid_index
+
+    grid_index.get_grid_gdf()  # load outside of the timed region
+    side = int(round(np.sqrt(fx.n_grids)))
+    span = side * synthetic.CELL_DEG
+    pts = [(synthetic.DELHI_ORIGIN[1] + rng.uniform(0.01, 0.99) * span,
+            synthetic.DELHI_ORIGIN[0] + rng.uniform(0.01, 0.99) * span) for _ in range(reps)]
+    it = iter(pts * 2)
+    results.append(measure("lookup_grid_id", lambda: grid_index.lookup_grid_id(*next(it)), reps=reps - 2))
+
+
+def bench_predict_location_time(results: List[Dict], fx: synthetic.Fixture, app_mod, rng, reps: int):
+    req_cls = app_mod.LocationTimeRequest
+    payloads = [req_cls(grid_id=int(g), hour_of_day=int(h), month=7, day_of_week=int(d))
+                for g, h, d in zip(rng.integers(0, fx.n_grids, reps + 4), rng.integers(0, 24, reps + 4), rng.integers(0, 7, reps + 4))]
+    it = iter(payloads)
+    results.append(measure("predict_location_time", lambda: app_mod.predict_location_time(next(it)),
+                           reps=reps, params={"cache": "cold"}, setup=app_mod.PREDICTION_CACHE.clear))
+
+    hot = payloads[:300]
+    for p in hot:
+        app_mod.predict_location_time(p)
+    hot_it = iter(hot * (reps // len(hot) + 2))
+    results.append(measure("predict_location_time", lambda: app_mod.predict_location_time(next(hot_it)),
+                           reps=reps, params={"cache": "hot", "hot_cells": len(hot)}))
+
+
+def bench_prect(results: List[Dict], client, rng, batch_sizes: List[int]):
+    for n in batch_sizes:
+        rows = [{
+            "Elevation": float(e), "Road_Density": float(r), "Rain_mm": float(rm), "Rain_Past3h": float(rp),
+            "Drain_Water_Level": float(dw), "Soil_Moisture": float(sm),
+            "hour_of_day": int(h), "month": 7, "day_of_week": int(d),
+        } for e, r, rm, rp, dw, sm, h, d in zip(
+            rng.uniform(190, 250, n), rng.gamma(2.0, 3500.0, n), rng.uniform(0, 50, n), rng.uniform(0, 150, n),
+            rng.uniform(0, 2, n), rng.uniform(0, 1, n), rng.integers(0, 24, n), rng.integers(0, 7, n))]
+        body = json.dumps({"grids": rows}).encode()
+
+        def call():
+            r = client.post("/prect", content=body, headers={"content-type": "application/json"})
+            if r.status_code != 200:
+                raise RuntimeError(f"/prect returned {r.status_code}: {r.text[:200]}")
+
+        results.append(measure("prect", call, reps=_reps_for(n, 200000, hi=50), items=n, warmup=1, params={"batch_size": n}))
+
+
+def bench_detect(results: List[Dict], client, potholes_mod):
+    import cv2
+
+    stub = synthetic.DetectorStub()
+    potholes_mod._MODEL, potholes_mod._MODEL_NAMES = stub, stub.names
+    for w, h in ((1280, 720), (4000, 3000)):
+        ok, enc = cv2.imencode(".jpg", synthetic.road_image(w, h))
+        data = enc.tobytes()
+
+        def call():
+            r = client.post("/potholes/detect", files={"image": ("road.jpg", data, "image/jpeg")})
+            if r.status_code != 200:
+                raise RuntimeError(f"/potholes/detect returned {r.status_code}")
+
+        results.append(measure("potholes_detect", call, reps=10, params={"size": f"{w}x{h}", "engine": "stub"}))
+
+
+def bench_dataset_creation(results: List[Dict], fx: synthetic.Fixture, side: int):
+    import dataset_creation
+
+    boundary = synthetic.boundary_polygon(side)
+    results.append(measure("create_grid", lambda: dataset_creation.create_grid(boundary, synthetic.CELL_DEG),
+                           reps=3, warmup=1, params={"lattice_side": side}))
+
+    dem = dataset_creation.open_dem(fx.dem_path)
+    cells = list(synthetic.lattice_grid(side).geometry[:500])
+    it = iter(cells * 2)
+    results.append(measure("sample_dem_average", lambda: dataset_creation.sample_dem_average(dem, next(it)),
+                           reps=len(cells) - 5))
+
+
+def bench_cv2_fallback(results: List[Dict], potholes_mod):
+    for w, h in ((1280, 720), (4000, 3000)):
+        img = synthetic.road_image(w, h)
+        results.append(measure("cv2_fallback", lambda: potholes_mod._cv2_fallback(img), reps=10, params={"size": f"{w}x{h}"}))
+
+
+def compare(current: Dict, baseline_path: str, tolerance: float) -> int:
+    """Print p50/throughput ratios against a previous run; return the number of regressions."""
+    with open(baseline_path) as f:
+        base = json.load(f)
+    key = lambda r: (r["name"], json.dumps(r["params"], sort_keys=True))
+    old = {key(r): r for r in base.get("results", [])}
+    regressions = 0
+    for r in current["results"]:
+        o = old.get(key(r))
+        if o is None:
+            continue
+        ratio = r["latency_ms"]["p50"] / o["latency_ms"]["p50"] if o["latency_ms"]["p50"] else float("inf")
+        flag = ""
+        if ratio > 1.0 + tolerance:
+            regressions += 1
+            flag = "  <-- REGRESSION"
+        print(f"[COMPARE] {r['name']:<24} {json.dumps(r['params'], sort_keys=True):<40} p50 x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run DelhiFlow offline benchmarks.")
+    parser.add_argument("--out", default="bench_results.json", help="Where to write the JSON report")
+    parser.add_argument("--side", type=int, default=84, help="Lattice side; 84 gives ~7000 grids like Delhi")
+    parser.add_argument("--hours", type=int, default=168, help="Hours per grid in the synthetic dataset")
+    parser.add_argument("--trees", type=int, default=200, help="RandomForest n_estimators (notebook uses 200)")
+    parser.add_argument("--batch-sizes", default="1,10,100,1000,10000,100000")
+    parser.add_argument("--reps", type=int, default=200, help="Calls per single-item benchmark")
+    parser.add_argument("--quick", action="store_true", help="Small fixture and fewer reps for smoke runs")
+    parser.add_argument("--workdir", help="Keep fixtures in this directory instead of a temp dir")
+    parser.add_argument("--compare", help="Previous JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50 slowdown before flagging")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.side, args.hours, args.trees, args.reps = 20, 48, 20, 30
+        args.batch_sizes = "1,10,100,1000"
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",") if b]
+
+    warnings.filterwarnings("ignore")
+    root = args.workdir or tempfile.mkdtemp(prefix="delhiflow-bench-")
+    os.makedirs(root, exist_ok=True)
+    t0 = time.perf_counter()
+    fx = synthetic.build(root, side=args.side, n_hours=args.hours, n_estimators=args.trees)
+    print(f"[BENCH] Fixtures: {fx.n_grids} grids x {fx.n_hours} hours in {root} ({time.perf_counter() - t0:.1f}s)")
+    os.environ.update(fx.env())
+
+    t0 = time.perf_counter()
+    import app as app_mod
+    import potholes as potholes_mod
+    import_s = time.perf_counter() - t0
+    from fastapi.testclient import TestClient
+    client = TestClient(app_mod.app)
+    app_mod.load_dataset()
+
+    rng = np.random.default_rng(1234)
+    results: List[Dict] = []
+    bench_lookup(results, fx, rng, args.reps)
+    bench_predict_location_time(results, fx, app_mod, rng, args.reps)
+    bench_prect(results, client, rng, batch_sizes)
+    bench_detect(results, client, potholes_mod)
+    bench_dataset_creation(results, fx, args.side)
+    bench_cv2_fallback(results, potholes_mod)
+
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except Exception:
+        max_rss = None
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "fixture": {"grids": fx.n_grids, "hours": fx.n_hours, "trees": args.trees},
+            "app_import_s": round(import_s, 3),
+            "max_rss_bytes": max_rss,
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[BENCH] Wrote {args.out}")
+
+    if args.compare:
+        if compare(report, args.compare, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Synthetic, offline fixtures for benchmarks.
+
+Everything here is generated from fixed seeds so two runs on the same machine
+produce the same inputs:
+ - a square lattice of grid cells over Delhi (same cell size as create_grid)
+ - a grid x hour parquet with the columns written by dataset_creation.py
+ - a RandomForest/StandardScaler/LabelEncoder trained like the notebook does
+ - a small GeoTIFF DEM covering the lattice
+ - a detector stub exposing the subset of the ultralytics API potholes.py uses
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+DELHI_ORIGIN = (76.84, 28.41)  # (lon, lat) of the south-west lattice corner
+CELL_DEG = 500 / 111000.0  # create_grid's default 500 m cell
+CONTINUOUS = ["Elevation", "Road_Density", "Rain_mm", "Rain_Past3h", "Drain_Water_Level", "Soil_Moisture"]
+
+
+@dataclass
+class Fixture:
+    root: str
+    dataset_dir: str
+    model_path: str
+    scaler_path: str
+    encoder_path: str
+    data_path: str
+    grid_path: str
+    dem_path: str
+    n_grids: int
+    n_hours: int
+
+    def env(self) -> dict:
+        """Environment overrides that point app.py / grid_index.py at this fixture."""
+        return {
+            "FLOOD_MODEL_PATH": self.model_path,
+            "FLOOD_SCALER_PATH": self.scaler_path,
+            "FLOOD_ENCODER_PATH": self.encoder_path,
+            "FLOOD_DATA_PATH": self.data_path,
+            "GRID_INDEX_DIR": self.dataset_dir,
+            # Never reach for the network to fetch yolov8n.pt; the stub is injected instead.
+            "POTHOLES_MODEL_PATH": os.path.join(self.root, "missing-detector.pt"),
+            # Everything the server writes or caches stays under the fixture root, never in server/
+            "FLOOD_RUNTIME_PATH": os.path.join(self.root, "flood_model.npz"),
+            "FLOOD_CASCADE_PATH": os.path.join(self.root, "cascade.json"),
+            "DETECTION_LOG_DIR": os.path.join(self.root, "detection_log"),
+            "TILE_CACHE_DIR": os.path.join(self.root, "tile_cache"),
+            "REGIONS_PATH": os.path.join(self.dataset_dir, "wards.geojson"),
+            "REGIONS_MAPPING_PATH": os.path.join(self.dataset_dir, "wards_mapping.npz"),
+        }
+
+
+def lattice_grid(side: int, cell_deg: float = CELL_DEG, origin=DELHI_ORIGIN):
+    """GeoDataFrame of side x side square cells with Grid_ID in row-major order."""
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    x0, y0 = origin
+    ix, iy = np.meshgrid(np.arange(side), np.arange(side), indexing="ij")
+    minx = x0 + ix.ravel() * cell_deg
+    miny = y0 + iy.ravel() * cell_deg
+    polys = [box(a, b, a + cell_deg, b + cell_deg) for a, b in zip(minx, miny)]
+    return gpd.GeoDataFrame({"Grid_ID": np.arange(len(polys)), "geometry": polys}, crs="EPSG:4326")
+
+
+def boundary_polygon(side: int, cell_deg: float = CELL_DEG, origin=DELHI_ORIGIN):
+    """A roughly circular city boundary inscribed in the lattice, for create_grid."""
+    import geopandas as gpd
+    from shapely.geometry import Point
+
+    half = side * cell_deg / 2.0
+    centre = Point(origin[0] + half, origin[1] + half)
+    return gpd.GeoDataFrame({"name": ["synthetic"]}, geometry=[centre.buffer(half * 0.95)], crs="EPSG:4326")
+
+
+def grid_hours(n_grids: int, n_hours: int, seed: int = 42, start="2025-07-01") -> pd.DataFrame:
+    """Grid x hour frame with the schema of dataset/delhi_flood_dataset_demo.parquet."""
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range(start, periods=n_hours, freq="h")
+    df = pd.MultiIndex.from_product([np.arange(n_grids), hours], names=["Grid_ID", "Hour"]).to_frame(index=False)
+    elevation = rng.uniform(190, 250, n_grids)
+    road = rng.gamma(2.0, 3500.0, n_grids)
+    df["Elevation"] = elevation[df["Grid_ID"].to_numpy()]
+    df["Road_Density"] = road[df["Grid_ID"].to_numpy()]
+    df["Drain_Density"] = np.nan
+    df["Pop_Density"] = np.nan
+    df["Historical_Flood_Score"] = np.nan
+    rain = rng.uniform(0, 50, len(df))
+    df["Rain_mm"] = rain
+    # rows are grid-major, so a per-grid 3h rolling sum is a reshape away
+    r = rain.reshape(n_grids, n_hours)
+    past = r.copy()
+    past[:, 1:] += r[:, :-1]
+    past[:, 2:] += r[:, :-2]
+    df["Rain_Past3h"] = past.ravel()
+    df["Drain_Water_Level"] = rng.uniform(0, 2, len(df))
+    df["Soil_Moisture"] = rng.uniform(0, 1, len(df))
+    score = (
+        0.4 * df["Rain_mm"] / 50.0
+        + 0.2 * df["Rain_Past3h"] / 150.0
+        + 0.15 * (1.0 / df["Elevation"])
+        + 0.15 * (df["Drain_Water_Level"] / 2.0)
+    )
+    df["Score"] = score
+    low_th, high_th = score.quantile(0.33), score.quantile(0.66)
+    df["Flood_Risk"] = np.where(score > high_th, "High", np.where(score > low_th, "Medium", "Low"))
+    return df
+
+
+def model_matrix(df: pd.DataFrame, scaler):
+    """Scaled continuous features + cyclical time encoding, as in the training notebook."""
+    cont = scaler.transform(df[CONTINUOUS].to_numpy(dtype=float))
+    hour = df["Hour"].dt.hour.to_numpy(dtype=float)
+    month = df["Hour"].dt.month.to_numpy(dtype=float)
+    dow = df["Hour"].dt.dayofweek.to_numpy(dtype=float)
+    time_feats = np.stack([
+        np.sin(2 * np.pi * hour / 24), np.cos(2 * np.pi * hour / 24),
+        np.sin(2 * np.pi * month / 12), np.cos(2 * np.pi * month / 12),
+        np.sin(2 * np.pi * dow / 7), np.cos(2 * np.pi * dow / 7),
+    ], axis=1)
+    return np.concatenate([cont, time_feats], axis=1)
+
+
+def train_artifacts(df: pd.DataFrame, n_estimators: int, max_rows: int = 50000, seed: int = 42):
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+    sample = df.sample(n=min(max_rows, len(df)), random_state=seed)
+    scaler = StandardScaler().fit(sample[CONTINUOUS].to_numpy(dtype=float))
+    le = LabelEncoder().fit(sample["Flood_Risk"])
+    X = model_matrix(sample, scaler)
+    y = le.transform(sample["Flood_Risk"])
+    model = RandomForestClassifier(n_estimators=n_estimators, max_depth=12, random_state=seed, n_jobs=-1)
+    model.fit(X, y)
+    return model, scaler, le
+
+
+def write_dem(path: str, side: int, px_per_cell: int = 16, cell_deg: float = CELL_DEG, origin=DELHI_ORIGIN, seed: int = 42):
+    """Smooth synthetic terrain (tilted plane + bumps) as a float32 GeoTIFF."""
+    import rasterio
+    from rasterio.transform import from_origin
+
+    n = side * px_per_cell
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:n, 0:n].astype(np.float32) / n
+    dem = 200 + 30 * (1 - yy) + 10 * xx
+    for _ in range(12):
+        cx, cy, r, a = rng.uniform(0, 1), rng.uniform(0, 1), rng.uniform(0.03, 0.12), rng.uniform(-8, 8)
+        dem += a * np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * r * r))
+    res = cell_deg / px_per_cell
+    top = origin[1] + side * cell_deg
+    transform = from_origin(origin[0], top, res, res)
+    with rasterio.open(path, "w", driver="GTiff", height=n, width=n, count=1, dtype="float32",
+                       crs="EPSG:4326", transform=transform, nodata=-9999.0) as ds:
+        ds.write(dem.astype(np.float32), 1)
+    return path
+
+
+def road_image(width: int, height: int, seed: int = 42) -> np.ndarray:
+    """BGR asphalt-like image with a few dark blobs standing in for potholes."""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    img = rng.normal(120, 18, (height, width, 3)).clip(0, 255).astype(np.uint8)
+    img = cv2.GaussianBlur(img, (7, 7), 0)
+    for _ in range(8):
+        c = (int(rng.uniform(0, width)), int(rng.uniform(height * 0.4, height)))
+        axes = (int(rng.uniform(0.01, 0.05) * width), int(rng.uniform(0.005, 0.02) * height) + 2)
+        cv2.ellipse(img, c, axes, float(rng.uniform(0, 180)), 0, 360, (35, 35, 40), -1)
+    return img
+
+
+class _Tensor:
+    def __init__(self, arr):
+        self._arr = np.asarray(arr, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._arr
+
+    def tolist(self):
+        return self._arr.tolist()
+
+    def __getitem__(self, i):
+        item = self._arr[i]
+        return _Tensor(item) if np.ndim(item) else item
+
+    def __len__(self):
+        return len(self._arr)
+
+
+class _Boxes:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = _Tensor(xyxy)
+        self.conf = _Tensor(conf)
+        self.cls = _Tensor(cls)
+
+    def __len__(self):
+        return len(self.xyxy)
+
+    def __iter__(self):
+        # like ultralytics Boxes: one (1, n) Boxes per detection
+        for i in range(len(self)):
+            yield _Boxes(self.xyxy.numpy()[i:i + 1], self.conf.numpy()[i:i + 1], self.cls.numpy()[i:i + 1])
+
+
+class _Result:
+    def __init__(self, boxes, names, shape):
+        self.boxes = boxes
+        self.names = names
+        self.orig_shape = shape
+
+
+class DetectorStub:
+    """Stands in for an ultralytics YOLO model with a 'pothole' class.
+
+    It letterboxes the input to imgsz like the real preprocessor (so decode and
+    resize costs stay realistic) and returns a fixed box per image.
+    """
+
+    names = {0: "pothole"}
+
+    def predict(self, source, imgsz=640, conf=0.25, verbose=False, **kwargs):
+        import cv2
+
+        sources = source if isinstance(source, list) else [source]
+        out = []
+        for src in sources:
+            arr = np.asarray(src)
+            h, w = arr.shape[:2]
+            s = imgsz / max(h, w)
+            cv2.resize(arr, (max(1, int(w * s)), max(1, int(h * s))))
+            box = [w * 0.4, h * 0.6, w * 0.55, h * 0.7]
+            out.append(_Result(_Boxes([box], [0.8], [0]), self.names, (h, w)))
+        return out
+
+    __call__ = predict
+
+
+def build(root: str, side: int = 84, n_hours: int = 168, n_estimators: int = 200) -> Fixture:
+    """Write every artifact under root and return their paths."""
+    import joblib
+
+    dataset_dir = os.path.join(root, "dataset")
+    os.makedirs(dataset_dir, exist_ok=True)
+    grid = lattice_grid(side)
+    grid_path = os.path.join(dataset_dir, "grid_index.geojson")
+    grid.to_file(grid_path, driver="GeoJSON")
+
+    df = grid_hours(len(grid), n_hours)
+    data_path = os.path.join(dataset_dir, "delhi_flood_dataset_demo.parquet")
+    df.to_parquet(data_path, index=False)
+
+    model, scaler, le = train_artifacts(df, n_estimators)
+    paths = {}
+    for name, obj in (("flood_model.pkl", model), ("scaler.pkl", scaler), ("label_encoder.pkl", le)):
+        paths[name] = os.path.join(root, name)
+        joblib.dump(obj, paths[name])
+
+    dem_path = write_dem(os.path.join(root, "dem.tif"), side)
+    return Fixture(
+        root=root, dataset_dir=dataset_dir,
+        model_path=paths["flood_model.pkl"], scaler_path=paths["scaler.pkl"], encoder_path=paths["label_encoder.pkl"],
+        data_path=data_path, grid_path=grid_path, dem_path=dem_path,
+        n_grids=len(grid), n_hours=n_hours,
+    )
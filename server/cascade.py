@@ -0,0 +1,319 @@
+"""Two-stage (cascade) flood-risk scoring.
+
+Most grid-hours are clear cases: dry hours are Low and downpours on low-lying
+cells are High, whatever the forest says about the details. The first stage is
+the dataset builder's rule score (the `Score` formula in dataset_creation.py,
+without the historical term the model never sees), a handful of vector
+operations per row. Rows scoring at or below `low_max` are answered Low, rows
+at or above `high_min` High, and only the rows in between go to the full model.
+
+The two thresholds are calibrated offline against the full model, not against
+the training labels: on a reservoir sample of the dataset, `low_max` is the
+largest score whose rows (all rows scoring at or below it) the model labels
+Low in at least `target` of cases, and `high_min` likewise for High from the
+top. Agreement with the model and accuracy against the labels are then
+measured on the held-out split and stored with the thresholds in
+model/cascade.json, together with a digest of the model it was calibrated
+for, so a retrained model never serves stale thresholds.
+
+Rows answered by the first stage get the mean model confidence of the
+calibration rows on that side. While serving, a small fraction of them
+(FLOOD_CASCADE_AUDIT) is also scored by the full model and the live agreement
+is reported by `stats()` (in /admin/artifacts).
+
+Calibrate (after training or exporting the runtime):
+    python cascade.py --data dataset/ --target 0.995
+"""
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+# Share of first-stage rows re-scored by the full model to measure live agreement (0 disables)
+AUDIT_FRACTION = float(os.getenv("FLOOD_CASCADE_AUDIT", "0.01"))
+# Raw row columns (FEATURES + hour/month/dow order)
+_ELEVATION, _RAIN, _RAIN_PAST3H, _DRAIN = 0, 2, 3, 4
+
+
+def rule_score(raw: np.ndarray) -> np.ndarray:
+    """Rule score of (n, 9) raw rows, as dataset_creation.py computes it (historical term 0)."""
+    elevation = raw[:, _ELEVATION]
+    safe_elevation = np.where(elevation > 0, elevation, 1.0)
+    return (
+        0.4 * raw[:, _RAIN] / 50.0
+        + 0.2 * raw[:, _RAIN_PAST3H] / 150.0
+        + 0.15 * (1.0 / safe_elevation)
+        + 0.15 * (raw[:, _DRAIN] / 2.0)
+    )
+
+
+def _prefix_threshold(scores: np.ndarray, hit: np.ndarray, target: float, min_rows: int) -> Optional[int]:
+    """Largest k such that the k lowest scores are >= target hits and k ends a run of equal scores."""
+    n = len(scores)
+    if n == 0:
+        return None
+    k = np.arange(1, n + 1)
+    precision = np.cumsum(hit) / k
+    # a threshold cannot separate equal scores, so only the last row of each run is a candidate
+    boundary = np.append(scores[1:] != scores[:-1], True)
+    ok = np.flatnonzero((precision >= target) & boundary & (k >= min_rows))
+    return int(ok[-1]) + 1 if len(ok) else None
+
+
+class Cascade:
+    def __init__(self, low_max: Optional[float], high_min: Optional[float], confidence: Dict[str, float],
+                 source: str = "", calibration: Optional[dict] = None):
+        self.low_max = low_max
+        self.high_min = high_min
+        self.confidence = dict(confidence)
+        self.source = source
+        self.calibration = calibration or {}
+        self.class_ids: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng()
+        self._counts = {"rows": 0, "low": 0, "high": 0, "model": 0, "audited": 0, "audit_agree": 0}
+
+    def bind(self, le) -> "Cascade":
+        """Resolve the Low/High labels to the model's class ids; a side whose label is unknown is disabled."""
+        names = [str(c) for c in le.classes_]
+        self.class_ids = {label: names.index(label) for label in ("Low", "High") if label in names}
+        if "Low" not in self.class_ids:
+            self.low_max = None
+        if "High" not in self.class_ids:
+            self.high_min = None
+        return self
+
+    def split(self, raw: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Boolean masks of the rows the first stage answers Low and High."""
+        score = rule_score(raw)
+        low = score <= self.low_max if self.low_max is not None else np.zeros(len(raw), dtype=bool)
+        high = score >= self.high_min if self.high_min is not None else np.zeros(len(raw), dtype=bool)
+        return low, high & ~low
+
+    def predict(self, raw: np.ndarray, full: Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]],
+                dtype=np.int64) -> Tuple[np.ndarray, np.ndarray]:
+        """(class ids, max probability) for raw rows; full(rows) scores the undecided ones."""
+        n = len(raw)
+        low, high = self.split(raw)
+        rest = np.flatnonzero(~(low | high))
+        preds = np.empty(n, dtype=dtype)
+        probs = np.empty(n, dtype=float)
+        if low.any():
+            preds[low] = self.class_ids["Low"]
+            probs[low] = self.confidence["Low"]
+        if high.any():
+            preds[high] = self.class_ids["High"]
+            probs[high] = self.confidence["High"]
+
+        decided = np.flatnonzero(low | high)
+        audit = np.empty(0, dtype=np.int64)
+        if AUDIT_FRACTION > 0 and len(decided):
+            with self._lock:
+                audit = decided[self._rng.random(len(decided)) < AUDIT_FRACTION]
+        if len(rest) or len(audit):
+            # audited rows ride along in the same model call
+            idx = np.concatenate([rest, audit])
+            p, pr = full(raw[idx])
+            preds[rest] = p[:len(rest)]
+            probs[rest] = pr[:len(rest)]
+            agree = int((p[len(rest):] == preds[audit]).sum())
+        else:
+            agree = 0
+        with self._lock:
+            c = self._counts
+            c["rows"] += n
+            c["low"] += int(low.sum())
+            c["high"] += int(high.sum())
+            c["model"] += len(rest)
+            c["audited"] += len(audit)
+            c["audit_agree"] += agree
+        return preds, probs
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self._counts)
+        return {
+            "low_max": self.low_max,
+            "high_min": self.high_min,
+            **c,
+            "first_stage_share": round((c["low"] + c["high"]) / c["rows"], 4) if c["rows"] else None,
+            "live_agreement": round(c["audit_agree"] / c["audited"], 4) if c["audited"] else None,
+            "calibrated": {k: self.calibration.get(k) for k in ("target", "first_stage_share", "agreement", "created_at")},
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "format": FORMAT_VERSION,
+            "source": self.source,
+            "low_max": self.low_max,
+            "high_min": self.high_min,
+            "confidence": self.confidence,
+            "calibration": self.calibration,
+        }
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Cascade":
+        with open(path) as f:
+            d = json.load(f)
+        if d.get("format") != FORMAT_VERSION:
+            raise ValueError(f"unsupported cascade format {d.get('format')}")
+        return cls(d["low_max"], d["high_min"], d["confidence"], d.get("source", ""), d.get("calibration"))
+
+
+def load_if_current(path: str, source: str, le) -> Optional[Cascade]:
+    """Cascade at path bound to le, or None if missing, unreadable, or calibrated for another model."""
+    if not path or not os.path.exists(path) or le is None:
+        return None
+    try:
+        cascade = Cascade.load(path)
+    except Exception as ex:
+        print(f"[CASCADE] Ignoring unreadable cascade '{path}': {ex}")
+        return None
+    if cascade.source != source:
+        print(f"[CASCADE] '{path}' was calibrated for a different model; re-run cascade.py to refresh it")
+        return None
+    return cascade.bind(le)
+
+
+def calibrate(raw: np.ndarray, model_labels: np.ndarray, model_probs: np.ndarray, target: float = 0.995,
+              min_rows: int = 100) -> Tuple[Optional[float], Optional[float], Dict[str, float]]:
+    """(low_max, high_min, confidence per side) from the full model's labels on calibration rows."""
+    score = rule_score(raw)
+    order = np.argsort(score, kind="stable")
+    s = score[order]
+    labels = np.asarray(model_labels, dtype=object)[order]
+    probs = np.asarray(model_probs, dtype=float)[order]
+
+    low_max = high_min = None
+    confidence: Dict[str, float] = {}
+    k = _prefix_threshold(s, labels == "Low", target, min_rows)
+    if k is not None:
+        low_max = float(s[k - 1])
+        confidence["Low"] = float(probs[:k].mean())
+    k = _prefix_threshold(-s[::-1], labels[::-1] == "High", target, min_rows)
+    if k is not None:
+        high_min = float(s[len(s) - k])
+        confidence["High"] = float(probs[len(s) - k:].mean())
+    if low_max is not None and high_min is not None and low_max >= high_min:
+        # only possible with target <= 0.5; keep the side covering more rows
+        if (s <= low_max).sum() >= (s >= high_min).sum():
+            high_min = None
+        else:
+            low_max = None
+    return low_max, high_min, confidence
+
+
+def _load_model(model_path: str, scaler_path: str, encoder_path: str, runtime_path: Optional[str]):
+    """(model, scaler, le, source digest) as load_bundle would serve them."""
+    try:
+        from . import flood_runtime  # type: ignore
+    except Exception:
+        import flood_runtime  # type: ignore
+
+    pickles = (model_path, scaler_path, encoder_path)
+    runtime = flood_runtime.load_if_current(runtime_path, pickles) if runtime_path else None
+    if runtime is not None:
+        return runtime.model, runtime.scaler, runtime.le, runtime.source
+    import joblib
+
+    return (joblib.load(model_path), joblib.load(scaler_path), joblib.load(encoder_path),
+            flood_runtime.source_digest(pickles))
+
+
+def build(data: str, model_path: str, scaler_path: str, encoder_path: str, runtime_path: Optional[str],
+          out_path: str, target: float = 0.995, sample_rows: int = 500_000, batch_rows: int = 262_144,
+          test_fraction: float = 0.2, seed: int = 42) -> Cascade:
+    """Calibrate on a reservoir of training-split rows, validate on held-out rows and write out_path."""
+    try:
+        from . import flood_runtime  # type: ignore
+        from .train import Reservoir, batches  # type: ignore
+    except Exception:
+        import flood_runtime  # type: ignore
+        from train import Reservoir, batches  # type: ignore
+
+    model, scaler, le, source = _load_model(model_path, scaler_path, encoder_path, runtime_path)
+
+    def full(rows):
+        proba = model.predict_proba(flood_runtime.design_matrix(rows, scaler))
+        best = proba.argmax(axis=1)
+        return model.classes_.take(best), proba[np.arange(len(best)), best]
+
+    fit = Reservoir(sample_rows, 9, seed)
+    held = Reservoir(sample_rows, 9, seed + 1)
+    for raw, labels, is_test in batches(data, batch_rows, test_fraction, seed):
+        ok = np.isfinite(raw).all(axis=1)
+        fit.add(raw[ok & ~is_test], labels[ok & ~is_test])
+        held.add(raw[ok & is_test], labels[ok & is_test])
+    raw_fit, _ = fit.sample()
+    raw_val, y_val = held.sample()
+    if len(raw_fit) == 0 or len(raw_val) == 0:
+        raise RuntimeError(f"No complete rows to calibrate on in '{data}'")
+
+    preds, probs = full(raw_fit)
+    low_max, high_min, confidence = calibrate(raw_fit, le.inverse_transform(preds), probs, target)
+    cascade = Cascade(low_max, high_min, confidence, source).bind(le)
+
+    # validation: cascade vs full model, and both vs the dataset labels
+    ref, _ = full(raw_val)
+    global AUDIT_FRACTION
+    audit, AUDIT_FRACTION = AUDIT_FRACTION, 0.0
+    try:
+        got, _ = cascade.predict(raw_val, full, dtype=ref.dtype)
+    finally:
+        AUDIT_FRACTION = audit
+    low, high = cascade.split(raw_val)
+    decided = low | high
+    y_val = np.asarray(y_val, dtype=str)
+    cascade.calibration = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "target": target,
+        "calibration_rows": int(len(raw_fit)),
+        "validation_rows": int(len(raw_val)),
+        "first_stage_share": round(float(decided.mean()), 4),
+        "low_share": round(float(low.mean()), 4),
+        "high_share": round(float(high.mean()), 4),
+        "agreement": round(float((got == ref).mean()), 5),
+        "first_stage_agreement": round(float((got[decided] == ref[decided]).mean()), 5) if decided.any() else None,
+        "model_accuracy": round(float((np.asarray(le.inverse_transform(ref), dtype=str) == y_val).mean()), 5),
+        "cascade_accuracy": round(float((np.asarray(le.inverse_transform(got), dtype=str) == y_val).mean()), 5),
+    }
+    cascade.save(out_path)
+    cal = cascade.calibration
+    print(f"[CASCADE] low_max={low_max} high_min={high_min}: first stage answers {cal['first_stage_share']:.1%} of rows, "
+          f"agreement {cal['agreement']} (accuracy {cal['model_accuracy']} -> {cal['cascade_accuracy']}); -> {out_path}")
+    return cascade
+
+
+if __name__ == "__main__":
+    import argparse
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Calibrate the rule-score first stage of cascade flood scoring.")
+    parser.add_argument("--data", default=os.path.join(here, "dataset", "delhi_flood_dataset_demo.parquet"),
+                        help="parquet file or directory of parquet files")
+    parser.add_argument("--model", default=os.path.join(here, "model", "flood_model.pkl"))
+    parser.add_argument("--scaler", default=os.path.join(here, "scaler", "scaler.pkl"))
+    parser.add_argument("--encoder", default=os.path.join(here, "encoder", "label_encoder.pkl"))
+    parser.add_argument("--runtime", default=os.path.join(here, "model", "flood_model.npz"))
+    parser.add_argument("--out", default=os.path.join(here, "model", "cascade.json"))
+    parser.add_argument("--target", type=float, default=0.995, help="minimum agreement with the model on each side")
+    parser.add_argument("--sample-rows", type=int, default=500_000)
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    build(args.data, args.model, args.scaler, args.encoder, args.runtime, args.out, target=args.target,
+          sample_rows=args.sample_rows, test_fraction=args.test_fraction, seed=args.seed)
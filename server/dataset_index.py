@@ -0,0 +1,89 @@
+"""Array index over the grid x hour dataset.
+
+The dataset is sorted once by (Grid_ID, Hour) and the columns the API needs
+are pulled out as NumPy arrays, so per-request lookups become binary searches
+instead of boolean scans over the whole DataFrame.
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+FEATURES = ["Elevation", "Road_Density", "Rain_mm", "Rain_Past3h", "Drain_Water_Level", "Soil_Moisture"]
+NS_PER_HOUR = 3600 * 10**9
+
+
+def time_columns(abs_hours: np.ndarray):
+    """(hour_of_day, month, day_of_week) for absolute hour numbers (ns since epoch // NS_PER_HOUR)."""
+    h = np.asarray(abs_hours, dtype=np.int64)
+    month = (h * NS_PER_HOUR).astype("datetime64[ns]").astype("datetime64[M]").astype(np.int64) % 12 + 1
+    # 1970-01-01 was a Thursday (weekday 3)
+    return h % 24, month, (h // 24 + 3) % 7
+
+
+class DatasetIndex:
+    def __init__(self, df: pd.DataFrame):
+        if not np.issubdtype(df["Hour"].dtype, np.datetime64):
+            df = df.assign(Hour=pd.to_datetime(df["Hour"]))
+        df = df.sort_values(["Grid_ID", "Hour"], kind="mergesort").reset_index(drop=True)
+        self.df = df
+        self.n_rows = len(df)
+
+        gid = df["Grid_ID"].to_numpy(dtype=np.int64)
+        self.grid_ids, self.starts = np.unique(gid, return_index=True)
+        self.ends = np.append(self.starts[1:], len(gid)).astype(np.int64)
+        self.hours = df["Hour"].to_numpy(dtype="datetime64[ns]")
+        self.features = np.column_stack([
+            df[c].to_numpy(dtype=float) if c in df.columns else np.full(len(df), np.nan) for c in FEATURES
+        ]) if len(df) else np.empty((0, len(FEATURES)))
+
+        # First row per (grid, month, hour-of-day), matching predict_location_time's selection rule.
+        grid_pos = np.repeat(np.arange(len(self.grid_ids), dtype=np.int64), self.ends - self.starts)
+        hour_series = df["Hour"]
+        bucket = grid_pos * 10000 + hour_series.dt.month.to_numpy(dtype=np.int64) * 100 + hour_series.dt.hour.to_numpy(dtype=np.int64)
+        self._bucket_keys, self._bucket_rows = np.unique(bucket, return_index=True)
+        # (grid position, absolute hour) keys; sorted because rows are sorted by grid then hour
+        self._abs_hours = self.hours.astype(np.int64) // NS_PER_HOUR
+        self._time_keys = grid_pos * (1 << 32) + self._abs_hours
+
+    def grid_position(self, grid_id: int) -> Optional[int]:
+        i = int(np.searchsorted(self.grid_ids, grid_id))
+        if i < len(self.grid_ids) and self.grid_ids[i] == grid_id:
+            return i
+        return None
+
+    def row_for(self, grid_id: int, month: int, hour: int) -> Optional[int]:
+        """Row of the first sample for grid_id in (month, hour), else the grid's first row.
+
+        Returns None when the grid has no rows at all.
+        """
+        pos = self.grid_position(int(grid_id))
+        if pos is None:
+            return None
+        key = pos * 10000 + int(month) * 100 + int(hour)
+        j = int(np.searchsorted(self._bucket_keys, key))
+        if j < len(self._bucket_keys) and self._bucket_keys[j] == key:
+            return int(self._bucket_rows[j])
+        return int(self.starts[pos])
+
+    def rows_at(self, grid_pos: np.ndarray, abs_hours: np.ndarray):
+        """Rows for every (grid, hour) pair of grid_pos x abs_hours, as a (G, T) array.
+
+        Exact timestamps are used when the dataset has them; otherwise the same
+        (month, hour-of-day) bucket, then the grid's first row, as in row_for().
+        Also returns a (G, T) bool array telling which rows matched exactly.
+        """
+        gp = np.asarray(grid_pos, dtype=np.int64)[:, None]
+        h = np.asarray(abs_hours, dtype=np.int64)[None, :]
+        key = gp * (1 << 32) + h
+        j = np.minimum(np.searchsorted(self._time_keys, key), max(self.n_rows - 1, 0))
+        exact = self._time_keys[j] == key
+
+        hod, month, _ = time_columns(h)
+        bkey = gp * 10000 + month * 100 + hod
+        b = np.minimum(np.searchsorted(self._bucket_keys, bkey), len(self._bucket_keys) - 1)
+        in_bucket = self._bucket_keys[b] == bkey
+        fallback = np.where(in_bucket, self._bucket_rows[b], self.starts[gp])
+        return np.where(exact, j, fallback), exact
@@ -0,0 +1,359 @@
+"""Append-only log of pothole detections, compacted into date-partitioned parquet.
+
+Every detection request appends one JSON line to a write-ahead segment
+
+    {root}/wal/{start ms}-{pid}-{random}.open
+
+which is a single buffered write + flush under a lock, cheap enough for the
+request path. Segments are sealed (renamed to .jsonl) when they grow past
+DETECTION_WAL_SEGMENT_KB or when compaction runs; a background thread then
+rewrites sealed segments as parquet
+
+    {root}/parquet/date=YYYY-MM-DD/{segment}.parquet
+
+and deletes them. The parquet file is named after its segment and written
+atomically, so compaction that crashes half-way (or runs in two worker
+processes at once) simply rewrites the same files. Segments left open by a
+process that is no longer running are sealed by the next compaction.
+
+Queries prune by date directory, read only the columns they need, and add the
+not yet compacted segments so counts are current. Times are UTC.
+
+Configuration (env vars):
+ - DETECTION_LOG_DIR          log root (default server/detection_log)
+ - DETECTION_COMPACT_S        compaction interval in seconds (default 300, 0 disables)
+ - DETECTION_WAL_SEGMENT_KB   seal the open segment beyond this size (default 4096)
+"""
+from __future__ import annotations
+
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .artifacts import fingerprint  # type: ignore
+except Exception:
+    from artifacts import fingerprint  # type: ignore
+
+DETECTION_LOG_DIR = os.getenv("DETECTION_LOG_DIR", os.path.join(os.path.dirname(__file__), "detection_log"))
+DETECTION_COMPACT_S = float(os.getenv("DETECTION_COMPACT_S", "300"))
+DETECTION_WAL_SEGMENT_BYTES = int(float(os.getenv("DETECTION_WAL_SEGMENT_KB", "4096")) * 1024)
+
+BUCKETS = {"hour": "h", "day": "D"}
+# Upper bound on the number of time buckets one counts query may return
+MAX_COUNT_BUCKETS = 2000
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("ts", pa.timestamp("ms")),
+        ("source", pa.string()),
+        ("engine", pa.string()),
+        ("model_version", pa.string()),
+        ("lat", pa.float64()),
+        ("lon", pa.float64()),
+        ("grid_id", pa.int64()),
+        ("image_width", pa.int32()),
+        ("image_height", pa.int32()),
+        ("n_boxes", pa.int32()),
+        ("boxes", pa.list_(pa.list_(pa.float32(), 4))),  # x1, y1, x2, y2 in original image pixels
+        ("scores", pa.list_(pa.float32())),
+    ])
+
+
+def model_version(path: str) -> str:
+    """Detector identity for log records: file name plus a fingerprint of the file."""
+    if os.path.exists(path):
+        return f"{os.path.basename(path)}@{fingerprint([path])}"
+    return os.path.basename(path)
+
+
+def _locate(lat: float, lon: float) -> Optional[int]:
+    try:
+        from .grid_index import lookup_grid_id  # type: ignore
+    except Exception:
+        try:
+            from grid_index import lookup_grid_id  # type: ignore
+        except Exception:
+            return None
+    try:
+        return lookup_grid_id(float(lat), float(lon))
+    except Exception:
+        return None
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _to_utc_naive(t) -> pd.Timestamp:
+    ts = pd.Timestamp(t)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return ts
+
+
+class DetectionLog:
+    def __init__(self, root: str, segment_bytes: int = DETECTION_WAL_SEGMENT_BYTES):
+        self.root = root
+        self.wal_dir = os.path.join(root, "wal")
+        self.parquet_dir = os.path.join(root, "parquet")
+        self.segment_bytes = int(segment_bytes)
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._fh = None
+        self._path: Optional[str] = None
+        self._stop = threading.Event()
+        self._compactor: Optional[threading.Thread] = None
+        self.appended = 0
+        self.compactions = 0
+        self.compacted_records = 0
+        self.errors = 0
+
+    # --- write path ---
+    def append(self, source: str, engine: str, model_version: str, boxes: Sequence[Sequence[float]],
+               scores: Sequence[Optional[float]], width: int, height: int,
+               lat: Optional[float] = None, lon: Optional[float] = None, grid_id: Optional[int] = None):
+        """Log one detection request; boxes are x1, y1, x2, y2 in original image pixels.
+
+        grid_id is looked up from lat/lon when not given. Never raises: a failing log
+        must not fail the request.
+        """
+        try:
+            if grid_id is None and lat is not None and lon is not None:
+                grid_id = _locate(lat, lon)
+            rec = {
+                "ts": int(time.time() * 1000), "source": source, "engine": engine, "model_version": model_version,
+                "lat": lat, "lon": lon, "grid_id": None if grid_id is None else int(grid_id),
+                "image_width": int(width), "image_height": int(height), "n_boxes": len(boxes),
+                "boxes": [[round(float(v), 1) for v in b] for b in boxes],
+                "scores": [None if s is None else round(float(s), 4) for s in scores],
+            }
+            line = json.dumps(rec, separators=(",", ":")) + "\n"
+            with self._lock:
+                if self._fh is None:
+                    self._open_segment()
+                self._fh.write(line)
+                self._fh.flush()
+                self.appended += 1
+                if self._fh.tell() >= self.segment_bytes:
+                    self._seal_current()
+        except Exception as ex:
+            self.errors += 1
+            print(f"[DETECTIONS] Could not log detection: {ex}")
+
+    def _open_segment(self):
+        os.makedirs(self.wal_dir, exist_ok=True)
+        name = f"{int(time.time() * 1000)}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._path = os.path.join(self.wal_dir, name + ".open")
+        self._fh = open(self._path, "a", encoding="utf-8")
+
+    def _seal_current(self):
+        """Close the open segment and hand it to compaction (caller holds _lock)."""
+        if self._fh is None:
+            return
+        self._fh.close()
+        os.replace(self._path, self._path[:-len(".open")] + ".jsonl")
+        self._fh = None
+        self._path = None
+
+    def _seal_orphans(self):
+        for path in glob.glob(os.path.join(self.wal_dir, "*.open")):
+            try:
+                pid = int(os.path.basename(path).split("-")[1])
+            except (IndexError, ValueError):
+                continue
+            if pid != os.getpid() and not _pid_alive(pid):
+                try:
+                    os.replace(path, path[:-len(".open")] + ".jsonl")
+                except OSError:
+                    pass
+
+    # --- compaction ---
+    def compact(self) -> int:
+        """Seal the open segment and rewrite every sealed segment as parquet; returns records moved."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        with self._compact_lock:
+            with self._lock:
+                self._seal_current()
+            self._seal_orphans()
+            moved = 0
+            for seg in sorted(glob.glob(os.path.join(self.wal_dir, "*.jsonl"))):
+                df = _read_segment(seg)
+                if len(df):
+                    stem = os.path.splitext(os.path.basename(seg))[0]
+                    for day, part in df.groupby(df["ts"].dt.strftime("%Y-%m-%d"), sort=False):
+                        out_dir = os.path.join(self.parquet_dir, f"date={day}")
+                        os.makedirs(out_dir, exist_ok=True)
+                        table = pa.Table.from_pandas(part.reset_index(drop=True), schema=_schema(), preserve_index=False)
+                        fd, tmp = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+                        os.close(fd)
+                        try:
+                            pq.write_table(table, tmp, compression="zstd")
+                            os.replace(tmp, os.path.join(out_dir, stem + ".parquet"))
+                        except BaseException:
+                            if os.path.exists(tmp):
+                                os.remove(tmp)
+                            raise
+                    moved += len(df)
+                try:
+                    os.remove(seg)
+                except OSError:
+                    pass  # compacted concurrently by another worker
+            self.compactions += 1
+            self.compacted_records += moved
+            return moved
+
+    def watch(self, interval_s: float):
+        """Compact every interval_s seconds in a daemon thread (<= 0 disables)."""
+        if interval_s <= 0 or self._compactor is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval_s):
+                try:
+                    self.compact()
+                except Exception as ex:
+                    self.errors += 1
+                    print(f"[DETECTIONS] Compaction failed: {ex}")
+
+        self._compactor = threading.Thread(target=loop, name="detection-compactor", daemon=True)
+        self._compactor.start()
+
+    # --- queries ---
+    def partitions(self, start: pd.Timestamp, end: pd.Timestamp) -> List[str]:
+        """Parquet files of the date partitions that can hold records in [start, end)."""
+        files: List[str] = []
+        day = start.normalize()
+        while day < end:
+            files += sorted(glob.glob(os.path.join(self.parquet_dir, f"date={day:%Y-%m-%d}", "*.parquet")))
+            day += pd.Timedelta(days=1)
+        return files
+
+    def read(self, start, end, columns: Sequence[str] = ("ts", "grid_id", "n_boxes")) -> pd.DataFrame:
+        """Records with start <= ts < end from the matching partitions plus the uncompacted log."""
+        import pyarrow.parquet as pq
+
+        start, end = _to_utc_naive(start), _to_utc_naive(end)
+        cols = list(columns)
+        # not concurrently with compaction, which would move records between the two sources
+        with self._compact_lock:
+            frames = [pq.read_table(f, columns=cols).to_pandas() for f in self.partitions(start, end)]
+            for seg in glob.glob(os.path.join(self.wal_dir, "*.jsonl")) + glob.glob(os.path.join(self.wal_dir, "*.open")):
+                frames.append(_read_segment(seg)[cols])
+        frames = [f for f in frames if len(f)]
+        if not frames:
+            return _read_segment(None)[cols]
+        df = pd.concat(frames, ignore_index=True)
+        if "ts" in df:
+            df = df[(df["ts"] >= start) & (df["ts"] < end)]
+        return df
+
+    def counts(self, start, end, grid_ids: Optional[Sequence[int]] = None, bucket: Optional[str] = "day") -> Dict[str, Any]:
+        """Per-grid report and pothole counts in [start, end), optionally per hour/day bucket.
+
+        Returns columnar arrays: grid_ids, reports and potholes (totals), and with a bucket
+        also buckets plus (G, B) reports_by_bucket / potholes_by_bucket.
+        """
+        start, end = _to_utc_naive(start), _to_utc_naive(end)
+        if bucket is not None and bucket not in BUCKETS:
+            raise ValueError(f"bucket must be one of {sorted(BUCKETS)} or none")
+        edges = None
+        if bucket is not None:
+            freq = BUCKETS[bucket]
+            edges = pd.date_range(start.floor(freq), end, freq=freq, inclusive="left")
+            if len(edges) > MAX_COUNT_BUCKETS:
+                raise ValueError(f"Range spans {len(edges)} {bucket} buckets (max {MAX_COUNT_BUCKETS})")
+
+        df = self.read(start, end)
+        unlocated = int(df["grid_id"].isna().sum())
+        df = df[df["grid_id"].notna()]
+        gid = df["grid_id"].to_numpy(dtype=np.int64)
+        keys = pd.unique(np.asarray(list(grid_ids), dtype=np.int64)) if grid_ids is not None else np.unique(gid)
+        # output row of each record; keys keep the caller's order
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        pos = np.clip(np.searchsorted(sorted_keys, gid), 0, max(len(keys) - 1, 0))
+        hit = sorted_keys[pos] == gid if len(keys) else np.zeros(len(gid), dtype=bool)
+        rows = order[pos[hit]]
+        boxes = df["n_boxes"].to_numpy(dtype=np.int64)[hit]
+
+        result: Dict[str, Any] = {
+            "grid_ids": keys.tolist(),
+            "reports": np.bincount(rows, minlength=len(keys)).tolist(),
+            "potholes": np.bincount(rows, weights=boxes, minlength=len(keys)).astype(np.int64).tolist(),
+            "unlocated_reports": unlocated,
+            "records": int(len(df) + unlocated),
+        }
+        if edges is not None:
+            nb = len(edges)
+            b = np.searchsorted(edges.values, df["ts"].to_numpy(dtype="datetime64[ns]")[hit], side="right") - 1
+            flat = rows * nb + b
+            size = len(keys) * nb
+            result["buckets"] = [t.isoformat() for t in edges]
+            result["reports_by_bucket"] = np.bincount(flat, minlength=size).reshape(len(keys), nb).tolist()
+            result["potholes_by_bucket"] = (
+                np.bincount(flat, weights=boxes, minlength=size).astype(np.int64).reshape(len(keys), nb).tolist()
+            )
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(glob.glob(os.path.join(self.wal_dir, "*.jsonl")) + glob.glob(os.path.join(self.wal_dir, "*.open")))
+            return {
+                "appended": self.appended, "compactions": self.compactions, "compacted_records": self.compacted_records,
+                "pending_segments": pending, "errors": self.errors,
+            }
+
+
+def _read_segment(path: Optional[str]) -> pd.DataFrame:
+    """Records of a WAL segment as a frame with the parquet column types (empty for None)."""
+    rows = []
+    try:
+        if path is None:
+            raise FileNotFoundError
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue  # torn last line of a crashed writer
+    except FileNotFoundError:
+        pass
+    schema = _schema()
+    df = pd.DataFrame(rows, columns=schema.names)
+    df["ts"] = pd.to_datetime(df["ts"], unit="ms")
+    df["grid_id"] = df["grid_id"].astype("Int64")
+    return df
+
+
+_SHARED: Optional[DetectionLog] = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared() -> DetectionLog:
+    """Process-wide log from the env configuration, compacting in the background."""
+    global _SHARED
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = DetectionLog(DETECTION_LOG_DIR)
+            _SHARED.watch(DETECTION_COMPACT_S)
+        return _SHARED
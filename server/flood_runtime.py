@@ -0,0 +1,339 @@
+"""Self-contained flood-model runtime: the sklearn forest, scaler and label
+encoder flattened into one .npz of NumPy arrays, plus an evaluator that
+needs nothing but NumPy.
+
+Serving the joblib pickles unpickles all of scikit-learn in every worker and
+pays its per-call overhead (input validation, joblib thread dispatch) on
+every request, which dominates small batches. The exported artifact holds:
+
+ - the StandardScaler mean_/scale_ and the class labels;
+ - every tree of the forest as flat node arrays (feature, float32 threshold,
+   left child) with the trees concatenated. Nodes are renumbered breadth-first
+   so the right child is always left + 1, and leaves point at themselves, so
+   one step of the walk is `node = left[node] + (x[feature[node]] > threshold[node])`;
+ - the per-leaf class probabilities exactly as DecisionTreeClassifier.predict_proba
+   returns them.
+
+The evaluator walks all trees for a chunk of rows in lock-step, max_depth
+steps of that expression, then sums the leaf probabilities tree by tree in
+estimator order and divides by the tree count: the same float operations
+sklearn performs, so predict_proba is bit-for-bit identical to the sklearn
+model evaluated with n_jobs=1. (With n_jobs > 1 sklearn adds the trees in
+thread completion order, which can change the last bit between its own runs.)
+`export` checks this on sample rows and refuses to write an artifact that
+differs. Rows must be finite; the app fills defaults before scoring.
+
+`FloodRuntime` exposes `scaler`, `model` and `le` objects with the subset of
+the sklearn API the app uses (transform, predict_proba, classes_,
+inverse_transform), so an ArtifactBundle can hold either form.
+
+Export (after training, next to the pickles):
+    python flood_runtime.py --out model/flood_model.npz
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from typing import Optional, Sequence
+
+import numpy as np
+
+FORMAT_VERSION = 1
+# Rows evaluated per lock-step pass; bounds the (trees x rows) node-index matrix
+CHUNK_ROWS = 4096
+# Threads evaluating chunks of large batches (sklearn's n_jobs=-1 equivalent)
+RUNTIME_THREADS = int(os.getenv("FLOOD_RUNTIME_THREADS", str(os.cpu_count() or 1)))
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def _executor():
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            _EXECUTOR = ThreadPoolExecutor(RUNTIME_THREADS, thread_name_prefix="flood-runtime")
+        return _EXECUTOR
+
+
+def design_matrix(raw: np.ndarray, scaler) -> np.ndarray:
+    """(n, 9) rows in FEATURES order -> the (n, 12) model input used in training:
+    scaled continuous features followed by the cyclical hour / month / weekday encoding."""
+    cont = scaler.transform(raw[:, :6].astype(float))
+    hour = raw[:, 6].astype(float)
+    month = raw[:, 7].astype(float)
+    dow = raw[:, 8].astype(float)
+    time_feats = np.stack([
+        np.sin(2 * np.pi * hour / 24), np.cos(2 * np.pi * hour / 24),
+        np.sin(2 * np.pi * month / 12), np.cos(2 * np.pi * month / 12),
+        np.sin(2 * np.pi * dow / 7), np.cos(2 * np.pi * dow / 7),
+    ], axis=1)
+    return np.concatenate([cont, time_feats], axis=1)
+
+
+def source_digest(paths: Sequence[str]) -> str:
+    """Content hash of the pickles an artifact was exported from (mtime-independent, so copies match)."""
+    h = hashlib.sha1()
+    for p in paths:
+        with open(p, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()[:16]
+
+
+class Scaler:
+    def __init__(self, mean: np.ndarray, scale: np.ndarray):
+        self.mean_ = mean
+        self.scale_ = scale
+
+    def transform(self, X) -> np.ndarray:
+        # same operations as StandardScaler.transform (copy, subtract, divide)
+        X = np.array(X, dtype=np.float64)
+        X -= self.mean_
+        X /= self.scale_
+        return X
+
+
+class LabelDecoder:
+    def __init__(self, classes: np.ndarray):
+        self.classes_ = classes
+
+    def inverse_transform(self, y) -> np.ndarray:
+        return self.classes_[np.asarray(y, dtype=np.int64)]
+
+
+class Forest:
+    def __init__(self, feature, threshold, left, leaf_proba, roots, classes, max_depth: int):
+        """Flattened trees in breadth-first order: the right child of node i is left[i] + 1,
+        leaves point at themselves with threshold +inf; leaf_proba is (n_classes, n_nodes)."""
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.leaf_proba = leaf_proba
+        self.roots = roots
+        self.classes_ = classes
+        self.max_depth = int(max_depth)
+
+    @property
+    def n_estimators(self) -> int:
+        return len(self.roots)
+
+    def apply(self, X) -> np.ndarray:
+        """(n_trees, n) global index of the leaf each row reaches in each tree."""
+        # trees split on float32 features and the thresholds were rounded down to float32,
+        # so x > t here is exactly sklearn's not (x <= threshold)
+        n = len(X)
+        XT = np.ascontiguousarray(np.asarray(X, dtype=np.float32).T).ravel()
+        offsets = self.feature.astype(np.intp) * n
+        rows = np.tile(np.arange(n), len(self.roots))
+        node = np.repeat(self.roots, n)
+        for _ in range(self.max_depth):
+            node = self.left.take(node) + (XT.take(offsets.take(node) + rows) > self.threshold.take(node))
+        return node.reshape(len(self.roots), n)
+
+    def _accumulate(self, X, out):
+        leaves = self.apply(X)
+        for t in range(len(self.roots)):
+            for c in range(len(self.classes_)):
+                out[c] += self.leaf_proba[c].take(leaves[t])
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.asarray(X)
+        out = np.zeros((len(self.classes_), len(X)), dtype=np.float64)
+        chunks = range(0, len(X), CHUNK_ROWS)
+        if len(chunks) > 1 and RUNTIME_THREADS > 1:
+            # rows are independent and numpy releases the GIL in take
+            list(_executor().map(lambda s: self._accumulate(X[s:s + CHUNK_ROWS], out[:, s:s + CHUNK_ROWS]), chunks))
+        else:
+            for s in chunks:
+                self._accumulate(X[s:s + CHUNK_ROWS], out[:, s:s + CHUNK_ROWS])
+        out /= self.n_estimators
+        return out.T
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(self.predict_proba(X).argmax(axis=1))
+
+
+class FloodRuntime:
+    def __init__(self, scaler: Scaler, model: Forest, le: LabelDecoder, source: str = ""):
+        self.scaler = scaler
+        self.model = model
+        self.le = le
+        self.source = source
+
+    def predict_proba(self, raw: np.ndarray) -> np.ndarray:
+        """Class probabilities for (n, 9) raw feature rows."""
+        return self.model.predict_proba(design_matrix(raw, self.scaler))
+
+    def save(self, path: str):
+        m = self.model
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp, format_version=np.array(FORMAT_VERSION), source=np.array(self.source),
+            mean=self.scaler.mean_, scale=self.scaler.scale_, labels=self.le.classes_.astype(str),
+            feature=m.feature, threshold=m.threshold, left=m.left, leaf_proba=m.leaf_proba, roots=m.roots, classes=m.classes_, max_depth=np.array(m.max_depth),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "FloodRuntime":
+        z = np.load(path, allow_pickle=False)
+        if int(z["format_version"]) != FORMAT_VERSION:
+            raise ValueError(f"Unsupported runtime format {int(z['format_version'])} in '{path}'")
+        forest = Forest(z["feature"], z["threshold"], z["left"].astype(np.intp), z["leaf_proba"],
+                        z["roots"].astype(np.intp), z["classes"], int(z["max_depth"]))
+        return cls(Scaler(z["mean"], z["scale"]), forest, LabelDecoder(z["labels"].astype(object)), str(z["source"]))
+
+
+def _flatten_forest(model) -> Forest:
+    estimators = getattr(model, "estimators_", None)
+    if estimators is None and hasattr(model, "tree_"):
+        estimators = [model]
+    if not estimators or not all(hasattr(e, "tree_") for e in estimators) or getattr(model, "n_outputs_", 1) != 1:
+        raise TypeError(f"Cannot export {type(model).__name__}: expected a single-output tree ensemble classifier")
+
+    # sklearn >= 1.4 stores class fractions in tree_.value and returns them as is;
+    # older versions store weighted counts and normalise them in predict_proba
+    import sklearn
+
+    fractions = tuple(int(v) for v in sklearn.__version__.split(".")[:2]) >= (1, 4)
+    feats, thrs, lefts, probas, roots = [], [], [], [], []
+    offset = 0
+    for est in estimators:
+        t = est.tree_
+        # breadth-first renumbering so that sibling nodes are adjacent
+        order = [0]
+        for node in order:
+            if t.children_left[node] != -1:
+                order += [t.children_left[node], t.children_right[node]]
+        order = np.asarray(order)
+        new_id = np.empty(t.node_count, dtype=np.int64)
+        new_id[order] = np.arange(len(order))
+        leaf = t.children_left[order] == -1
+        lefts.append(np.where(leaf, np.arange(len(order)), new_id[np.maximum(t.children_left[order], 0)]) + offset)
+        feats.append(np.where(leaf, 0, t.feature[order]))
+        thr = t.threshold[order].astype(np.float64)
+        thr32 = thr.astype(np.float32)
+        # largest float32 <= threshold: for float32 x, x <= thr exactly when x <= thr32
+        up = thr32.astype(np.float64) > thr
+        thr32[up] = np.nextafter(thr32[up], np.float32(-np.inf))
+        thrs.append(np.where(leaf, np.float32(np.inf), thr32))
+        value = t.value[order, 0, :].astype(np.float64)
+        if not fractions:
+            norm = value.sum(axis=1)
+            norm[norm == 0.0] = 1.0
+            value = value / norm[:, None]
+        probas.append(value)
+        roots.append(offset)
+        offset += len(order)
+    return Forest(
+        np.concatenate(feats).astype(np.int32), np.concatenate(thrs).astype(np.float32),
+        np.concatenate(lefts).astype(np.intp), np.ascontiguousarray(np.concatenate(probas).T),
+        np.asarray(roots, dtype=np.intp), np.asarray(model.classes_), max(e.tree_.max_depth for e in estimators),
+    )
+
+
+def from_sklearn(model, scaler, le, source: str = "") -> FloodRuntime:
+    mean = getattr(scaler, "mean_", None)
+    scale = getattr(scaler, "scale_", None)
+    n = getattr(scaler, "n_features_in_", 6)
+    mean = np.zeros(n) if mean is None else np.asarray(mean, dtype=np.float64)
+    scale = np.ones(n) if scale is None else np.asarray(scale, dtype=np.float64)
+    return FloodRuntime(Scaler(mean, scale), _flatten_forest(model), LabelDecoder(np.asarray(le.classes_, dtype=object)), source)
+
+
+def verify(runtime: FloodRuntime, model, scaler, raw: np.ndarray) -> bool:
+    """True when the runtime reproduces the sklearn probabilities exactly on raw rows."""
+    X_ref = design_matrix(raw, scaler)
+    X_rt = design_matrix(raw, runtime.scaler)
+    if not np.array_equal(X_ref, X_rt):
+        return False
+    n_jobs = getattr(model, "n_jobs", None)
+    try:
+        if n_jobs is not None:
+            model.n_jobs = 1  # sequential tree order, see module docstring
+        ref = model.predict_proba(X_ref)
+    finally:
+        if n_jobs is not None:
+            model.n_jobs = n_jobs
+    return np.array_equal(ref, runtime.model.predict_proba(X_rt))
+
+
+def sample_rows(data_path: Optional[str], n: int, seed: int = 0) -> np.ndarray:
+    """Verification rows: the first n dataset rows when available, plus random rows around them."""
+    try:
+        from .dataset_index import FEATURES  # type: ignore
+    except Exception:
+        from dataset_index import FEATURES  # type: ignore
+    rng = np.random.default_rng(seed)
+    rows = []
+    if data_path and os.path.exists(data_path):
+        import pandas as pd
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(data_path, format="parquet", partitioning="hive" if os.path.isdir(data_path) else None)
+        df = dataset.head(n, columns=["Hour"] + FEATURES).to_pandas()
+        ts = pd.to_datetime(df["Hour"])
+        data = np.column_stack([
+            df[FEATURES].to_numpy(dtype=float), ts.dt.hour.to_numpy(), ts.dt.month.to_numpy(), ts.dt.dayofweek.to_numpy(),
+        ]).astype(float)
+        rows.append(data[np.isfinite(data).all(axis=1)])
+    base = rows[0] if rows and len(rows[0]) else np.zeros((1, len(FEATURES) + 3))
+    spread = base[:, :6].std(axis=0) + 1.0
+    cont = base[rng.integers(0, len(base), n), :6] + rng.normal(0, 1, (n, 6)) * spread
+    times = np.column_stack([rng.integers(0, 24, n), rng.integers(1, 13, n), rng.integers(0, 7, n)])
+    rows.append(np.column_stack([cont, times]).astype(float))
+    return np.concatenate(rows)
+
+
+def export(model_path: str, scaler_path: str, encoder_path: str, out_path: str,
+           data_path: Optional[str] = None, n_verify: int = 20000) -> FloodRuntime:
+    """Convert the joblib pickles to out_path after checking bit-exactness on sample rows."""
+    import joblib
+
+    model, scaler, le = joblib.load(model_path), joblib.load(scaler_path), joblib.load(encoder_path)
+    runtime = from_sklearn(model, scaler, le, source=source_digest([model_path, scaler_path, encoder_path]))
+    raw = sample_rows(data_path, n_verify)
+    if not verify(runtime, model, scaler, raw):
+        raise RuntimeError("Exported runtime does not reproduce the sklearn probabilities; not writing it")
+    runtime.save(out_path)
+    print(f"[RUNTIME] Exported {runtime.model.n_estimators} trees ({len(runtime.model.feature)} nodes) to {out_path}; "
+          f"verified on {len(raw)} rows")
+    return runtime
+
+
+def load_if_current(path: str, source_paths: Sequence[str]) -> Optional[FloodRuntime]:
+    """Runtime at path, or None if missing, unreadable, or exported from different pickles.
+
+    When none of the pickles are present (a sklearn-free deployment) the runtime is used as is.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        runtime = FloodRuntime.load(path)
+    except Exception as ex:
+        print(f"[RUNTIME] Ignoring unreadable runtime '{path}': {ex}")
+        return None
+    if all(os.path.exists(p) for p in source_paths) and runtime.source != source_digest(source_paths):
+        print(f"[RUNTIME] '{path}' was exported from different pickles; re-run flood_runtime.py to refresh it")
+        return None
+    return runtime
+
+
+if __name__ == "__main__":
+    import argparse
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Export the flood model pickles to the NumPy runtime format.")
+    parser.add_argument("--model", default=os.path.join(here, "model", "flood_model.pkl"))
+    parser.add_argument("--scaler", default=os.path.join(here, "scaler", "scaler.pkl"))
+    parser.add_argument("--encoder", default=os.path.join(here, "encoder", "label_encoder.pkl"))
+    parser.add_argument("--data", default=os.path.join(here, "dataset", "delhi_flood_dataset_demo.parquet"),
+                        help="dataset used for verification rows (optional)")
+    parser.add_argument("--out", default=os.path.join(here, "model", "flood_model.npz"))
+    parser.add_argument("--verify-rows", type=int, default=20000)
+    args = parser.parse_args()
+    export(args.model, args.scaler, args.encoder, args.out, data_path=args.data, n_verify=args.verify_rows)
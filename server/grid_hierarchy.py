@@ -0,0 +1,165 @@
+"""Nested lattice levels over the Grid_ID cells for zoom-dependent queries.
+
+dataset_creation.create_grid lays cells on a regular lon/lat lattice, so each
+cell has integer lattice coordinates (ix, iy). Level k groups 2^k x 2^k base
+cells: the level-k cell of a base cell is (ix >> k, iy >> k). Level 0 keeps the
+original Grid_IDs; coarser cells get stable integer ids
+
+    (k << 40) | (px << 20) | py
+
+that depend only on the lattice, never on the order cells were loaded in, so
+a client can cache them and derive parents with a shift.
+
+Features and risk are aggregated per level with bincount over the base cells,
+so a bbox query returns a bounded number of cells whatever the base resolution.
+"""
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ID_SHIFT = 40
+AXIS_SHIFT = 20
+AXIS_MASK = (1 << AXIS_SHIFT) - 1
+
+
+def cell_id(level: int, px, py):
+    return (np.int64(level) << ID_SHIFT) | (np.asarray(px, dtype=np.int64) << AXIS_SHIFT) | np.asarray(py, dtype=np.int64)
+
+
+def decode_id(cid: int) -> Tuple[int, int, int]:
+    """(level, px, py) of a level >= 1 cell id."""
+    cid = int(cid)
+    return cid >> ID_SHIFT, (cid >> AXIS_SHIFT) & AXIS_MASK, cid & AXIS_MASK
+
+
+class _Level:
+    def __init__(self, k: int, ids, px, py, members, bounds):
+        self.k = k
+        self.ids = ids  # cell id per level cell
+        self.px = px
+        self.py = py
+        self.members = members  # level-cell position of every base cell
+        self.counts = np.bincount(members, minlength=len(ids))
+        self.bounds = bounds  # (n, 4) lon/lat minx, miny, maxx, maxy
+
+
+class GridHierarchy:
+    def __init__(self, grid_ids: Sequence[int], ix, iy, origin: Tuple[float, float], step: float,
+                 base_bounds: Optional[np.ndarray] = None):
+        order = np.argsort(np.asarray(grid_ids, dtype=np.int64))
+        self.grid_ids = np.asarray(grid_ids, dtype=np.int64)[order]
+        self.ix = np.asarray(ix, dtype=np.int64)[order]
+        self.iy = np.asarray(iy, dtype=np.int64)[order]
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.step = float(step)
+
+        n = len(self.grid_ids)
+        if base_bounds is None:
+            base_bounds = self._lattice_bounds(0, self.ix, self.iy)
+        self.levels: List[_Level] = [_Level(0, self.grid_ids, self.ix, self.iy, np.arange(n), np.asarray(base_bounds)[order])]
+        top = int(max(self.ix.max(initial=0), self.iy.max(initial=0)))
+        k = 1
+        # add levels until a single cell covers the whole lattice
+        while n and (top >> (k - 1)) > 0:
+            keys = cell_id(k, self.ix >> k, self.iy >> k)
+            ids, members = np.unique(keys, return_inverse=True)
+            px, py = (ids >> AXIS_SHIFT) & AXIS_MASK, ids & AXIS_MASK
+            self.levels.append(_Level(k, ids, px, py, members, self._lattice_bounds(k, px, py)))
+            k += 1
+
+    def _lattice_bounds(self, k: int, px, py) -> np.ndarray:
+        size = self.step * (1 << k)
+        minx = self.origin[0] + np.asarray(px) * size
+        miny = self.origin[1] + np.asarray(py) * size
+        return np.column_stack([minx, miny, minx + size, miny + size])
+
+    @property
+    def n_levels(self) -> int:
+        return len(self.levels)
+
+    def in_bbox(self, k: int, bbox: Optional[Sequence[float]]) -> np.ndarray:
+        """Positions of level-k cells overlapping bbox (minx, miny, maxx, maxy); all when bbox is None."""
+        lv = self.levels[k]
+        if bbox is None:
+            return np.arange(len(lv.ids))
+        b = lv.bounds
+        hit = (b[:, 2] >= bbox[0]) & (b[:, 0] <= bbox[2]) & (b[:, 3] >= bbox[1]) & (b[:, 1] <= bbox[3])
+        return np.flatnonzero(hit)
+
+    def level_for(self, bbox: Optional[Sequence[float]], max_cells: int, min_level: int = 0) -> int:
+        """Finest level >= min_level with at most max_cells cells in bbox (coarsest if none fits)."""
+        for k in range(min(max(min_level, 0), self.n_levels - 1), self.n_levels):
+            if len(self.in_bbox(k, bbox)) <= max_cells:
+                return k
+        return self.n_levels - 1
+
+    def level_for_zoom(self, zoom: float, min_cell_px: float = 4.0) -> int:
+        """Coarsest level whose cells are still at least min_cell_px wide at a web map zoom."""
+        px_per_deg = 256 * (2.0 ** zoom) / 360.0
+        for k in range(self.n_levels):
+            if self.step * (1 << k) * px_per_deg >= min_cell_px:
+                return k
+        return self.n_levels - 1
+
+    def parent_ids(self, k: int, positions) -> Optional[np.ndarray]:
+        if k + 1 >= self.n_levels:
+            return None
+        lv = self.levels[k]
+        return cell_id(k + 1, lv.px[positions] >> 1, lv.py[positions] >> 1)
+
+    def children(self, cid: int) -> Tuple[int, np.ndarray]:
+        """(child level, positions) of the cells one level below cell id cid."""
+        k, px, py = decode_id(cid)
+        if not 1 <= k < self.n_levels:
+            raise KeyError(cid)
+        child = self.levels[k - 1]
+        pos = np.flatnonzero(((child.px >> 1) == px) & ((child.py >> 1) == py))
+        if len(pos) == 0:
+            raise KeyError(cid)
+        return k - 1, pos
+
+    def aggregate(self, k: int, values: np.ndarray, how: str = "mean") -> np.ndarray:
+        """Per level-k cell aggregate of a base-cell vector (grid_ids order); NaNs are skipped."""
+        lv = self.levels[k]
+        v = np.asarray(values, dtype=float)
+        ok = ~np.isnan(v)
+        if how == "max":
+            out = np.full(len(lv.ids), -np.inf)
+            np.maximum.at(out, lv.members[ok], v[ok])
+            return np.where(np.isinf(out), np.nan, out)
+        total = np.bincount(lv.members[ok], weights=v[ok], minlength=len(lv.ids))
+        if how == "sum":
+            return total
+        n = np.bincount(lv.members[ok], minlength=len(lv.ids))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(n > 0, total / n, np.nan)
+
+    def aggregate_risk(self, k: int, severity: np.ndarray, high: int = 2) -> Dict[str, np.ndarray]:
+        """max severity (-1 = unscored) and share of High among scored base cells per level-k cell."""
+        sev = np.asarray(severity, dtype=float)
+        sev = np.where(sev < 0, np.nan, sev)
+        return {
+            "max_severity": np.nan_to_num(self.aggregate(k, sev, "max"), nan=-1).astype(np.int64),
+            "high_share": self.aggregate(k, np.where(np.isnan(sev), np.nan, (sev >= high).astype(float)), "mean"),
+        }
+
+
+def from_grid_gdf(gdf, step: Optional[float] = None) -> GridHierarchy:
+    """Recover lattice coordinates from Grid_ID polygons in lon/lat.
+
+    The lattice origin is the lower-left corner of all cells; the step defaults to the
+    widest cell (cells clipped by the city boundary are narrower, never wider).
+    """
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+    b = gdf.geometry.bounds.to_numpy()
+    if step is None:
+        step = float(max(np.max(b[:, 2] - b[:, 0]), np.max(b[:, 3] - b[:, 1])))
+    origin = (float(b[:, 0].min()), float(b[:, 1].min()))
+    # a point inside each (possibly clipped) cell identifies its lattice slot
+    pts = gdf.geometry.representative_point()
+    ix = np.floor((pts.x.to_numpy() - origin[0]) / step).astype(np.int64)
+    iy = np.floor((pts.y.to_numpy() - origin[1]) / step).astype(np.int64)
+    return GridHierarchy(gdf["Grid_ID"].to_numpy(), ix, iy, origin, step, base_bounds=b)
@@ -8,6 +8,8 @@ Supported input files (first one found will be used):
  - server/dataset/grid_index.parquet (GeoParquet)
  - server/dataset/grid_index.shp (Shapefile)
 
+Set GRID_INDEX_DIR to look in a different directory.
+
 If none are found, lookup functions will raise a descriptive error.
 """
 from __future__ import annotations
@@ -20,7 +22,7 @@ import shapely.geometry as geom
 
 
 BASE_DIR = os.path.dirname(__file__)
-DATASET_DIR = os.path.join(BASE_DIR, "dataset")
+DATASET_DIR = os.getenv("GRID_INDEX_DIR", os.path.join(BASE_DIR, "dataset"))
 
 
 def _candidate_paths():
@@ -0,0 +1,120 @@
+"""Size-aware image decoding for the detection endpoints.
+
+The detector runs at a fixed input size (imgsz=640), so decoding a 12 MP
+phone photo at full resolution only to have YOLO shrink it again wastes most
+of the request. `decode` reads the header first and then:
+
+ - JPEG: asks libjpeg for a DCT-scaled decode (1/2, 1/4 or 1/8) that is still
+   at least the target size, which skips most of the decoding work;
+ - other formats: decodes and box-reduces by an integer factor;
+ - applies the EXIF orientation, so boxes match what the user sees;
+ - converts once to a contiguous BGR uint8 array, the layout both YOLO
+   (numpy input) and the OpenCV fallback expect.
+
+Boxes found on the reduced image are mapped back to original-resolution
+pixel coordinates with `DecodedImage.to_original` / `detections_to_original`.
+"""
+from __future__ import annotations
+
+import io
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# EXIF orientations that swap width and height
+_TRANSPOSED = (5, 6, 7, 8)
+_EXIF_ORIENTATION = 0x0112
+# EXIF orientation -> PIL transpose that makes the image upright (as ImageOps.exif_transpose)
+_ORIENT_OPS = {
+    2: "FLIP_LEFT_RIGHT", 3: "ROTATE_180", 4: "FLIP_TOP_BOTTOM", 5: "TRANSPOSE",
+    6: "ROTATE_270", 7: "TRANSVERSE", 8: "ROTATE_90",
+}
+
+
+class DecodedImage:
+    def __init__(self, bgr: np.ndarray, width: int, height: int, fmt: Optional[str] = None):
+        """bgr is the (possibly reduced) pixels; width/height the original upright size."""
+        self.bgr = bgr
+        self.width = int(width)
+        self.height = int(height)
+        self.format = fmt
+        self.scale_x = self.width / bgr.shape[1]
+        self.scale_y = self.height / bgr.shape[0]
+
+    @property
+    def reduced(self) -> bool:
+        return self.bgr.shape[1] != self.width or self.bgr.shape[0] != self.height
+
+    def to_original(self, xyxy) -> np.ndarray:
+        """(n, 4) x1, y1, x2, y2 boxes on bgr -> original image pixels."""
+        boxes = np.asarray(xyxy, dtype=float).reshape(-1, 4)
+        return boxes * np.array([self.scale_x, self.scale_y, self.scale_x, self.scale_y])
+
+    def detections_to_original(self, dets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Rescale {"x", "y", "width", "height"} detections in place and return them."""
+        if self.reduced:
+            for d in dets:
+                d["x"] = float(d["x"]) * self.scale_x
+                d["y"] = float(d["y"]) * self.scale_y
+                d["width"] = float(d["width"]) * self.scale_x
+                d["height"] = float(d["height"]) * self.scale_y
+        return dets
+
+
+def decode(source, target: int = 640) -> DecodedImage:
+    """Decode bytes or a binary file object to a BGR array whose longer side is close to
+    (never below) target.
+
+    File objects (e.g. an UploadFile's spooled file) are read by the decoder directly,
+    without first loading the whole upload into memory. target <= 0 decodes at full
+    resolution. Raises ValueError if the input is not an image.
+    """
+    try:
+        from PIL import Image
+    except Exception:
+        return _decode_cv2(source)
+
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            img = Image.open(io.BytesIO(source))
+        else:
+            source.seek(0)
+            img = Image.open(source)
+        fmt = img.format
+        w, h = img.size
+        orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+        scale = target / max(w, h) if target > 0 else 1.0
+        if scale < 1.0 and img.format == "JPEG":
+            # picks the largest DCT reduction that still covers the requested size
+            img.draft("RGB", (max(1, int(np.ceil(w * scale))), max(1, int(np.ceil(h * scale)))))
+        img.load()
+        if scale < 1.0:
+            factor = int(min(img.size[0] / (w * scale), img.size[1] / (h * scale)))
+            if factor >= 2:
+                img = img.reduce(factor)
+        if orientation in _ORIENT_OPS:
+            img = img.transpose(getattr(Image.Transpose, _ORIENT_OPS[orientation]))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+    except Exception:
+        # formats Pillow cannot read may still be decodable by OpenCV
+        return _decode_cv2(source)
+
+    rgb = np.asarray(img)
+    bgr = np.ascontiguousarray(rgb[:, :, ::-1])
+    if orientation in _TRANSPOSED:
+        w, h = h, w
+    return DecodedImage(bgr, w, h, fmt)
+
+
+def _decode_cv2(source) -> DecodedImage:
+    import cv2
+
+    if not isinstance(source, (bytes, bytearray, memoryview)):
+        source.seek(0)
+        source = source.read()
+    bgr = cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise ValueError("Could not decode image")
+    h, w = bgr.shape[:2]
+    return DecodedImage(bgr, w, h)
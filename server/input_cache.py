@@ -0,0 +1,129 @@
+"""Content-addressed local cache for dataset_creation.py inputs and stages.
+
+Every file is stored once under objects/<sha256[:2]>/<sha256><suffix>, and
+named entries point at it from refs/:
+
+ - inputs fetched from the network (OSM boundary as GeoParquet, road edges
+   as GeoParquet, OpenTopography DEM as GeoTIFF, OpenTopoData elevations)
+   under a key such as "osm/boundary/Delhi, India". `fetch` downloads only
+   when the key is missing (or refresh is set), and in offline mode raises
+   OfflineMiss instead of touching the network;
+ - pipeline stage outputs under "stage/<name>/<fingerprint>", where the
+   fingerprint hashes the stage name, the digests of its input files, its
+   parameters and the source of the function that builds it. A stage whose
+   inputs and code are unchanged is reused instead of recomputed, and
+   re-fetching an input with identical content keeps every downstream stage.
+
+Writes go to a temporary file first and are renamed into place, so an
+interrupted build never leaves a half-written object behind.
+"""
+from __future__ import annotations
+
+import datetime
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
+
+
+class OfflineMiss(RuntimeError):
+    """An input needed by an --offline build is not in the cache."""
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprint(name: str, inputs: Dict[str, object], code: Union[Callable, Sequence[Callable], None] = None) -> str:
+    """Stage fingerprint: name, input digests / parameters and the source of the functions that build it."""
+    payload = {"stage": name, "inputs": inputs, "code": []}
+    for fn in ([] if code is None else [code] if callable(code) else code):
+        try:
+            payload["code"].append(hashlib.sha256(inspect.getsource(fn).encode()).hexdigest())
+        except (OSError, TypeError):
+            payload["code"].append(getattr(fn, "__qualname__", repr(fn)))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+
+class InputCache:
+    def __init__(self, root: str, offline: bool = False, refresh: bool = False):
+        self.root = root
+        self.offline = offline
+        self.refresh = refresh
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(root, "refs"), exist_ok=True)
+
+    def _ref_path(self, key: str) -> str:
+        return os.path.join(self.root, "refs", hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def _object_path(self, digest: str, suffix: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest + suffix)
+
+    def lookup(self, key: str) -> Optional[Tuple[str, str]]:
+        """(path, digest) of the object stored under key, or None if missing."""
+        try:
+            with open(self._ref_path(key)) as f:
+                ref = json.load(f)
+        except (OSError, ValueError):
+            return None
+        path = self._object_path(ref["digest"], ref.get("suffix", ""))
+        return (path, ref["digest"]) if os.path.exists(path) else None
+
+    def _store(self, key: str, tmp: str, suffix: str, meta: Optional[dict]) -> Tuple[str, str]:
+        digest = file_digest(tmp)
+        path = self._object_path(digest, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(tmp)  # same content already stored
+        else:
+            os.replace(tmp, path)
+        ref = {"key": key, "digest": digest, "suffix": suffix,
+               "stored_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"), "meta": meta or {}}
+        fd, ref_tmp = tempfile.mkstemp(dir=os.path.join(self.root, "refs"), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(ref, f, indent=2, default=str)
+        os.replace(ref_tmp, self._ref_path(key))
+        return path, digest
+
+    def _build(self, key: str, suffix: str, write: Callable[[str], None], meta: Optional[dict]) -> Tuple[str, str]:
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=suffix)
+        os.close(fd)
+        try:
+            write(tmp)
+            return self._store(key, tmp, suffix, meta)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def fetch(self, key: str, suffix: str, download: Callable[[str], None], meta: Optional[dict] = None) -> Tuple[str, str]:
+        """(path, digest) of a network input, calling download(path) only on a miss or refresh."""
+        hit = None if self.refresh and not self.offline else self.lookup(key)
+        if hit is not None:
+            print(f"[Cache] Using cached {key} ({hit[1][:12]})")
+            return hit
+        if self.offline:
+            raise OfflineMiss(f"'{key}' is not cached in {self.root}; run once without --offline to fetch it")
+        print(f"[Cache] Fetching {key} ...")
+        return self._build(key, suffix, download, meta)
+
+    def stage(self, name: str, inputs: Dict[str, object], code: Union[Callable, Sequence[Callable]], suffix: str,
+              build: Callable[[str], None]) -> Tuple[str, str]:
+        """(path, digest) of a stage output; build(path) runs only when the fingerprint is new.
+
+        code: the function(s) whose source defines the stage, so editing them rebuilds it.
+        """
+        fp = fingerprint(name, inputs, code)
+        key = f"stage/{name}/{fp}"
+        hit = self.lookup(key)
+        if hit is not None:
+            print(f"[Cache] Stage '{name}' unchanged ({fp[:12]}); reusing output")
+            return hit
+        print(f"[Cache] Building stage '{name}' ({fp[:12]}) ...")
+        return self._build(key, suffix, build, {"stage": name, "inputs": inputs})
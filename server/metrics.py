@@ -0,0 +1,174 @@
+"""Lightweight hot-path instrumentation with Prometheus text exposition.
+
+Request handlers wrap the interesting parts of their work in `stage("name")`.
+Timings are collected per request (see `begin_request`/`end_request`, driven by
+the HTTP middleware in app.py) and recorded into histograms labelled with the
+stage and the route template once the route is known. Outside of a request
+(scripts, benchmarks) stages are recorded immediately with endpoint="-".
+
+No third-party client library is needed; `render()` produces the Prometheus
+text format served by GET /metrics.
+"""
+from __future__ import annotations
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Iterable[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for key, counts, total, n in sorted(series):
+            cum = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                cum += c
+                le_s = "+Inf" if le == float("inf") else repr(float(le))
+                lines.append(f"{self.name}_bucket{_fmt_labels(key + (('le', le_s),))} {cum}")
+            lines.append(f"{self.name}_sum{_fmt_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(key)} {n}")
+        return lines
+
+
+class Gauge:
+    """A labelled value; `kind` can be set to "counter" for monotonic values read from elsewhere."""
+
+    def __init__(self, name: str, help: str, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            lines.append(f"{self.name}{_fmt_labels(key)} {v}")
+        return lines
+
+
+def _fmt_labels(key: Labels) -> str:
+    if not key:
+        return ""
+    inner = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in key)
+    return "{" + inner + "}"
+
+
+STAGE_SECONDS = Histogram("delhiflow_stage_seconds", "Time spent in each hot-path stage.", LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram("delhiflow_request_seconds", "End-to-end request latency per endpoint.", LATENCY_BUCKETS)
+BATCH_SIZE = Histogram("delhiflow_batch_size", "Rows per model call.", SIZE_BUCKETS)
+MODEL_LOAD_SECONDS = Gauge("delhiflow_model_load_seconds", "Wall time of the last artifact load.")
+REQUESTS_TOTAL = Gauge("delhiflow_requests_total", "Requests served per endpoint and status.", kind="counter")
+
+_METRICS = [REQUEST_SECONDS, STAGE_SECONDS, BATCH_SIZE, MODEL_LOAD_SECONDS, REQUESTS_TOTAL]
+_COLLECTORS: List[Callable[[], List[str]]] = []
+
+# Per-request collection of (kind, name, value) observations; None outside a request.
+_REQUEST: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("delhiflow_request_metrics", default=None)
+
+
+def register_collector(fn: Callable[[], List[str]]):
+    """Register a callable returning extra exposition lines (e.g. cache counters)."""
+    _COLLECTORS.append(fn)
+
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        obs = _REQUEST.get()
+        if obs is None:
+            STAGE_SECONDS.observe(dt, stage=name, endpoint="-")
+        else:
+            obs.append(("stage", name, dt))
+
+
+def observe_batch(n: int):
+    obs = _REQUEST.get()
+    if obs is None:
+        BATCH_SIZE.observe(n, endpoint="-")
+    else:
+        obs.append(("batch", "", n))
+
+
+def begin_request():
+    obs: list = []
+    return _REQUEST.set(obs), obs
+
+
+def end_request(token, obs: list, endpoint: str, method: str, status: int, elapsed: float):
+    """Flush a request's observations into the histograms, labelled with its route."""
+    _REQUEST.reset(token)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=method)
+    REQUESTS_TOTAL.inc(1, endpoint=endpoint, method=method, status=status)
+    for kind, name, value in obs:
+        if kind == "stage":
+            STAGE_SECONDS.observe(value, stage=name, endpoint=endpoint)
+        else:
+            BATCH_SIZE.observe(value, endpoint=endpoint)
+
+
+def server_timing(obs: list, elapsed: float) -> str:
+    """Format a request's stage timings as a Server-Timing header value."""
+    totals: Dict[str, float] = {}
+    for kind, name, value in obs:
+        if kind == "stage":
+            totals[name] = totals.get(name, 0.0) + value
+    parts = [f"{name};dur={dur * 1000:.2f}" for name, dur in totals.items()]
+    parts.append(f"total;dur={elapsed * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _METRICS:
+        lines.extend(m.render())
+    for fn in _COLLECTORS:
+        try:
+            lines.extend(fn())
+        except Exception as ex:
+            print(f"[METRICS] Collector failed: {ex}")
+    return "\n".join(lines) + "\n"
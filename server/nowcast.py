@@ -0,0 +1,222 @@
+"""Live nowcasting state: per-grid ring buffers of sensor/rain observations.
+
+Each grid owns a fixed number of hourly slots in plain NumPy arrays (rain,
+drain level, soil moisture and the absolute hour each slot holds). The slot
+for hour h is h % capacity, so advancing time never shifts data: a slot whose
+tag is not the expected hour is simply treated as empty.
+
+Ingest applies a whole tick of updates with array operations and marks only
+the touched grids dirty; `rescore` runs the model on those grids alone, which
+keeps a city-wide tick in the milliseconds range.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+try:
+    from .dataset_index import NS_PER_HOUR, time_columns  # type: ignore
+except Exception:
+    from dataset_index import NS_PER_HOUR, time_columns  # type: ignore
+
+# Model inputs for grids whose sensors have not reported drain/soil yet.
+DEFAULT_DRAIN_LEVEL = 0.8
+DEFAULT_SOIL_MOISTURE = 0.4
+
+
+class NowcastStore:
+    def __init__(self, grid_ids: Sequence[int], elevation: Sequence[float], road_density: Sequence[float],
+                 capacity: int = 24, window_h: int = 3):
+        order = np.argsort(np.asarray(grid_ids, dtype=np.int64))
+        self.grid_ids = np.asarray(grid_ids, dtype=np.int64)[order]
+        self.elevation = np.asarray(elevation, dtype=float)[order]
+        self.road_density = np.asarray(road_density, dtype=float)[order]
+        self.capacity = int(capacity)
+        self.window_h = int(window_h)
+        n = len(self.grid_ids)
+
+        self.rain = np.zeros((n, self.capacity))
+        self.drain = np.full((n, self.capacity), np.nan)
+        self.soil = np.full((n, self.capacity), np.nan)
+        self.tag = np.full((n, self.capacity), -1, dtype=np.int64)  # absolute hour held by each slot
+        self.latest = np.full(n, -1, dtype=np.int64)  # latest hour observed per grid
+        self.rain_past3h = np.zeros(n)
+
+        self.dirty = np.zeros(n, dtype=bool)
+        self.risk_class = np.full(n, -1, dtype=np.int64)
+        self.risk_label = np.full(n, "", dtype=object)
+        self.confidence = np.full(n, np.nan)
+        self.scored_hour = np.full(n, -1, dtype=np.int64)
+        self.ticks = 0
+        self._lock = threading.Lock()
+
+    def positions(self, grid_ids) -> np.ndarray:
+        """Row positions for grid_ids; -1 for unknown grids."""
+        g = np.asarray(grid_ids, dtype=np.int64)
+        if len(self.grid_ids) == 0:
+            return np.full(len(g), -1, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self.grid_ids, g), 0, len(self.grid_ids) - 1)
+        return np.where(self.grid_ids[pos] == g, pos, -1)
+
+    def ingest(self, grid_ids, hours, rain_mm=None, drain_level=None, soil_moisture=None) -> Dict[str, int]:
+        """Apply one tick of observations.
+
+        hours are absolute hours (nanoseconds since epoch // NS_PER_HOUR). NaN or
+        missing rain/drain/soil means "not reported": rain then stays as is for an
+        existing slot (0 for a new hour), drain/soil carry forward from the latest hour.
+        """
+        pos = self.positions(grid_ids)
+        hours = np.broadcast_to(np.asarray(hours, dtype=np.int64), pos.shape)
+        n = len(pos)
+        rain = np.full(n, np.nan) if rain_mm is None else np.asarray(rain_mm, dtype=float)
+        drain = np.full(n, np.nan) if drain_level is None else np.asarray(drain_level, dtype=float)
+        soil = np.full(n, np.nan) if soil_moisture is None else np.asarray(soil_moisture, dtype=float)
+
+        with self._lock:
+            known = pos >= 0
+            # late data that already fell out of the ring cannot be stored
+            fresh = known & (hours > self.latest[np.maximum(pos, 0)] - self.capacity)
+            unknown = int((~known).sum())
+            too_old = int((known & ~fresh).sum())
+            idx = np.flatnonzero(fresh)
+            # apply in time order; a grid with several updates in one tick is handled in rounds
+            idx = idx[np.argsort(hours[idx], kind="stable")]
+            while len(idx):
+                _, first = np.unique(pos[idx], return_index=True)
+                now = idx[first]
+                self._apply(pos[now], hours[now], rain[now], drain[now], soil[now])
+                idx = np.delete(idx, first)
+            self.ticks += 1
+        return {"accepted": int(len(np.flatnonzero(fresh))), "unknown_grid": unknown, "too_old": too_old}
+
+    def _apply(self, p, h, rain, drain, soil):
+        """Vectorized update where every grid position in p is distinct."""
+        slot = h % self.capacity
+        new_slot = self.tag[p, slot] != h
+        prev_latest = self.latest[p]
+        prev_slot = np.maximum(prev_latest, 0) % self.capacity
+        has_prev = prev_latest >= 0
+
+        # A new hour starts with no rain and inherits drain/soil from the latest hour.
+        self.rain[p[new_slot], slot[new_slot]] = 0.0
+        carry_drain = np.where(has_prev, self.drain[p, prev_slot], np.nan)
+        carry_soil = np.where(has_prev, self.soil[p, prev_slot], np.nan)
+        self.drain[p[new_slot], slot[new_slot]] = carry_drain[new_slot]
+        self.soil[p[new_slot], slot[new_slot]] = carry_soil[new_slot]
+        self.tag[p, slot] = h
+
+        got = ~np.isnan(rain)
+        self.rain[p[got], slot[got]] = rain[got]
+        got = ~np.isnan(drain)
+        self.drain[p[got], slot[got]] = drain[got]
+        got = ~np.isnan(soil)
+        self.soil[p[got], slot[got]] = soil[got]
+
+        self.latest[p] = np.maximum(prev_latest, h)
+        self.rain_past3h[p] = self._window_sum(p)
+        self.dirty[p] = True
+
+    def _window_sum(self, p) -> np.ndarray:
+        """Rain over the last window_h hours ending at each grid's latest hour (O(window) per grid)."""
+        total = np.zeros(len(p))
+        for k in range(self.window_h):
+            h = self.latest[p] - k
+            slot = h % self.capacity
+            valid = (h >= 0) & (self.tag[p, slot] == h)
+            total += np.where(valid, self.rain[p, slot], 0.0)
+        return total
+
+    def model_inputs(self, p) -> np.ndarray:
+        """(n, 9) rows in GridInput column order for the latest hour of each grid."""
+        h = self.latest[p]
+        slot = h % self.capacity
+        hour_of_day, month, dow = time_columns(h)
+        drain = self.drain[p, slot]
+        soil = self.soil[p, slot]
+        return np.column_stack([
+            self.elevation[p], self.road_density[p], self.rain[p, slot], self.rain_past3h[p],
+            np.where(np.isnan(drain), DEFAULT_DRAIN_LEVEL, drain),
+            np.where(np.isnan(soil), DEFAULT_SOIL_MOISTURE, soil),
+            hour_of_day.astype(float), month.astype(float), dow.astype(float),
+        ])
+
+    def rescore(self, predict: Callable[[np.ndarray], tuple]) -> Dict[str, object]:
+        """Score dirty grids only. predict(rows) -> (class ids, max prob, labels).
+
+        scored_hours in the result lists the absolute hours whose live risk was updated.
+        """
+        with self._lock:
+            p = np.flatnonzero(self.dirty & (self.latest >= 0))
+            if len(p) == 0:
+                return {"rescored": 0, "changed_grid_ids": [], "scored_hours": []}
+            classes, probs, labels = predict(self.model_inputs(p))
+            classes = np.asarray(classes, dtype=np.int64)
+            changed = p[self.risk_class[p] != classes]
+            self.risk_class[p] = classes
+            self.risk_label[p] = np.asarray(labels, dtype=object)
+            self.confidence[p] = np.round(np.asarray(probs, dtype=float) * 100, 2)
+            self.scored_hour[p] = self.latest[p]
+            self.dirty[p] = False
+            hours = np.unique(self.scored_hour[p])
+        return {"rescored": int(len(p)), "changed_grid_ids": self.grid_ids[changed].tolist(), "scored_hours": hours.tolist()}
+
+    def refresh_static(self, grid_ids, elevation, road_density) -> bool:
+        """Take static features from a new dataset and queue every live grid for rescoring.
+
+        Returns False (and changes nothing) when the grid set differs; callers then
+        start a fresh store.
+        """
+        g = np.asarray(grid_ids, dtype=np.int64)
+        order = np.argsort(g)
+        if not np.array_equal(g[order], self.grid_ids):
+            return False
+        with self._lock:
+            self.elevation = np.asarray(elevation, dtype=float)[order]
+            self.road_density = np.asarray(road_density, dtype=float)[order]
+            self.dirty[self.latest >= 0] = True
+        return True
+
+    def snapshot(self, grid_ids: Optional[Sequence[int]] = None) -> Dict[str, list]:
+        """Columnar live state for the given grids (default: all grids with observations)."""
+        with self._lock:
+            if grid_ids is None:
+                p = np.flatnonzero(self.latest >= 0)
+            else:
+                p = self.positions(grid_ids)
+                p = p[p >= 0]
+            h = self.latest[p]
+            slot = np.maximum(h, 0) % self.capacity
+            return {
+                "grid_id": self.grid_ids[p].tolist(),
+                "hour": [str(np.datetime64(int(x) * NS_PER_HOUR, "ns").astype("datetime64[h]")) if x >= 0 else None for x in h],
+                "rain_mm": self.rain[p, slot].tolist(),
+                "rain_past3h": self.rain_past3h[p].tolist(),
+                "class": self.risk_class[p].tolist(),
+                "label": self.risk_label[p].tolist(),
+                "confidence": [None if np.isnan(c) else float(c) for c in self.confidence[p]],
+                "stale": (self.scored_hour[p] != h).tolist(),
+            }
+
+
+def to_hours(timestamps) -> np.ndarray:
+    """Absolute hour numbers for datetime-like values, on the wall clock they were given in.
+
+    The dataset's Hour column is naive local time, so offsets such as +05:30 are dropped
+    rather than converted.
+    """
+    import pandas as pd
+
+    stamps = [pd.Timestamp(t) for t in timestamps]
+    naive = [t.tz_localize(None) if t.tzinfo is not None else t for t in stamps]
+    return pd.DatetimeIndex(naive).as_unit("ns").asi8 // NS_PER_HOUR
+
+
+def from_bundle(bundle, capacity: int = 24) -> Optional[NowcastStore]:
+    """Store sized to the bundle's grids, with their static Elevation/Road_Density."""
+    index = getattr(bundle, "index", None)
+    if index is None or len(index.grid_ids) == 0:
+        return None
+    static = index.features[index.starts]
+    return NowcastStore(index.grid_ids, static[:, 0], static[:, 1], capacity=capacity)
@@ -1,32 +1,62 @@
 from __future__ import annotations
-import io, os
+import os, time
+import pandas as pd
 from typing import List, Dict, Any, Optional
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from fastapi.responses import JSONResponse
 
+try:
+    from . import metrics  # type: ignore
+    from . import image_io  # type: ignore
+    from . import uploads  # type: ignore
+    from . import detection_log  # type: ignore
+except Exception:
+    import metrics  # type: ignore
+    import image_io  # type: ignore
+    import uploads  # type: ignore
+    import detection_log  # type: ignore
+
 router = APIRouter()
 
+# Detector input size; uploads are decoded to roughly this size (longer side) before inference
+DETECT_IMGSZ = int(os.getenv("DETECT_IMGSZ", "640"))
+# Sliced mode (/detect with sliced=true): overlapping tiles of the high-res image, batched
+SLICE_TILE = int(os.getenv("SLICE_TILE", "640"))
+SLICE_OVERLAP = float(os.getenv("SLICE_OVERLAP", "0.2"))
+SLICE_MAX_SIDE = int(os.getenv("SLICE_MAX_SIDE", "2560"))  # decode size cap in sliced mode
+SLICE_MAX_TILES = int(os.getenv("SLICE_MAX_TILES", "24"))  # image is downscaled until it fits
+SLICE_BATCH = int(os.getenv("SLICE_BATCH", "8"))  # tiles per detector call
+SLICE_MERGE_IOS = float(os.getenv("SLICE_MERGE_IOS", "0.6"))
+# The OpenCV fallback works on a pyramid level whose longer side is at most this
+FALLBACK_MAX_SIDE = int(os.getenv("FALLBACK_MAX_SIDE", "480"))
+
 # --- Dedicated pothole model loading logic ---
 POTHOLE_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'model', 'potholes.pt')
 GENERAL_MODEL_PATH = os.getenv("POTHOLES_MODEL_PATH", "yolov8n.pt")
 POTHOLE_MODEL = None
+POTHOLE_MODEL_VERSION = None
+_t0 = time.perf_counter()
 try:
     from ultralytics import YOLO  # type: ignore
     if os.path.exists(POTHOLE_MODEL_PATH):
         POTHOLE_MODEL = YOLO(POTHOLE_MODEL_PATH)
+        POTHOLE_MODEL_VERSION = detection_log.model_version(POTHOLE_MODEL_PATH)
         print(f"[MODEL] Loaded pothole model from {POTHOLE_MODEL_PATH}")
     else:
         POTHOLE_MODEL = YOLO(GENERAL_MODEL_PATH)
+        POTHOLE_MODEL_VERSION = detection_log.model_version(GENERAL_MODEL_PATH)
         print(f"[MODEL] Pothole model not found, falling back to {GENERAL_MODEL_PATH}")
 except Exception as e:
     POTHOLE_MODEL = None
     print(f"[MODEL] Failed to load pothole model: {e}")
+metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - _t0, artifact="pothole")
 
 _MODEL = None
 _MODEL_NAMES = None
+_MODEL_VERSION = None  # version of the weights _MODEL was loaded from, recorded with its detections
 
 def _get_model():
-    global _MODEL, _MODEL_NAMES
+    global _MODEL, _MODEL_NAMES, _MODEL_VERSION
     if _MODEL is not None:
         return _MODEL
     try:
@@ -36,20 +66,36 @@ def _get_model():
         _MODEL_NAMES = None
         return None
     model_path = os.getenv("POTHOLES_MODEL_PATH", "yolov8n.pt")
+    t0 = time.perf_counter()
     try:
         _MODEL = YOLO(model_path)
         _MODEL_NAMES = getattr(_MODEL, "names", {0: "Pothole"})
+        _MODEL_VERSION = detection_log.model_version(model_path)
     except Exception:
         _MODEL = None
         _MODEL_NAMES = None
+    metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - t0, artifact="detector")
     return _MODEL
 
+
+def _log_detections(source: str, engine: str, version: str, boxes: List[List[float]], scores: List[Optional[float]],
+                    width: int, height: int, lat: Optional[float], lon: Optional[float]):
+    with metrics.stage("detection_log"):
+        detection_log.shared().append(source, engine, version, boxes, scores, width, height, lat=lat, lon=lon)
+
 def _dummy_boxes(w: int, h: int) -> List[Dict[str, Any]]:
     bw, bh = int(w * 0.25), int(h * 0.25)
     x, y = int((w - bw) / 2), int((h - bh) / 2)
     return [{"x": x, "y": y, "width": bw, "height": bh, "score": 0.88, "label": "Pothole"}]
 
 def _cv2_fallback(img) -> List[Dict[str, Any]]:
+    """Dark-blob heuristic used when the detector has no pothole class.
+
+    Runs on a pyrDown level of the frame: threshold + edges, closing, then
+    connectedComponentsWithStats for the blobs. Darkness per blob is its box mean
+    from an integral image, so scoring is a few array operations whatever the blob count.
+    Boxes are returned in the input frame's pixels.
+    """
     import numpy as np, cv2
     if isinstance(img, bytes):
         np_arr = np.frombuffer(img, np.uint8)
@@ -58,8 +104,13 @@ def _cv2_fallback(img) -> List[Dict[str, Any]]:
         frame = img
     if frame is None:
         return []
-    h, w = frame.shape[:2]
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    factor = 1
+    while max(gray.shape[:2]) > FALLBACK_MAX_SIDE:
+        gray = cv2.pyrDown(gray)
+        factor *= 2
+    h, w = gray.shape[:2]
+
     blur = cv2.GaussianBlur(gray, (5, 5), 0)
     thr = max(10, int(gray.mean() * 0.9))
     _, mask = cv2.threshold(blur, thr, 255, cv2.THRESH_BINARY_INV)
@@ -67,60 +118,137 @@ def _cv2_fallback(img) -> List[Dict[str, Any]]:
     mask = cv2.bitwise_or(mask, edges)
     kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
     mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-    cnts, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if n <= 1:
+        return []
+    x, y, bw, bh = (stats[1:, k].astype(np.int64) for k in (cv2.CC_STAT_LEFT, cv2.CC_STAT_TOP, cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT))
     img_area = float(w * h)
-    dets: List[Dict[str, Any]] = []
-    for c in cnts:
-        x, y, bw, bh = cv2.boundingRect(c)
-        area = bw * bh
-        if area < img_area * 0.0003 or area > img_area * 0.25:
-            continue
-        roi = gray[y:y+bh, x:x+bw]
-        if roi.size == 0:
+    area = bw * bh
+    keep = (area >= img_area * 0.0003) & (area <= img_area * 0.25)
+    if not keep.any():
+        return []
+    x, y, bw, bh, area = x[keep], y[keep], bw[keep], bh[keep], area[keep]
+
+    integral = cv2.integral(gray, sdepth=cv2.CV_64F)
+    box_sum = integral[y + bh, x + bw] - integral[y, x + bw] - integral[y + bh, x] + integral[y, x]
+    darkness = 1.0 - (box_sum / area) / 255.0
+    size_score = np.minimum(1.0, area / (img_area * 0.02))
+    score = np.maximum(0.1, 0.5 * darkness + 0.5 * size_score)
+
+    order = np.argsort(-score, kind="stable")[:50]
+    return [
+        {"x": float(x[i] * factor), "y": float(y[i] * factor), "width": float(bw[i] * factor), "height": float(bh[i] * factor),
+         "score": round(float(score[i]), 3), "label": "Pothole"}
+        for i in order
+    ]
+
+
+def _tile_offsets(length: int, tile: int, stride: int) -> List[int]:
+    """Start offsets covering [0, length) with tiles of size tile; the last tile is flush with the end."""
+    if length <= tile:
+        return [0]
+    offsets = list(range(0, length - tile, stride))
+    offsets.append(length - tile)
+    return offsets
+
+
+def _slice_grid(w: int, h: int, tile: int, overlap: float):
+    stride = max(1, int(tile * (1.0 - overlap)))
+    return [(x, y) for y in _tile_offsets(h, tile, stride) for x in _tile_offsets(w, tile, stride)]
+
+
+def _merge_boxes(xyxy, scores, ios_threshold: float):
+    """Greedy cross-tile NMS; a box is dropped when it covers more than ios_threshold of a
+    higher-scoring box or is covered that much by it (intersection over the smaller box),
+    which also removes the partial copies of an object cut by a tile edge."""
+    import numpy as np
+    order = np.argsort(-scores)
+    xyxy, scores = xyxy[order], scores[order]
+    area = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    keep = []
+    suppressed = np.zeros(len(xyxy), dtype=bool)
+    for i in range(len(xyxy)):
+        if suppressed[i]:
             continue
-        darkness = 1.0 - (float(roi.mean()) / 255.0)
-        size_score = min(1.0, area / (img_area * 0.02))
-        score = max(0.1, 0.5 * darkness + 0.5 * size_score)
-        dets.append({"x": float(x), "y": float(y), "width": float(bw), "height": float(bh), "score": round(float(score), 3), "label": "Pothole"})
-    dets.sort(key=lambda d: d["score"], reverse=True)
-    return dets[:50]
+        keep.append(i)
+        ix1 = np.maximum(xyxy[i, 0], xyxy[i + 1:, 0])
+        iy1 = np.maximum(xyxy[i, 1], xyxy[i + 1:, 1])
+        ix2 = np.minimum(xyxy[i, 2], xyxy[i + 1:, 2])
+        iy2 = np.minimum(xyxy[i, 3], xyxy[i + 1:, 3])
+        inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+        smaller = np.maximum(np.minimum(area[i], area[i + 1:]), 1e-9)
+        suppressed[i + 1:] |= inter / smaller > ios_threshold
+    return xyxy[keep], scores[keep]
+
+
+def _sliced_predict(model, img, tile: int, overlap: float):
+    """Run the detector on overlapping tiles (plus the whole frame) in bounded batches.
+
+    Returns (xyxy in img.bgr pixels, scores, number of tiles). The frame is downscaled
+    first if it would need more than SLICE_MAX_TILES tiles, which bounds memory per request.
+    """
+    import numpy as np, cv2
+    frame = img.bgr
+    h, w = frame.shape[:2]
+    grid = _slice_grid(w, h, tile, overlap)
+    shrink = 1.0
+    while len(grid) > SLICE_MAX_TILES:
+        shrink *= 0.9
+        grid = _slice_grid(int(w * shrink), int(h * shrink), tile, overlap)
+    if shrink < 1.0:
+        frame = cv2.resize(frame, (int(w * shrink), int(h * shrink)), interpolation=cv2.INTER_AREA)
+
+    # views, not copies; the whole frame catches potholes larger than a tile
+    sources = [frame] + [frame[y:y + tile, x:x + tile] for x, y in grid]
+    offsets = [(0, 0)] + grid
+    boxes, scores = [], []
+    for start in range(0, len(sources), max(1, SLICE_BATCH)):
+        batch = sources[start:start + SLICE_BATCH]
+        results = model.predict(batch, imgsz=tile, conf=0.25, verbose=False)
+        for res, (ox, oy) in zip(results, offsets[start:start + SLICE_BATCH]):
+            b = getattr(res, "boxes", None)
+            if b is None or not hasattr(b, "xyxy") or len(b) == 0:
+                continue
+            names = getattr(res, "names", _MODEL_NAMES) or {}
+            cls = b.cls.cpu().numpy().astype(int) if hasattr(b, "cls") else np.zeros(len(b), dtype=int)
+            is_pothole = np.array(["pothole" in str(names.get(int(c), "")).lower() for c in cls], dtype=bool)
+            xyxy = b.xyxy.cpu().numpy()[is_pothole] + np.array([ox, oy, ox, oy])
+            boxes.append(xyxy / shrink)
+            scores.append(b.conf.cpu().numpy()[is_pothole])
+    if not boxes:
+        return np.empty((0, 4)), np.empty(0), len(grid)
+    xyxy, sc = _merge_boxes(np.concatenate(boxes), np.concatenate(scores).astype(float), SLICE_MERGE_IOS)
+    return xyxy, sc, len(grid)
+
 
 @router.post("/detect")
-async def detect_potholes(image: UploadFile = File(None), file: UploadFile = File(None)):
+async def detect_potholes(image: UploadFile = File(None), file: UploadFile = File(None), sliced: bool = Form(False),
+                          tile: Optional[int] = Form(None), overlap: Optional[float] = Form(None),
+                          lat: Optional[float] = Form(None), lon: Optional[float] = Form(None)):
+    """Detect potholes in an uploaded photo.
+
+    Every request is recorded in the detection log (see detection_log); optional lat/lon
+    place it on a Grid_ID for /potholes/detections/counts.
+
+    sliced=true runs the detector on overlapping tiles of a higher-resolution decode and
+    merges boxes across tiles, which finds small/distant potholes at the cost of more
+    inference (tile, overlap default to SLICE_TILE, SLICE_OVERLAP).
+    """
     # Accept both 'image' and 'file' field names
     upload: Optional[UploadFile] = image or file
     if upload is None:
         return JSONResponse({"detections": [], "error": "No file field 'image' or 'file' provided"}, status_code=400)
 
+    uploads.check_size(upload, uploads.MAX_IMAGE_BYTES)
+    # One reduced-size BGR array feeds both YOLO and the OpenCV fallback; boxes are
+    # mapped back to the original resolution (PIL first, OpenCV for other formats).
     try:
-        from PIL import Image
+        with metrics.stage("image_decode"):
+            img = image_io.decode(upload.file, target=SLICE_MAX_SIDE if sliced else DETECT_IMGSZ)
     except Exception:
-        # If Pillow missing, try OpenCV path directly
-        data = await upload.read()
-        try:
-            dets = _cv2_fallback(data)
-        except Exception:
-            dets = []
-        if not dets:
-            dets = _dummy_boxes(640, 360)
-        return {"detections": dets, "image_size": {"width": 640, "height": 360}, "engine": "cv2_no_pillow"}
-
-    data = await upload.read()
-    # Decode with Pillow; fallback to OpenCV if Pillow can't decode (e.g., unsupported format)
-    try:
-        pil_img = Image.open(io.BytesIO(data)).convert("RGB")
-        w, h = pil_img.size
-    except Exception:
-        try:
-            import numpy as np, cv2
-            bgr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
-            if bgr is None:
-                raise ValueError("decode failed")
-            h, w = bgr.shape[:2]
-            dets = _cv2_fallback(bgr)
-            return {"detections": dets or _dummy_boxes(w, h), "image_size": {"width": w, "height": h}, "engine": "cv2_fallback"}
-        except Exception:
-            return {"detections": _dummy_boxes(640, 360), "image_size": {"width": 640, "height": 360}, "engine": "dummy"}
+        return {"detections": _dummy_boxes(640, 360), "image_size": {"width": 640, "height": 360}, "engine": "dummy"}
+    w, h = img.width, img.height
 
     # Try YOLO (only if model knows 'pothole'); otherwise cv2 fallback
     detections: List[Dict[str, Any]] = []
@@ -132,14 +260,26 @@ async def detect_potholes(image: UploadFile = File(None), file: UploadFile = Fil
     except Exception:
         model_has_pothole = False
 
-    if model is not None and model_has_pothole:
+    n_tiles = 0
+    if model is not None and model_has_pothole and sliced:
+        tile_px = min(max(int(tile or SLICE_TILE), 160), 1280)
+        tile_overlap = min(max(float(SLICE_OVERLAP if overlap is None else overlap), 0.0), 0.5)
+        try:
+            with metrics.stage("yolo_inference"):
+                xyxy, confs, n_tiles = _sliced_predict(model, img, tile_px, tile_overlap)
+            for (x1, y1, x2, y2), sc in zip(img.to_original(xyxy).tolist(), confs.tolist()):
+                detections.append({"x": float(x1), "y": float(y1), "width": float(x2 - x1), "height": float(y2 - y1), "score": float(sc), "label": "Pothole"})
+        except Exception:
+            detections = []
+    elif model is not None and model_has_pothole:
         try:
-            results = model.predict(pil_img, imgsz=640, conf=0.25, verbose=False)
+            with metrics.stage("yolo_inference"):
+                results = model.predict(img.bgr, imgsz=DETECT_IMGSZ, conf=0.25, verbose=False)
             res = results[0]
             boxes = getattr(res, "boxes", None)
             names = getattr(res, "names", _MODEL_NAMES) or {}
             if boxes is not None and hasattr(boxes, "xyxy"):
-                xyxy = boxes.xyxy.cpu().tolist()
+                xyxy = img.to_original(boxes.xyxy.cpu().numpy()).tolist()
                 confs = boxes.conf.cpu().tolist() if hasattr(boxes, "conf") else [None] * len(xyxy)
                 clss = boxes.cls.cpu().tolist() if hasattr(boxes, "cls") else [0] * len(xyxy)
                 for (x1, y1, x2, y2), sc, c in zip(xyxy, confs, clss):
@@ -151,18 +291,33 @@ async def detect_potholes(image: UploadFile = File(None), file: UploadFile = Fil
             detections = []
 
     if not detections:
-        import numpy as np, cv2
-        bgr = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-        detections = _cv2_fallback(bgr)
+        scale = DETECT_IMGSZ / max(img.bgr.shape[:2])
+        if sliced and scale < 1.0:
+            # the fallback's thresholds are tuned for detector-sized frames
+            import cv2
+            small = cv2.resize(img.bgr, (int(img.bgr.shape[1] * scale), int(img.bgr.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+            img = image_io.DecodedImage(small, img.width, img.height, img.format)
+        with metrics.stage("cv2_fallback"):
+            detections = img.detections_to_original(_cv2_fallback(img.bgr))
         engine = "cv2_fallback"
     else:
-        engine = "ultralytics"
+        engine = "ultralytics_sliced" if n_tiles else "ultralytics"
 
+    # logged before the dummy boxes, which are a placeholder for the UI, not detections
+    _log_detections(
+        "detect", engine if detections else "dummy",
+        _MODEL_VERSION if engine.startswith("ultralytics") else engine,
+        [[d["x"], d["y"], d["x"] + d["width"], d["y"] + d["height"]] for d in detections], [d["score"] for d in detections],
+        w, h, lat, lon,
+    )
     if not detections:
         detections = _dummy_boxes(w, h)
         engine = "dummy"
 
-    return {"detections": detections, "image_size": {"width": w, "height": h}, "engine": engine}
+    result = {"detections": detections, "image_size": {"width": w, "height": h}, "engine": engine}
+    if n_tiles:
+        result["tiles"] = n_tiles
+    return result
 
 @router.post('/analyze_issue')
 async def analyze_issue(
@@ -184,15 +339,18 @@ async def analyze_issue(
     if POTHOLE_MODEL is None:
         raise HTTPException(status_code=500, detail='Pothole model not available on server')
 
-    data = await file.read()
+    # The upload is already spooled to a temp file by the form parser; never load it whole
+    uploads.check_size(file, uploads.MAX_IMAGE_BYTES if content_type.startswith('image/') else uploads.MAX_UPLOAD_BYTES)
 
     if content_type.startswith('image/'):
-        np_arr = np.frombuffer(data, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        if img is None:
+        try:
+            with metrics.stage("image_decode"):
+                img = image_io.decode(file.file, target=DETECT_IMGSZ)
+        except ValueError:
             raise HTTPException(status_code=400, detail='Could not decode image')
         try:
-            results = POTHOLE_MODEL(img)
+            with metrics.stage("yolo_inference"):
+                results = POTHOLE_MODEL(img.bgr, imgsz=DETECT_IMGSZ)
         except Exception as e:
             print(f"[ANALYZE] Model inference failed: {e}")
             raise HTTPException(status_code=500, detail='Model inference failed')
@@ -206,8 +364,10 @@ async def analyze_issue(
             label = names.get(cls, str(cls)) if isinstance(names, dict) else str(cls)
             if str(label).lower() == 'pothole' or cls == 0:
                 pothole_detected = True
-                x1, y1, x2, y2 = map(float, box.xyxy[0]) if hasattr(box, 'xyxy') else (0,0,0,0)
+                x1, y1, x2, y2 = map(float, img.to_original(box.xyxy[0].cpu().numpy())[0]) if hasattr(box, 'xyxy') else (0,0,0,0)
                 pothole_boxes.append({'bbox': [x1, y1, x2, y2], 'confidence': conf, 'class': cls, 'label': label})
+        _log_detections("analyze_issue", "ultralytics", POTHOLE_MODEL_VERSION, [b['bbox'] for b in pothole_boxes],
+                        [b['confidence'] for b in pothole_boxes], img.width, img.height, lat, lon)
         report_sent = False
         if pothole_detected:
             try:
@@ -225,18 +385,14 @@ async def analyze_issue(
     else:
         # For videos: save temporarily and analyze first frame
         try:
-            tmp_path = os.path.join(os.path.dirname(__file__), 'temp_upload')
-            os.makedirs(tmp_path, exist_ok=True)
-            tmp_file = os.path.join(tmp_path, file.filename)
-            with open(tmp_file, 'wb') as f:
-                f.write(data)
-            cap = cv2.VideoCapture(tmp_file)
-            ret, frame = cap.read()
-            cap.release()
-            os.remove(tmp_file)
+            with uploads.spooled_path(file) as tmp_file:
+                cap = cv2.VideoCapture(tmp_file)
+                ret, frame = cap.read()
+                cap.release()
             if not ret or frame is None:
                 raise HTTPException(status_code=400, detail='Could not read video frame')
-            results = POTHOLE_MODEL(frame)
+            with metrics.stage("yolo_inference"):
+                results = POTHOLE_MODEL(frame)
             detections = results[0].boxes
             pothole_detected = False
             pothole_boxes = []
@@ -249,6 +405,8 @@ async def analyze_issue(
                     pothole_detected = True
                     x1, y1, x2, y2 = map(float, box.xyxy[0]) if hasattr(box, 'xyxy') else (0,0,0,0)
                     pothole_boxes.append({'bbox': [x1, y1, x2, y2], 'confidence': conf, 'class': cls, 'label': label})
+            _log_detections("analyze_issue_video", "ultralytics", POTHOLE_MODEL_VERSION, [b['bbox'] for b in pothole_boxes],
+                            [b['confidence'] for b in pothole_boxes], frame.shape[1], frame.shape[0], lat, lon)
             report_sent = False
             if pothole_detected:
                 try:
@@ -266,4 +424,33 @@ async def analyze_issue(
             raise
         except Exception as e:
             print(f"[ANALYZE VIDEO] Failed: {e}")
-            raise HTTPException(status_code=500, detail='Video analysis failed')
\ No newline at end of file
+            raise HTTPException(status_code=500, detail='Video analysis failed')
+
+@router.get("/detections/counts")
+def detection_counts(start: Optional[str] = None, end: Optional[str] = None, grid_ids: Optional[str] = None, bucket: str = "day"):
+    """Per-grid detection counts in [start, end) (UTC; default the last 7 days).
+
+    grid_ids is a comma-separated list (default: every grid with a located report);
+    bucket is hour, day or none. Only the date partitions overlapping the range are read.
+    """
+    def utc(ts: pd.Timestamp) -> pd.Timestamp:
+        # naive bounds are UTC; aware ones are converted, so the two always compare
+        return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+    try:
+        end_ts = utc(pd.Timestamp(end)) if end else pd.Timestamp.now(tz="UTC")
+        start_ts = utc(pd.Timestamp(start)) if start else end_ts - pd.Timedelta(days=7)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid start/end format")
+    if start_ts >= end_ts:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    try:
+        ids = [int(g) for g in grid_ids.split(",") if g.strip()] if grid_ids else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="grid_ids must be comma-separated integers")
+    try:
+        with metrics.stage("detection_query"):
+            result = detection_log.shared().counts(start_ts, end_ts, grid_ids=ids, bucket=None if bucket == "none" else bucket)
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+    return {"start": start_ts.isoformat(), "end": end_ts.isoformat(), "bucket": bucket, **result}
@@ -0,0 +1,129 @@
+"""Bounded LRU/TTL cache for flood predictions.
+
+Predictions are deterministic for a given grid, time bucket and artifact
+version, so repeated requests for the same hot cells (e.g. during a rain event)
+can be served from memory instead of re-running the dataset lookup and model.
+
+The cache is thread-safe (sync FastAPI endpoints run in a threadpool) and
+protects against stampedes: when several requests miss on the same key at the
+same time, only the first one computes the value and the rest wait for it.
+
+Configuration (env vars):
+ - PREDICTION_CACHE_SIZE   max number of entries (default 4096, 0 disables)
+ - PREDICTION_CACHE_TTL_S  entry lifetime in seconds (default 3600)
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+class _InFlight:
+    """A computation in progress that other callers can wait on."""
+
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class PredictionCache:
+    def __init__(self, maxsize: int = 4096, ttl_s: float = 3600.0):
+        self.maxsize = int(maxsize)
+        self.ttl_s = float(ttl_s)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, _InFlight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached value for key, computing it at most once on a miss."""
+        if self.maxsize <= 0:
+            return compute()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            pending = self._inflight.get(key)
+            if pending is None:
+                pending = _InFlight()
+                self._inflight[key] = pending
+                owner = True
+                self.misses += 1
+            else:
+                owner = False
+                self.waits += 1
+
+        if not owner:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            value = compute()
+        except BaseException as ex:
+            pending.error = ex
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.event.set()
+            raise
+
+        pending.value = value
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_s, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            self._inflight.pop(key, None)
+        pending.event.set()
+        return value
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.waits
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                # waiters were served without recomputing, so they count as hits
+                "hit_rate": round((self.hits + self.waits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+def from_env() -> PredictionCache:
+    return PredictionCache(
+        maxsize=int(os.getenv("PREDICTION_CACHE_SIZE", "4096")),
+        ttl_s=float(os.getenv("PREDICTION_CACHE_TTL_S", "3600")),
+    )
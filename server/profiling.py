@@ -0,0 +1,240 @@
+"""On-demand sampling profiler and allocation tracing for a live worker.
+
+Nothing here runs until an admin starts a session, so a server that never
+profiles pays nothing. A session lasts at most MAX_SECONDS and:
+
+ - samples every thread's stack with sys._current_frames() every interval
+   from a daemon thread, keeping only stacks that pass through the endpoint
+   function of a selected route (sync endpoints run in the threadpool,
+   async ones on the event loop; both show up with their endpoint frame).
+   Stacks are trimmed to start at the endpoint and counted in collapsed form
+   ("endpoint;helper;leaf count" per line), which flamegraph.pl and
+   speedscope read directly;
+ - optionally runs tracemalloc for the window and reports the traced peak (whole
+   process) and the allocation sites whose live memory grew the most, counting only
+   allocations made under a selected endpoint. Live growth is what a request
+   leaves behind (caches, leaks); memory a request frees before it returns is
+   only visible in the peak.
+
+Frames are identified by function, not line, so samples aggregate per call
+path. Sampling holds the GIL briefly each tick: at the default 5 ms interval a
+busy worker loses roughly 10% throughput while a session runs; a longer
+interval_ms costs proportionally less.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Longest accepted profiling window, in seconds
+MAX_SECONDS = float(os.getenv("PROFILE_MAX_S", "120"))
+# Frames kept per allocation traceback; deep enough to reach the endpoint from numpy/sklearn internals
+TRACE_FRAMES = int(os.getenv("PROFILE_TRACE_FRAMES", "48"))
+# Deepest stack walked per sample
+MAX_STACK = 256
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _line_span(code):
+    lines = [line for _, _, line in code.co_lines() if line is not None] if hasattr(code, "co_lines") else []
+    return code.co_filename, code.co_firstlineno, max(lines, default=code.co_firstlineno)
+
+
+class ProfileSession:
+    def __init__(self, endpoints: Dict[object, str], seconds: float, interval: float, memory: bool, top: int = 30):
+        """endpoints maps endpoint code objects to route paths; empty profiles every thread."""
+        self.endpoints = dict(endpoints)
+        self.seconds = seconds
+        self.interval = interval
+        self.memory = memory
+        self.top = top
+        self.started_at = time.time()
+        self.stopped_at: Optional[float] = None
+        self.stacks: Counter = Counter()
+        self.samples = 0  # sampler ticks
+        self.hits: Counter = Counter()  # samples per route
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._result: Optional[dict] = None
+        self._mem_before = None
+        if memory:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start(TRACE_FRAMES)
+            tracemalloc.reset_peak()
+            self._mem_before = tracemalloc.take_snapshot()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self) -> bool:
+        return self.stopped_at is None
+
+    def _run(self):
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid != own:
+                    self._sample(frame)
+            self.samples += 1
+            if time.monotonic() >= deadline:
+                break
+        self.stop()
+
+    def _sample(self, frame):
+        names = []
+        route = None
+        depth = 0
+        while frame is not None and depth < MAX_STACK:
+            code = frame.f_code
+            names.append(_frame_name(code))
+            if code in self.endpoints:
+                # outermost endpoint frame wins; the stack above it is framework plumbing
+                route = self.endpoints[code]
+                root = len(names)
+            frame = frame.f_back
+            depth += 1
+        if route is None and self.endpoints:
+            return
+        if route is not None:
+            names = names[:root]
+        self.stacks[";".join(reversed(names))] += 1
+        self.hits[route or "*"] += 1
+
+    def stop(self) -> dict:
+        """End the session (idempotent) and return its result."""
+        self._stop.set()
+        if threading.current_thread() is not self._thread:
+            # outside the lock: the sampler thread finishes through stop() too
+            self._thread.join()
+        with self._lock:
+            if self._result is not None:
+                return self._result
+            self.stopped_at = time.time()
+            result = {
+                "routes": sorted(set(self.endpoints.values())) or None,
+                "started_at": self.started_at,
+                "duration_s": round(self.stopped_at - self.started_at, 3),
+                "interval_ms": round(self.interval * 1000, 3),
+                "ticks": self.samples,
+                "samples": dict(self.hits),
+                "top_frames": self._top_frames(),
+                "collapsed": self.collapsed(),
+            }
+            if self.memory:
+                result["memory"] = self._memory()
+            self._result = result
+            return result
+
+    def collapsed(self) -> str:
+        # copy first: the sampler may still be adding stacks
+        stacks = dict(self.stacks)
+        return "\n".join(f"{stack} {n}" for stack, n in sorted(stacks.items(), key=lambda kv: -kv[1]))
+
+    def _top_frames(self) -> Dict[str, list]:
+        """Functions by own (leaf) and total (anywhere on the stack) sample counts, columnar."""
+        own, total = Counter(), Counter()
+        for stack, n in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += n
+            for name in set(frames):
+                total[name] += n
+        names = [name for name, _ in own.most_common(self.top)]
+        return {"frame": names, "own": [own[n] for n in names], "total": [total[n] for n in names]}
+
+    def _memory(self) -> dict:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if self._started_tracing:
+            tracemalloc.stop()
+        spans = [_line_span(code) for code in self.endpoints]
+
+        def sites(snapshot):
+            sizes, counts = Counter(), Counter()
+            for trace in snapshot.traces:
+                frames = trace.traceback
+                if spans and not any(f.filename == fn and lo <= f.lineno <= hi for f in frames for fn, lo, hi in spans):
+                    continue
+                # frames run from the oldest call to the allocation
+                site = f"{frames[-1].filename}:{frames[-1].lineno}"
+                sizes[site] += trace.size
+                counts[site] += 1
+            return sizes, counts
+
+        before_size, before_count = sites(self._mem_before)
+        after_size, after_count = sites(after)
+        self._mem_before = None
+        growth = Counter({s: after_size[s] - before_size.get(s, 0) for s in after_size})
+        top = [(s, g) for s, g in growth.most_common(self.top) if g > 0]
+        return {
+            "peak_kb": round(peak / 1024, 1),
+            "site": [s for s, _ in top],
+            "growth_kb": [round(g / 1024, 1) for _, g in top],
+            "blocks": [after_count[s] - before_count.get(s, 0) for s, _ in top],
+        }
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "routes": sorted(set(self.endpoints.values())) or None,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "memory": self.memory,
+            "ticks": self.samples,
+            "samples": dict(self.hits),
+        }
+
+
+_SESSION: Optional[ProfileSession] = None
+_SESSION_LOCK = threading.Lock()
+
+
+def start(endpoints: Dict[object, str], seconds: float, interval: float, memory: bool, top: int = 30) -> ProfileSession:
+    """Start the process-wide session; raises RuntimeError if one is already running."""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is not None and _SESSION.running:
+            raise RuntimeError("A profiling session is already running")
+        _SESSION = ProfileSession(endpoints, seconds, interval, memory, top)
+        return _SESSION
+
+
+def current() -> Optional[ProfileSession]:
+    """The running session, or the last finished one (its result stays readable)."""
+    return _SESSION
+
+
+def _walk_routes(routes, prefix: str = ""):
+    """(full path, endpoint) of every route, including those of included routers."""
+    for route in routes:
+        path = getattr(route, "path", None)
+        endpoint = getattr(route, "endpoint", None)
+        if path is not None and endpoint is not None:
+            yield prefix + path, endpoint
+        # newer FastAPI keeps an included router as one entry instead of copying its routes
+        inner = getattr(route, "original_router", None)
+        if inner is not None:
+            context = getattr(route, "include_context", None)
+            yield from _walk_routes(inner.routes, prefix + (getattr(context, "prefix", "") or ""))
+
+
+def endpoint_codes(routes: List[object], paths: List[str]) -> Dict[object, str]:
+    """{endpoint code object: path} for the routes whose path is in paths; ValueError for unknown paths."""
+    by_path = {}
+    for path, endpoint in _walk_routes(routes):
+        code = getattr(endpoint, "__code__", None)
+        if code is not None:
+            by_path.setdefault(path, []).append(code)
+    unknown = [p for p in paths if p not in by_path]
+    if unknown:
+        raise ValueError(f"Unknown routes: {unknown}")
+    return {code: p for p in paths for code in by_path[p]}
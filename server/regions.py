@@ -0,0 +1,182 @@
+"""Grid -> ward aggregation through a precomputed sparse overlap matrix.
+
+The ward polygons are overlaid with the grid geometry once, in a metric CRS,
+and the overlap areas are stored as a (n_wards x n_grids) CSR matrix. A cell
+split across a ward boundary contributes to each ward in proportion to the
+area it has there. Per-ward summaries for an hour are then one sparse
+matrix product over the scored grid vector, plus a segmented max over the
+CSR rows.
+
+The matrix is cached as .npz next to the ward file and rebuilt when the ward
+file or the grid set changes.
+
+Supported ward files: GeoJSON, GeoParquet or Shapefile with a polygon per
+ward. The id column is the first of Ward_ID, ward_id, ward_no, Ward_No, id;
+the name column the first of Ward_Name, ward_name, name, Name (both optional).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy import sparse
+
+try:
+    from .artifacts import fingerprint  # type: ignore
+except Exception:
+    from artifacts import fingerprint  # type: ignore
+
+# Metric CRS for overlap areas (UTM zone 43N covers Delhi)
+AREA_CRS = "EPSG:32643"
+# Overlaps smaller than this share of a cell are boundary slivers and are dropped
+MIN_OVERLAP_SHARE = 0.001
+ID_COLUMNS = ("Ward_ID", "ward_id", "ward_no", "Ward_No", "id")
+NAME_COLUMNS = ("Ward_Name", "ward_name", "name", "Name")
+
+
+class RegionMapping:
+    def __init__(self, weights: sparse.csr_matrix, grid_ids, region_ids, region_names, source: str):
+        """weights[r, g] is the area in m^2 of grid cell grid_ids[g] inside region r."""
+        order = np.argsort(np.asarray(grid_ids, dtype=np.int64))
+        self.grid_ids = np.asarray(grid_ids, dtype=np.int64)[order]
+        self.weights = sparse.csr_matrix(weights)[:, order]
+        self.weights.sort_indices()
+        self.region_ids = [str(r) for r in region_ids]
+        self.region_names = [str(n) for n in region_names]
+        self.source = source
+
+    @property
+    def n_regions(self) -> int:
+        return self.weights.shape[0]
+
+    def align(self, grid_ids) -> np.ndarray:
+        """Position of each mapping grid in grid_ids (sorted); -1 where it is absent."""
+        g = np.asarray(grid_ids, dtype=np.int64)
+        if len(g) == 0:
+            return np.full(len(self.grid_ids), -1, dtype=np.int64)
+        pos = np.clip(np.searchsorted(g, self.grid_ids), 0, len(g) - 1)
+        return np.where(g[pos] == self.grid_ids, pos, -1)
+
+    def summarize(self, severity: np.ndarray, high: int = 2, at_risk: int = 1) -> Dict[str, np.ndarray]:
+        """Per-region summaries for a severity vector in grid_ids order (-1 = unscored).
+
+        Returns max severity, area-weighted share of High, and High / at-risk / scored
+        areas in km^2.
+        """
+        sev = np.asarray(severity, dtype=np.int64)
+        scored = sev >= 0
+        cols = np.column_stack([sev >= high, sev >= at_risk, scored]).astype(float)
+        high_area, risk_area, scored_area = (self.weights @ cols).T / 1e6
+
+        w = self.weights
+        row_max = np.full(self.n_regions, -1, dtype=np.int64)
+        nonempty = np.diff(w.indptr) > 0
+        if nonempty.any():
+            row_max[nonempty] = np.maximum.reduceat(sev[w.indices], w.indptr[:-1][nonempty])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            share = np.where(scored_area > 0, high_area / scored_area, np.nan)
+        return {
+            "max_severity": row_max,
+            "high_share": share,
+            "high_area_km2": high_area,
+            "at_risk_area_km2": risk_area,
+            "scored_area_km2": scored_area,
+            "area_km2": np.asarray(w.sum(axis=1)).ravel() / 1e6,
+            "cells": np.diff(w.indptr),
+        }
+
+    def save(self, path: str):
+        w = self.weights
+        np.savez_compressed(
+            path, data=w.data, indices=w.indices, indptr=w.indptr, shape=np.array(w.shape),
+            grid_ids=self.grid_ids, region_ids=np.array(self.region_ids), region_names=np.array(self.region_names),
+            source=np.array(self.source),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "RegionMapping":
+        z = np.load(path, allow_pickle=False)
+        w = sparse.csr_matrix((z["data"], z["indices"], z["indptr"]), shape=tuple(z["shape"]))
+        return cls(w, z["grid_ids"], z["region_ids"].tolist(), z["region_names"].tolist(), str(z["source"]))
+
+
+def _pick(columns, candidates) -> Optional[str]:
+    for c in candidates:
+        if c in columns:
+            return c
+    return None
+
+
+def build_mapping(grids_gdf, regions_gdf, source: str = "") -> RegionMapping:
+    """Area-weighted overlap matrix between Grid_ID polygons and region polygons."""
+    import geopandas as gpd  # type: ignore
+
+    id_col = _pick(regions_gdf.columns, ID_COLUMNS)
+    name_col = _pick(regions_gdf.columns, NAME_COLUMNS)
+    regions = regions_gdf.reset_index(drop=True)
+    region_ids = regions[id_col].astype(str).tolist() if id_col else [str(i) for i in range(len(regions))]
+    region_names = regions[name_col].astype(str).tolist() if name_col else list(region_ids)
+
+    grids = grids_gdf[["Grid_ID", "geometry"]].reset_index(drop=True)
+    if grids.crs is None:
+        grids = grids.set_crs(epsg=4326)
+    if regions.crs is None:
+        regions = regions.set_crs(epsg=4326)
+    grids = grids.to_crs(AREA_CRS)
+    regions = gpd.GeoDataFrame({"_region": np.arange(len(regions))}, geometry=regions.geometry.to_crs(AREA_CRS))
+    grids["_grid"] = np.arange(len(grids))
+    cell_area = grids.geometry.area.to_numpy()
+
+    parts = gpd.overlay(grids[["_grid", "geometry"]], regions, how="intersection", keep_geom_type=True)
+    area = parts.geometry.area.to_numpy()
+    g = parts["_grid"].to_numpy(dtype=np.int64)
+    r = parts["_region"].to_numpy(dtype=np.int64)
+    keep = area > MIN_OVERLAP_SHARE * cell_area[g]
+    # a cell can intersect a ward in several pieces; coo -> csr sums duplicates
+    weights = sparse.coo_matrix((area[keep], (r[keep], g[keep])), shape=(len(regions), len(grids))).tocsr()
+    return RegionMapping(weights, grids["Grid_ID"].to_numpy(), region_ids, region_names, source)
+
+
+def _source_key(regions_path: str, grid_ids) -> str:
+    h = hashlib.sha1(np.sort(np.asarray(grid_ids, dtype=np.int64)).tobytes())
+    return f"{fingerprint([regions_path])}-{h.hexdigest()[:12]}"
+
+
+def load_or_build(regions_path: str, cache_path: str, grids_gdf) -> Optional[RegionMapping]:
+    """Mapping from cache_path when it matches the ward file and grid set, else rebuilt and saved."""
+    if not os.path.exists(regions_path):
+        return None
+    source = _source_key(regions_path, grids_gdf["Grid_ID"].to_numpy())
+    if os.path.exists(cache_path):
+        try:
+            mapping = RegionMapping.load(cache_path)
+            if mapping.source == source:
+                return mapping
+        except Exception as ex:
+            print(f"[REGIONS] Ignoring unreadable mapping cache '{cache_path}': {ex}")
+
+    import geopandas as gpd  # type: ignore
+
+    mapping = build_mapping(grids_gdf, gpd.read_file(regions_path), source=source)
+    try:
+        mapping.save(cache_path)
+        print(f"[REGIONS] Built mapping for {mapping.n_regions} regions -> {cache_path}")
+    except OSError as ex:
+        print(f"[REGIONS] Could not write mapping cache '{cache_path}': {ex}")
+    return mapping
+
+
+def severity_columns(summary: Dict[str, np.ndarray], labels: List[str]) -> Dict[str, list]:
+    """Columnar JSON-ready form of summarize() with severities mapped back to labels."""
+    lookup = np.array([None] + list(labels), dtype=object)
+    return {
+        "max_label": lookup[summary["max_severity"] + 1].tolist(),
+        "high_share": [None if np.isnan(v) else round(float(v), 4) for v in summary["high_share"]],
+        "high_area_km2": np.round(summary["high_area_km2"], 4).tolist(),
+        "at_risk_area_km2": np.round(summary["at_risk_area_km2"], 4).tolist(),
+        "scored_area_km2": np.round(summary["scored_area_km2"], 4).tolist(),
+        "area_km2": np.round(summary["area_km2"], 4).tolist(),
+        "cells": summary["cells"].tolist(),
+    }
@@ -0,0 +1,200 @@
+"""Push of current-hour risk changes to subscribed map clients (/ws/risk).
+
+Clients subscribe to a set of grid cells (Grid_IDs, or a bbox resolved to
+them by app.py) and get a snapshot of the current hour's risk, then only the
+cells whose risk class changes. Changes are found once per publish by
+diffing the new city-wide labels against the last published ones. Clients
+with the same subscription form a group: each group's delta is intersected
+and serialized once, and the same text is queued for every member.
+
+Publishes come from worker threads (nowcast ingest, bundle swaps, the hour
+ticker); each subscriber has an asyncio queue on the server loop that its
+WebSocket task drains. A subscriber that falls QUEUE_SIZE messages behind has
+its backlog dropped and is sent a fresh snapshot instead.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Messages queued per subscriber before its backlog is replaced by a snapshot
+QUEUE_SIZE = int(os.getenv("RISK_STREAM_QUEUE", "64"))
+# Marker queued for a subscriber that must be re-sent a snapshot
+RESYNC = object()
+
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+        self.group: Optional["_Group"] = None
+        self.resync_queued = False
+
+    def _put(self, item):
+        # runs on the subscriber's loop; one queued snapshot request is enough
+        if item is RESYNC:
+            if self.resync_queued:
+                return
+            self.resync_queued = True
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.resync_queued = True
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self):
+        """Next queued item (a JSON text or RESYNC)."""
+        item = await self.queue.get()
+        if item is RESYNC:
+            self.resync_queued = False
+        return item
+
+    def push(self, item):
+        """Queue an item from any thread."""
+        try:
+            self.loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError:
+            pass  # loop closed; the connection is going away
+
+
+class _Group:
+    def __init__(self, key: str, grid_ids: np.ndarray):
+        self.key = key
+        self.grid_ids = grid_ids  # sorted, unique
+        self.pos = np.empty(0, dtype=np.int64)  # positions in the published grid_ids; -1 if absent
+        self.members: List[Subscriber] = []
+
+
+class RiskBroadcaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups: Dict[str, _Group] = {}
+        self.grid_ids = np.empty(0, dtype=np.int64)
+        self.labels = np.empty(0, dtype=object)
+        self.hour: Optional[str] = None
+        self.version: Optional[str] = None
+        self.published = 0
+        self.messages = 0
+
+    @property
+    def subscribers(self) -> int:
+        with self._lock:
+            return sum(len(g.members) for g in self._groups.values())
+
+    def subscribe(self, sub: Subscriber, grid_ids) -> int:
+        """(Re)subscribe sub to grid_ids; returns the number of cells it watches."""
+        ids = np.unique(np.asarray(grid_ids, dtype=np.int64))
+        key = hashlib.sha1(ids.tobytes()).hexdigest()
+        with self._lock:
+            self._leave(sub)
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = _Group(key, ids)
+                group.pos = self._positions(ids)
+            group.members.append(sub)
+            sub.group = group
+        return len(ids)
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            self._leave(sub)
+
+    def _leave(self, sub: Subscriber):
+        group = sub.group
+        if group is not None:
+            group.members.remove(sub)
+            if not group.members:
+                del self._groups[group.key]
+            sub.group = None
+
+    def _positions(self, ids: np.ndarray) -> np.ndarray:
+        g = self.grid_ids
+        if len(g) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        pos = np.clip(np.searchsorted(g, ids), 0, len(g) - 1)
+        return np.where(g[pos] == ids, pos, -1)
+
+    def snapshot(self, sub: Subscriber) -> str:
+        """Current risk of every cell sub watches, as a JSON message."""
+        with self._lock:
+            group = sub.group
+            if group is None:
+                return json.dumps({"type": "snapshot", "hour": self.hour, "grid_ids": [], "label": []})
+            known = group.pos >= 0
+            return json.dumps({
+                "type": "snapshot",
+                "hour": self.hour,
+                "grid_ids": group.grid_ids[known].tolist(),
+                "label": self.labels[group.pos[known]].tolist(),
+                "unknown_grid_ids": group.grid_ids[~known].tolist(),
+                "model_version": self.version,
+            })
+
+    def publish(self, grid_ids: np.ndarray, labels: np.ndarray, hour: str, version: str) -> int:
+        """Make labels (for sorted grid_ids) current and push changed cells to each group.
+
+        Returns the number of changed cells. A different grid set re-resolves every group and
+        sends snapshots instead of deltas.
+        """
+        grid_ids = np.asarray(grid_ids, dtype=np.int64)
+        labels = np.asarray(labels, dtype=object)
+        with self._lock:
+            same_grids = np.array_equal(grid_ids, self.grid_ids)
+            if same_grids:
+                changed = np.flatnonzero(labels != self.labels)
+            first = self.hour is None
+            new_hour = not first and hour != self.hour
+            self.grid_ids, self.labels, self.hour, self.version = grid_ids, labels, hour, version
+            self.published += 1
+            groups = list(self._groups.values())
+            if not same_grids:
+                for group in groups:
+                    group.pos = self._positions(group.grid_ids)
+                    if not first:
+                        # on the first publish subscribers are still waiting for their initial snapshot
+                        for sub in group.members:
+                            sub.push(RESYNC)
+                return len(grid_ids)
+            if new_hour:
+                # every client learns about the rollover, even where no cell changes class
+                text = json.dumps({"type": "hour", "hour": hour, "model_version": version})
+                for group in groups:
+                    for sub in group.members:
+                        sub.push(text)
+                    self.messages += len(group.members)
+            if len(changed) == 0:
+                return 0
+            for group in groups:
+                # cells of this group among the changed ones (absent cells are -1 and never match)
+                hit = np.isin(group.pos, changed)
+                if not hit.any():
+                    continue
+                text = json.dumps({
+                    "type": "delta",
+                    "hour": hour,
+                    "grid_ids": group.grid_ids[hit].tolist(),
+                    "label": labels[group.pos[hit]].tolist(),
+                    "model_version": version,
+                })
+                for sub in group.members:
+                    sub.push(text)
+                self.messages += len(group.members)
+            return len(changed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "groups": len(self._groups),
+                "subscribers": sum(len(g.members) for g in self._groups.values()),
+                "hour": self.hour,
+                "published": self.published,
+                "messages": self.messages,
+            }
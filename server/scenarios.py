@@ -0,0 +1,116 @@
+"""Rainfall what-if scenarios scored over every grid cell.
+
+A scenario is a rainfall total per grid cell over a window of hours, given
+as a citywide value, per ward, or as a small lon/lat raster, and spread over
+the hours by a profile (even by default). The per-hour rain replaces Rain_mm
+in the dataset rows for those hours and Rain_Past3h becomes the scenario
+rain of the hour and the two before it (the dataset builder's rolling sum),
+so the model sees the storm while static features (Elevation, Road_Density)
+and, unless overridden, drain level and soil moisture stay per grid.
+
+These helpers only build arrays; app.py assembles the rows and makes one
+model call for all grids x hours.
+"""
+from __future__ import annotations
+
+import base64
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Largest accepted rainfall raster (rows x columns)
+MAX_FIELD_CELLS = 256 * 256
+
+
+def hourly_weights(hours: int, profile: Optional[Sequence[float]] = None) -> np.ndarray:
+    """Share of the total falling in each hour; even unless a non-negative profile is given."""
+    if profile is None:
+        return np.full(hours, 1.0 / hours)
+    w = np.asarray(profile, dtype=float)
+    if len(w) != hours or (w < 0).any() or not np.isfinite(w).all() or w.sum() <= 0:
+        raise ValueError(f"profile must be {hours} non-negative weights with a positive sum")
+    return w / w.sum()
+
+
+def ward_totals(mapping, grid_ids: np.ndarray, ward_mm: Dict[str, float], default_mm: float) -> np.ndarray:
+    """Per-grid totals from per-ward totals; a cell split across wards gets the area-weighted mean.
+
+    grid_ids must be sorted (DatasetIndex order). Cells outside every listed ward get default_mm.
+    """
+    index = {r: i for i, r in enumerate(mapping.region_ids)}
+    unknown = [w for w in ward_mm if w not in index]
+    if unknown:
+        raise ValueError(f"Unknown ward ids: {unknown[:10]}")
+    rain = np.zeros(mapping.n_regions)
+    listed = np.zeros(mapping.n_regions)
+    for ward, mm in ward_mm.items():
+        rain[index[ward]] = float(mm)
+        listed[index[ward]] = 1.0
+    w = mapping.weights
+    area = w.T @ listed  # area of each mapping cell inside listed wards
+    weighted = w.T @ rain
+    with np.errstate(invalid="ignore", divide="ignore"):
+        per_cell = np.where(area > 0, weighted / area, default_mm)
+    out = np.full(len(grid_ids), float(default_mm))
+    pos = mapping.align(grid_ids)
+    out[pos[pos >= 0]] = per_cell[pos >= 0]
+    return out
+
+
+def field_totals(lon: np.ndarray, lat: np.ndarray, bbox: Sequence[float], values, default_mm: float) -> np.ndarray:
+    """Nearest raster cell for each grid centroid; rows run north to south, columns west to east."""
+    field = np.asarray(values, dtype=float)
+    if field.ndim != 2 or field.size == 0 or field.size > MAX_FIELD_CELLS:
+        raise ValueError(f"field values must be a non-empty 2-D array of at most {MAX_FIELD_CELLS} cells")
+    if not np.isfinite(field).all() or (field < 0).any():
+        raise ValueError("field values must be finite and non-negative")
+    minx, miny, maxx, maxy = (float(v) for v in bbox)
+    if not (maxx > minx and maxy > miny):
+        raise ValueError("field bbox must be minx, miny, maxx, maxy")
+    n_rows, n_cols = field.shape
+    col = np.floor((lon - minx) / (maxx - minx) * n_cols).astype(np.int64)
+    row = np.floor((maxy - lat) / (maxy - miny) * n_rows).astype(np.int64)
+    inside = (col >= 0) & (col < n_cols) & (row >= 0) & (row < n_rows)
+    out = np.full(len(lon), float(default_mm))
+    out[inside] = field[row[inside], col[inside]]
+    return out
+
+
+def rain_series(totals: np.ndarray, weights: np.ndarray):
+    """(G, T) Rain_mm and Rain_Past3h (rain of the hour and the two before, within the scenario)."""
+    rain = totals[:, None] * weights[None, :]
+    csum = np.cumsum(rain, axis=1)
+    past3 = csum.copy()
+    past3[:, 3:] -= csum[:, :-3]
+    return rain, past3
+
+
+def summarize(classes: np.ndarray, label_names: List[str], severity_of: Dict[str, int]) -> Dict[str, object]:
+    """Columnar summary of a (G, T) class-index grid: per-hour class counts and per-grid worst class."""
+    n_labels = len(label_names)
+    g, t = classes.shape
+    per_hour = np.stack([np.bincount(classes[:, j], minlength=n_labels) for j in range(t)]) if g else np.zeros((t, n_labels), int)
+    severity = np.array([severity_of.get(name, -1) for name in label_names])
+    worst = severity[classes].max(axis=1) if t else np.full(g, -1)
+    high = severity_of.get("High")
+    high_col = label_names.index("High") if "High" in label_names else None
+    return {
+        "class_counts": per_hour.tolist(),  # one row per hour, one column per label
+        "high_share": (per_hour[:, high_col] / max(g, 1)).round(4).tolist() if high_col is not None else None,
+        "worst_class_counts": [int((worst == s).sum()) for s in severity],
+        # hour with the most High grids; None when no grid reaches High
+        "peak_hour_index": int(per_hour[:, high_col].argmax()) if high_col is not None and t and per_hour[:, high_col].any() else None,
+        "grids_reaching_high": int((worst >= high).sum()) if high is not None else None,
+    }, worst
+
+
+def encode_grid(grid_ids: np.ndarray, classes: np.ndarray, confidence: np.ndarray) -> Dict[str, object]:
+    """(G, T) classes and confidence (percent) as base64 uint8 arrays, row-major by grid."""
+    return {
+        "grid_ids": np.asarray(grid_ids).tolist(),
+        "shape": list(classes.shape),
+        "dtype": "uint8",
+        "order": "grid-major",
+        "class": base64.b64encode(np.ascontiguousarray(classes, dtype=np.uint8).tobytes()).decode("ascii"),
+        "confidence": base64.b64encode(np.clip(np.rint(confidence), 0, 100).astype(np.uint8).tobytes()).decode("ascii"),
+    }
@@ -0,0 +1,290 @@
+"""Terrain analysis of the DEM: depression filling, D8 flow directions and flow
+accumulation, aggregated per Grid_ID as static features.
+
+All steps are whole-array NumPy / SciPy operations; nothing loops over pixels
+in Python:
+
+ - filling (the result of priority-flood): a cell fills up to its spill
+   level, the lowest possible "highest point" on any path from it to the
+   DEM edge. That is the minimax (bottleneck) distance to an outlet node
+   joined to every edge cell, read off the minimum spanning tree of the
+   8-neighbour graph with edge weight max(z_a, z_b). SciPy builds the tree
+   (Kruskal, C). The maximum edge weight on each cell's tree path is then
+   propagated with pointer jumping, in log2(tree depth) vectorized rounds;
+ - D8: each cell drains to its steepest strictly lower neighbour on the
+   filled surface. Cells with no lower neighbour (flats and filled
+   depressions) drain to their spanning-tree parent. The parent is at the
+   same filled level and leads to the spill point, so the network has no
+   cycles and every cell reaches the edge;
+ - accumulation: upstream area summed in topological order (Kahn), one
+   vectorized step per frontier of cells whose donors are all done.
+
+For the 1 arc-second Delhi DEM (1724 x 1823 cells) the whole analysis takes a
+few seconds on one core.
+
+Per Grid_ID features (TERRAIN_FEATURES):
+ - Depression_Depth     mean fill depth (m): water ponding before it can drain
+ - Depression_Fraction  share of the cell's area inside a filled depression
+ - Flow_Accum_km2       largest upstream area draining through the cell (km2)
+ - TWI                  mean topographic wetness index ln(a / tan(slope)),
+                        a = upstream area per unit contour width
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+TERRAIN_FEATURES = ["Depression_Depth", "Depression_Fraction", "Flow_Accum_km2", "TWI"]
+# Slope floor (m/m) in the wetness index, so flats do not divide by zero
+MIN_SLOPE = 0.001
+# Fill depth (m) above which a cell counts as inside a depression
+DEPRESSION_MIN_DEPTH = 0.5
+# ESRI D8 codes by (row, col) offset; 0 marks cells that drain off the DEM or are nodata
+D8_CODES = {(0, 1): 1, (1, 1): 2, (1, 0): 4, (1, -1): 8, (0, -1): 16, (-1, -1): 32, (-1, 0): 64, (-1, 1): 128}
+# Metres per degree of latitude / of longitude at the equator
+_M_PER_DEG_LAT = 110540.0
+_M_PER_DEG_LON = 111320.0
+
+
+def _src(d: int, n: int) -> slice:
+    return slice(0, n - d) if d >= 0 else slice(-d, n)
+
+
+def _dst(d: int, n: int) -> slice:
+    return slice(d, n) if d >= 0 else slice(0, n + d)
+
+
+def cell_size(transform, height: int, geographic: bool) -> Tuple[np.ndarray, float]:
+    """(cell width per row, cell height) in metres."""
+    if not geographic:
+        return np.full(height, abs(transform.a)), abs(transform.e)
+    lat = transform.f + (np.arange(height) + 0.5) * transform.e
+    return abs(transform.a) * _M_PER_DEG_LON * np.cos(np.radians(lat)), abs(transform.e) * _M_PER_DEG_LAT
+
+
+def fill_depressions(z: np.ndarray, valid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(filled surface, spanning-tree parent of each flat index; -1 = the outlet or nodata)."""
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import breadth_first_order, minimum_spanning_tree
+
+    H, W = z.shape
+    N = H * W
+    outlet = N
+    flat_valid = valid.ravel()
+    zmin = float(z[valid].min()) if valid.any() else 0.0
+    # csgraph treats zero weights as missing edges, so shift every weight to >= 1
+    w = np.where(valid, z - zmin + 1.0, 0.0).ravel()
+    idx = np.arange(N).reshape(H, W)
+
+    rows, cols, weights = [], [], []
+    for dy, dx in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        a = idx[_src(dy, H), _src(dx, W)].ravel()
+        b = idx[_dst(dy, H), _dst(dx, W)].ravel()
+        keep = flat_valid[a] & flat_valid[b]
+        a, b = a[keep], b[keep]
+        rows.append(a)
+        cols.append(b)
+        weights.append(np.maximum(w[a], w[b]))
+    # cells on the DEM edge or next to nodata spill straight out at their own height
+    inside = np.pad(valid, 1, constant_values=False)
+    edge = np.zeros_like(valid)
+    for dy, dx in D8_CODES:
+        edge |= ~inside[1 + dy:H + 1 + dy, 1 + dx:W + 1 + dx]
+    e = idx[edge & valid]
+    rows.append(e)
+    cols.append(np.full(len(e), outlet))
+    weights.append(w[e])
+
+    graph = coo_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))), shape=(N + 1, N + 1))
+    tree = minimum_spanning_tree(graph.tocsr())
+    _, parent = breadth_first_order(tree + tree.T, outlet, directed=False, return_predecessors=True)
+    parent[parent < 0] = outlet
+
+    # spill level = heaviest edge on the tree path to the outlet, by pointer jumping
+    wo = np.append(w, 0.0)
+    level = np.maximum(wo, wo[parent])
+    level[outlet] = 0.0
+    anc = parent.copy()
+    anc[outlet] = outlet
+    while not (anc == outlet).all():
+        level = np.maximum(level, level[anc])
+        anc = anc[anc]
+    filled = np.where(valid, level[:N].reshape(H, W) + zmin - 1.0, np.nan)
+    parent = parent[:N]
+    parent[(parent == outlet) | ~flat_valid] = -1
+    return filled, parent
+
+
+def flow_directions(filled: np.ndarray, valid: np.ndarray, parent: np.ndarray, dx_row: np.ndarray,
+                    dy: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(receiver flat index or -1, steepest slope in m/m, D8 code) of every cell."""
+    H, W = filled.shape
+    surface = np.pad(np.where(valid, filled, np.inf), 1, constant_values=np.inf)
+    idx = np.arange(H * W).reshape(H, W)
+    slope = np.zeros((H, W))
+    receiver = np.full((H, W), -1, dtype=np.int64)
+    code = np.zeros((H, W), dtype=np.uint8)
+    for (oy, ox), c in D8_CODES.items():
+        dist = np.hypot(ox * dx_row, oy * dy)[:, None]
+        drop = (filled - surface[1 + oy:H + 1 + oy, 1 + ox:W + 1 + ox]) / dist
+        steeper = drop > slope  # strictly lower; nodata and off-DEM neighbours are +inf
+        slope[steeper] = drop[steeper]
+        receiver[steeper] = (idx + oy * W + ox)[steeper]
+        code[steeper] = c
+    receiver = receiver.ravel()
+    # flats and filled depressions follow the spanning tree towards their spill point
+    flat = (receiver < 0) & valid.ravel()
+    receiver[flat] = parent[flat]
+    to = receiver[flat]
+    inner = to >= 0
+    # D8 code of each parent from its flat-index offset (dy * W + dx)
+    lookup = np.zeros(2 * W + 3, dtype=np.uint8)
+    for (oy, ox), c in D8_CODES.items():
+        lookup[oy * W + ox + W + 1] = c
+    flat_codes = np.zeros(len(to), dtype=np.uint8)
+    flat_codes[inner] = lookup[to[inner] - np.flatnonzero(flat)[inner] + W + 1]
+    code.ravel()[flat] = flat_codes
+    return receiver, slope, code
+
+
+def flow_accumulation(receiver: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Sum of weights over each cell and everything upstream of it (receiver -1 = drains off)."""
+    N = len(receiver)
+    acc = weights.astype(float).copy()
+    downstream = receiver >= 0
+    pending = np.bincount(receiver[downstream], minlength=N)
+    frontier = np.flatnonzero(pending == 0)
+    while len(frontier):
+        to = receiver[frontier]
+        keep = to >= 0
+        src, to = frontier[keep], to[keep]
+        if len(to) > N // 256:
+            # wide frontiers (the first few): one dense pass beats scattered updates
+            acc += np.bincount(to, weights=acc[src], minlength=N)
+            pending -= np.bincount(to, minlength=N)
+        else:
+            np.add.at(acc, to, acc[src])
+            np.subtract.at(pending, to, 1)
+        frontier = np.unique(to[pending[to] == 0])
+    return acc
+
+
+class Terrain:
+    """Analysis of one DEM: rasters share its shape and transform."""
+
+    def __init__(self, z: np.ndarray, valid: np.ndarray, transform, geographic: bool):
+        self.transform = transform
+        self.valid = valid
+        H, W = z.shape
+        dx_row, dy = cell_size(transform, H, geographic)
+        self.cell_area = np.repeat((dx_row * dy)[:, None], W, axis=1)
+        self.timings: Dict[str, float] = {}
+
+        t0 = time.perf_counter()
+        self.filled, parent = fill_depressions(z, valid)
+        self.depth = np.where(valid, self.filled - z, np.nan)
+        t1 = time.perf_counter()
+        receiver, self.slope, self.d8 = flow_directions(self.filled, valid, parent, dx_row, dy)
+        t2 = time.perf_counter()
+        self.accumulation = flow_accumulation(receiver, np.where(valid, self.cell_area, 0.0).ravel()).reshape(H, W)
+        t3 = time.perf_counter()
+        # upstream area per unit contour width, taken as the cell width
+        width = np.sqrt(self.cell_area)
+        with np.errstate(divide="ignore"):
+            self.twi = np.where(valid, np.log(self.accumulation / width / np.maximum(self.slope, MIN_SLOPE)), np.nan)
+        self.timings = {"fill_s": round(t1 - t0, 3), "d8_s": round(t2 - t1, 3), "accumulation_s": round(t3 - t2, 3)}
+
+
+def analyze_dem(dem_path: str) -> Terrain:
+    import rasterio
+
+    with rasterio.open(dem_path) as ds:
+        band = ds.read(1, masked=True)
+        z = band.astype(float).filled(np.nan)
+        valid = ~np.ma.getmaskarray(band) & np.isfinite(z)
+        return Terrain(z, valid, ds.transform, bool(ds.crs and ds.crs.is_geographic))
+
+
+def grid_features(terrain: Terrain, labels: np.ndarray, n_labels: int) -> Dict[str, np.ndarray]:
+    """TERRAIN_FEATURES per label 1..n_labels of a raster aligned with the DEM (0 = no grid)."""
+    sel = (labels > 0) & terrain.valid
+    lab = labels[sel] - 1
+    area = terrain.cell_area[sel]
+    total = np.bincount(lab, weights=area, minlength=n_labels)
+    depth = terrain.depth[sel]
+
+    def mean(values):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.bincount(lab, weights=values * area, minlength=n_labels) / total
+
+    peak = np.zeros(n_labels)
+    np.maximum.at(peak, lab, terrain.accumulation[sel])
+    return {
+        "Depression_Depth": mean(depth),
+        "Depression_Fraction": mean((depth > DEPRESSION_MIN_DEPTH).astype(float)),
+        "Flow_Accum_km2": np.where(total > 0, peak / 1e6, np.nan),
+        "TWI": mean(terrain.twi[sel]),
+    }
+
+
+def grid_terrain_features(grids, dem_path: str, terrain: Optional[Terrain] = None):
+    """DataFrame of Grid_ID and TERRAIN_FEATURES for a GeoDataFrame of grid polygons."""
+    import pandas as pd
+    import rasterio
+    from rasterio.features import rasterize
+
+    terrain = terrain or analyze_dem(dem_path)
+    with rasterio.open(dem_path) as ds:
+        grids = grids.to_crs(ds.crs) if ds.crs is not None and grids.crs is not None else grids
+        shape = (ds.height, ds.width)
+    ids = grids['Grid_ID'].to_numpy()
+    # one burn for every grid; label k + 1 marks the pixels of the k-th row
+    labels = rasterize(zip(grids.geometry, np.arange(1, len(ids) + 1)), out_shape=shape,
+                       transform=terrain.transform, fill=0, dtype="int32")
+    features = grid_features(terrain, labels, len(ids))
+    print(f"[Terrain] Analysed DEM {shape[1]}x{shape[0]} ({terrain.timings}); "
+          f"{int((np.bincount(labels.ravel(), minlength=len(ids) + 1)[1:] == 0).sum())} grids smaller than a DEM cell")
+    return pd.DataFrame({"Grid_ID": ids, **features})
+
+
+def main():
+    here = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Fill, D8 and flow accumulation of a DEM; optional per-grid features.")
+    parser.add_argument("--dem", default=os.path.join(here, "delhi_opentopo_dem.tif"))
+    parser.add_argument("--grids", help="grid polygons (GeoParquet/GeoJSON with Grid_ID) to aggregate over")
+    parser.add_argument("--out", help="write per-grid features to this parquet")
+    parser.add_argument("--rasters", help="write filled, D8 and accumulation GeoTIFFs with this path prefix")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    terrain = analyze_dem(args.dem)
+    print(f"[Terrain] {terrain.timings}; max fill depth {np.nanmax(terrain.depth):.1f} m, "
+          f"largest catchment {terrain.accumulation.max() / 1e6:.1f} km2")
+    if args.grids:
+        import geopandas as gpd
+
+        grids = gpd.read_parquet(args.grids) if args.grids.endswith(".parquet") else gpd.read_file(args.grids)
+        df = grid_terrain_features(grids, args.dem, terrain)
+        print(df.describe().T[["mean", "min", "max"]])
+        if args.out:
+            df.to_parquet(args.out, index=False)
+    if args.rasters:
+        import rasterio
+
+        with rasterio.open(args.dem) as ds:
+            profile = ds.profile
+        for name, data, dtype, nodata in (("filled", terrain.filled, "float32", np.nan),
+                                          ("d8", terrain.d8, "uint8", 0),
+                                          ("accumulation", terrain.accumulation, "float32", None)):
+            p = dict(profile, dtype=dtype, count=1, nodata=nodata)
+            with rasterio.open(f"{args.rasters}_{name}.tif", "w", **p) as out:
+                out.write(data.astype(dtype), 1)
+    print(f"[Terrain] Done in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
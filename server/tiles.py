@@ -0,0 +1,224 @@
+"""XYZ raster tiles of per-hour flood risk.
+
+Grid polygons from grid_index are projected to Web Mercator once. A tile is
+drawn by selecting the cells whose bounding boxes overlap it (array compare,
+no spatial join) and filling them with the colour of their risk class.
+
+Rendered PNGs are cached on disk under
+
+    {root}/{model version}/{hour}/{z}/{x}/{y}.png
+
+so a repeat request is a plain file read. Everything for one (version, hour)
+lives in one directory, which makes invalidating an hour a single rename.
+"""
+from __future__ import annotations
+
+import io
+import math
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+TILE_SIZE = 256
+# Half the Web Mercator world width in metres
+ORIGIN_SHIFT = 20037508.342789244
+MAX_ZOOM = 22
+
+# RGBA per risk label; anything else is left transparent
+RISK_COLORS = {
+    "High": (215, 48, 39, 170),
+    "Medium": (252, 141, 89, 150),
+    "Low": (26, 152, 80, 110),
+}
+
+
+def lonlat_to_mercator(lon, lat):
+    lon = np.asarray(lon, dtype=float)
+    lat = np.clip(np.asarray(lat, dtype=float), -85.05112878, 85.05112878)
+    x = lon * ORIGIN_SHIFT / 180.0
+    y = np.log(np.tan((90.0 + lat) * np.pi / 360.0)) * ORIGIN_SHIFT / np.pi
+    return x, y
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(minx, miny, maxx, maxy) of an XYZ tile in Web Mercator metres."""
+    size = 2 * ORIGIN_SHIFT / (1 << z)
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tiles_covering(z: int, bounds: Tuple[float, float, float, float]) -> Iterator[Tuple[int, int]]:
+    """(x, y) of every tile at zoom z that overlaps mercator bounds."""
+    size = 2 * ORIGIN_SHIFT / (1 << z)
+    last = (1 << z) - 1
+    x0 = min(max(int(math.floor((bounds[0] + ORIGIN_SHIFT) / size)), 0), last)
+    x1 = min(max(int(math.floor((bounds[2] + ORIGIN_SHIFT) / size)), 0), last)
+    y0 = min(max(int(math.floor((ORIGIN_SHIFT - bounds[3]) / size)), 0), last)
+    y1 = min(max(int(math.floor((ORIGIN_SHIFT - bounds[1]) / size)), 0), last)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x, y
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+class TileRenderer:
+    def __init__(self, grid_ids: Sequence[int], geometries: Sequence):
+        """grid_ids and shapely (Multi)Polygons in lon/lat; interior rings are ignored."""
+        self.grid_ids = np.asarray(grid_ids, dtype=np.int64)
+        self.rings = []  # exterior rings in mercator, one (k, 2) array each
+        self.owner = []  # cell index of each ring
+        for i, g in enumerate(geometries):
+            if g is None or g.is_empty:
+                continue
+            for poly in getattr(g, "geoms", [g]):
+                lon, lat = np.asarray(poly.exterior.coords, dtype=float).T[:2]
+                mx, my = lonlat_to_mercator(lon, lat)
+                self.rings.append(np.column_stack([mx, my]))
+                self.owner.append(i)
+        self.owner = np.asarray(self.owner, dtype=np.int64)
+        if self.rings:
+            self.ring_bbox = np.array([[r[:, 0].min(), r[:, 1].min(), r[:, 0].max(), r[:, 1].max()] for r in self.rings])
+        else:
+            self.ring_bbox = np.empty((0, 4))
+
+    @property
+    def bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        if len(self.ring_bbox) == 0:
+            return None
+        b = self.ring_bbox
+        return float(b[:, 0].min()), float(b[:, 1].min()), float(b[:, 2].max()), float(b[:, 3].max())
+
+    def render(self, z: int, x: int, y: int, colors: np.ndarray) -> Optional[bytes]:
+        """PNG for tile (z, x, y); colors is (n_cells, 4) uint8 RGBA in grid_ids order.
+
+        Returns None when no visible cell touches the tile.
+        """
+        from PIL import Image, ImageDraw
+
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        b = self.ring_bbox
+        hit = (b[:, 2] >= minx) & (b[:, 0] <= maxx) & (b[:, 3] >= miny) & (b[:, 1] <= maxy)
+        hit &= colors[self.owner, 3] > 0
+        rings = np.flatnonzero(hit)
+        if len(rings) == 0:
+            return None
+
+        scale = TILE_SIZE / (maxx - minx)
+        img = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        for r in rings:
+            ring = self.rings[r]
+            px = (ring[:, 0] - minx) * scale
+            py = (maxy - ring[:, 1]) * scale
+            draw.polygon(list(zip(px.tolist(), py.tolist())), fill=tuple(int(c) for c in colors[self.owner[r]]))
+        buf = io.BytesIO()
+        img.save(buf, format="PNG", optimize=False)
+        return buf.getvalue()
+
+
+def colors_for_labels(labels: Sequence[str]) -> np.ndarray:
+    """(n, 4) uint8 RGBA for risk labels."""
+    out = np.zeros((len(labels), 4), dtype=np.uint8)
+    for name, rgba in RISK_COLORS.items():
+        out[np.asarray(labels, dtype=object) == name] = rgba
+    return out
+
+
+def empty_png() -> bytes:
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def from_grid_index() -> Optional[TileRenderer]:
+    """Renderer over the grid geometry from grid_index, or None when it is unavailable."""
+    try:
+        from .grid_index import get_grid_gdf  # type: ignore
+    except Exception:
+        from grid_index import get_grid_gdf  # type: ignore
+    try:
+        gdf = get_grid_gdf()
+    except Exception as ex:
+        print(f"[TILES] Grid geometry not available: {ex}")
+        return None
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+    return TileRenderer(gdf["Grid_ID"].to_numpy(), list(gdf.geometry))
+
+
+class TileCache:
+    def __init__(self, root: str):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def path(self, version: str, hour_key: str, z: int, x: int, y: int) -> str:
+        return os.path.join(self.root, version, hour_key, str(z), str(x), f"{y}.png")
+
+    def get(self, version: str, hour_key: str, z: int, x: int, y: int) -> Optional[bytes]:
+        """Cached PNG bytes, or None. Read here: a concurrent invalidate_hour may remove the file right after."""
+        try:
+            with open(self.path(version, hour_key, z, x, y), "rb") as f:
+                data = f.read()
+        except OSError:
+            data = None
+        with self._lock:
+            if data is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return data
+
+    def put(self, version: str, hour_key: str, z: int, x: int, y: int, data: bytes) -> str:
+        """Write atomically so concurrent readers never see a partial PNG."""
+        p = self.path(version, hour_key, z, x, y)
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(p), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, p)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return p
+
+    def _discard(self, path: str):
+        # rename first so the hour is gone immediately; deleting the files can happen later
+        trash = os.path.join(self.root, f".trash-{uuid.uuid4().hex}")
+        try:
+            os.replace(path, trash)
+        except OSError:
+            return
+        threading.Thread(target=shutil.rmtree, args=(trash, True), daemon=True).start()
+
+    def invalidate_hour(self, version: str, hour_key: str):
+        with self._lock:
+            self.invalidations += 1
+        self._discard(os.path.join(self.root, version, hour_key))
+
+    def drop_versions(self, keep: str):
+        """Remove tiles rendered for every model version except keep."""
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if name != keep and not name.startswith(".trash-"):
+                self._discard(os.path.join(self.root, name))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
@@ -0,0 +1,307 @@
+"""Scripted, bounded-memory training of the flood model.
+
+Replaces the notebook's load-everything workflow (Notebooks/DelhiFlow.ipynb)
+with passes over a parquet stream, so the 5-year dataset trains on an
+ordinary machine. The input is the dataset builder's parquet file or a
+directory of parquet files (hive partitions such as date=... are fine);
+it is read in record batches of only the columns training needs.
+
+ pass 1  StandardScaler.partial_fit on every batch and the label set. With
+         the forest learner it also keeps a uniform reservoir sample of up to
+         --sample-rows training rows (Algorithm R, vectorised per batch).
+ fit     forest: RandomForestClassifier (notebook hyper-parameters, n_jobs=-1)
+         on the reservoir. sgd: SGDClassifier.partial_fit over the stream
+         (--epochs passes); memory stays at one batch whatever the data size.
+ eval    a streamed pass over the held-out rows that accumulates a confusion
+         matrix.
+
+Rows are split into train and test by a hash of (Grid_ID, Hour), which is
+stable across runs and independent of file order. Missing feature values are
+filled with the feature mean, as in the notebook. Features are the scaled
+continuous columns plus the cyclical time encoding (flood_runtime.design_matrix),
+i.e. exactly what the server computes at prediction time.
+
+Writes model/flood_model.pkl, scaler/scaler.pkl, encoder/label_encoder.pkl and
+model/manifest.json (data version, parameters, metrics), each atomically so
+a watching server (ARTIFACT_WATCH_S) never loads a half-written file. A forest
+is also exported to the NumPy runtime (model/flood_model.npz).
+
+Usage:
+    python train.py --data dataset/ --learner forest --sample-rows 2000000
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .dataset_index import FEATURES, NS_PER_HOUR, time_columns  # type: ignore
+    from . import flood_runtime  # type: ignore
+except Exception:
+    from dataset_index import FEATURES, NS_PER_HOUR, time_columns  # type: ignore
+    import flood_runtime  # type: ignore
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COLUMNS = ["Grid_ID", "Hour"] + FEATURES + ["Flood_Risk"]
+
+
+def _dataset(path: str):
+    import pyarrow.dataset as ds
+
+    return ds.dataset(path, format="parquet", partitioning="hive" if os.path.isdir(path) else None)
+
+
+def data_version(path: str) -> Dict[str, object]:
+    """Identity of the input: fingerprint of every parquet file's size and mtime."""
+    try:
+        from .artifacts import fingerprint  # type: ignore
+    except Exception:
+        from artifacts import fingerprint  # type: ignore
+
+    files = sorted(glob.glob(os.path.join(path, "**", "*.parquet"), recursive=True)) if os.path.isdir(path) else [path]
+    return {"path": os.path.abspath(path), "files": len(files), "fingerprint": fingerprint(files)}
+
+
+def _split_hash(grid_ids: np.ndarray, abs_hours: np.ndarray, seed: int) -> np.ndarray:
+    """splitmix64 of (Grid_ID, hour) -> uniform floats in [0, 1)."""
+    with np.errstate(over="ignore"):
+        z = grid_ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + abs_hours.astype(np.uint64) + np.uint64(seed)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def batches(path: str, batch_rows: int, test_fraction: float, seed: int) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """(raw (n, 9) in FEATURES + hour/month/dow order, labels, is_test) per record batch."""
+    for batch in _dataset(path).to_batches(columns=COLUMNS, batch_size=batch_rows):
+        if batch.num_rows == 0:
+            continue
+        hours = batch.column("Hour").to_numpy().astype("datetime64[ns]").astype(np.int64) // NS_PER_HOUR
+        hod, month, dow = time_columns(hours)
+        cont = np.column_stack([batch.column(c).to_numpy(zero_copy_only=False).astype(float) for c in FEATURES])
+        raw = np.column_stack([cont, hod, month, dow]).astype(float)
+        labels = np.asarray(batch.column("Flood_Risk").to_numpy(zero_copy_only=False), dtype=object)
+        is_test = _split_hash(batch.column("Grid_ID").to_numpy(), hours, seed) < test_fraction
+        yield raw, labels, is_test
+
+
+class Reservoir:
+    """Uniform sample of at most k rows of a stream (Algorithm R, one batch at a time)."""
+
+    def __init__(self, k: int, width: int, seed: int):
+        self.k = int(k)
+        self.rows = np.empty((self.k, width))
+        self.labels = np.empty(self.k, dtype=object)
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, rows: np.ndarray, labels: np.ndarray):
+        n = len(rows)
+        fill = max(0, min(self.k - self.seen, n))
+        self.rows[self.seen:self.seen + fill] = rows[:fill]
+        self.labels[self.seen:self.seen + fill] = labels[:fill]
+        if fill < n:
+            # item with stream index i replaces slot j ~ U[0, i] when j < k
+            idx = self.seen + np.arange(fill, n)
+            j = (self.rng.random(len(idx)) * (idx + 1)).astype(np.int64)
+            take = np.flatnonzero(j < self.k)
+            # a slot hit twice in this batch keeps the later row, as in the sequential algorithm
+            slots, last = np.unique(j[take][::-1], return_index=True)
+            src = fill + take[::-1][last]
+            self.rows[slots] = rows[src]
+            self.labels[slots] = labels[src]
+        self.seen += n
+
+    def sample(self) -> Tuple[np.ndarray, np.ndarray]:
+        m = min(self.seen, self.k)
+        return self.rows[:m], self.labels[:m]
+
+
+def _fill_missing(raw: np.ndarray, means: np.ndarray) -> np.ndarray:
+    cont = raw[:, :len(FEATURES)]
+    bad = np.isnan(cont)
+    if bad.any():
+        cont[bad] = np.broadcast_to(means, cont.shape)[bad]
+    return raw
+
+
+def _metrics(confusion: np.ndarray, labels: List[str]) -> Dict[str, object]:
+    tp = np.diag(confusion).astype(float)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    total = int(confusion.sum())
+    return {
+        "test_rows": total,
+        "accuracy": round(float(tp.sum() / total), 5) if total else None,
+        "macro_f1": round(float(f1.mean()), 5) if total else None,
+        "per_class": {
+            lab: {"precision": round(float(p), 5), "recall": round(float(r), 5), "f1": round(float(f), 5), "support": int(s)}
+            for lab, p, r, f, s in zip(labels, precision, recall, f1, support)
+        },
+        "confusion": confusion.tolist(),
+    }
+
+
+def _dump(obj, path: str):
+    import joblib
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        joblib.dump(obj, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def train(data: str, out_dir: str = BASE_DIR, learner: str = "forest", sample_rows: int = 2_000_000,
+          batch_rows: int = 262_144, test_fraction: float = 0.2, n_estimators: int = 200, max_depth: Optional[int] = 12,
+          epochs: int = 2, seed: int = 42, export_runtime: bool = True) -> Dict[str, object]:
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+    t_start = time.perf_counter()
+    timings: Dict[str, float] = {}
+    scaler = StandardScaler()
+    label_set = set()
+    reservoir = Reservoir(sample_rows, len(FEATURES) + 3, seed) if learner == "forest" else None
+    n_train = n_test = 0
+
+    t0 = time.perf_counter()
+    for raw, labels, is_test in batches(data, batch_rows, test_fraction, seed):
+        train_rows = ~is_test
+        # NaNs are ignored by partial_fit, so mean_ is the fill value the notebook used
+        scaler.partial_fit(raw[train_rows, :len(FEATURES)])
+        label_set.update(labels[train_rows].tolist())
+        if reservoir is not None:
+            reservoir.add(raw[train_rows], labels[train_rows])
+        n_train += int(train_rows.sum())
+        n_test += int(is_test.sum())
+    print(f"[TRAIN] pass 1: {n_train} train / {n_test} test rows")
+    if n_train == 0:
+        raise ValueError(f"No training rows in '{data}'")
+    le = LabelEncoder().fit(sorted(label_set))
+    timings["scan_s"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if learner == "forest":
+        from sklearn.ensemble import RandomForestClassifier
+
+        rows, labels = reservoir.sample()
+        X = flood_runtime.design_matrix(_fill_missing(rows, scaler.mean_), scaler)
+        model = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, random_state=seed, n_jobs=-1)
+        model.fit(X, le.transform(labels))
+        fit_rows = len(rows)
+        del reservoir, rows, X
+    elif learner == "sgd":
+        from sklearn.linear_model import SGDClassifier
+
+        model = SGDClassifier(loss="log_loss", alpha=1e-5, random_state=seed)
+        classes = np.arange(len(le.classes_))
+        fit_rows = 0
+        for epoch in range(epochs):
+            for raw, labels, is_test in batches(data, batch_rows, test_fraction, seed):
+                keep = ~is_test
+                if keep.any():
+                    X = flood_runtime.design_matrix(_fill_missing(raw[keep], scaler.mean_), scaler)
+                    model.partial_fit(X, le.transform(labels[keep]), classes=classes)
+                    fit_rows += int(keep.sum())
+            print(f"[TRAIN] sgd epoch {epoch + 1}/{epochs}")
+    else:
+        raise ValueError(f"Unknown learner '{learner}' (forest or sgd)")
+    timings["fit_s"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    k = len(le.classes_)
+    confusion = np.zeros((k, k), dtype=np.int64)
+    known = {lab: i for i, lab in enumerate(le.classes_)}
+    for raw, labels, is_test in batches(data, batch_rows, test_fraction, seed):
+        if not is_test.any():
+            continue
+        y = np.array([known.get(lab, -1) for lab in labels[is_test]])
+        ok = y >= 0  # labels never seen in training cannot be scored
+        X = flood_runtime.design_matrix(_fill_missing(raw[is_test][ok], scaler.mean_), scaler)
+        pred = model.predict(X)
+        confusion += np.bincount(y[ok] * k + pred, minlength=k * k).reshape(k, k)
+    metrics = _metrics(confusion, [str(c) for c in le.classes_])
+    timings["eval_s"] = time.perf_counter() - t0
+
+    model_path = os.path.join(out_dir, "model", "flood_model.pkl")
+    scaler_path = os.path.join(out_dir, "scaler", "scaler.pkl")
+    encoder_path = os.path.join(out_dir, "encoder", "label_encoder.pkl")
+    _dump(scaler, scaler_path)
+    _dump(le, encoder_path)
+    _dump(model, model_path)
+    runtime_path = None
+    if export_runtime and learner == "forest":
+        runtime_path = os.path.join(out_dir, "model", "flood_model.npz")
+        flood_runtime.export(model_path, scaler_path, encoder_path, runtime_path, data_path=data)
+    timings["total_s"] = time.perf_counter() - t_start
+
+    import sklearn
+
+    manifest = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "data": {**data_version(data), "train_rows": n_train, "test_rows": n_test, "fit_rows": fit_rows},
+        "learner": learner,
+        "params": {
+            "sample_rows": sample_rows, "batch_rows": batch_rows, "test_fraction": test_fraction, "seed": seed,
+            **({"n_estimators": n_estimators, "max_depth": max_depth} if learner == "forest" else {"epochs": epochs}),
+        },
+        "features": FEATURES + ["hour_of_day", "month", "day_of_week"],
+        "classes": [str(c) for c in le.classes_],
+        "metrics": metrics,
+        "timings": {key: round(v, 2) for key, v in timings.items()},
+        "sklearn_version": sklearn.__version__,
+        "artifacts": {
+            "model": os.path.relpath(model_path, out_dir), "scaler": os.path.relpath(scaler_path, out_dir),
+            "encoder": os.path.relpath(encoder_path, out_dir),
+            **({"runtime": os.path.relpath(runtime_path, out_dir)} if runtime_path else {}),
+        },
+    }
+    manifest_path = os.path.join(out_dir, "model", "manifest.json")
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(manifest_path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path)
+    print(f"[TRAIN] {learner}: accuracy {metrics['accuracy']}, macro F1 {metrics['macro_f1']} on {metrics['test_rows']} rows; "
+          f"manifest -> {manifest_path}")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the flood model from (partitioned) parquet with bounded memory.")
+    parser.add_argument("--data", default=os.path.join(BASE_DIR, "dataset", "delhi_flood_dataset_demo.parquet"),
+                        help="parquet file or directory of parquet files")
+    parser.add_argument("--out-dir", default=BASE_DIR, help="writes model/, scaler/ and encoder/ under this directory")
+    parser.add_argument("--learner", choices=("forest", "sgd"), default="forest")
+    parser.add_argument("--sample-rows", type=int, default=2_000_000, help="forest: reservoir size (bounds memory)")
+    parser.add_argument("--batch-rows", type=int, default=262_144)
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--n-estimators", type=int, default=200)
+    parser.add_argument("--max-depth", type=int, default=12)
+    parser.add_argument("--epochs", type=int, default=2, help="sgd: passes over the stream")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-runtime", action="store_true", help="skip the NumPy runtime export")
+    args = parser.parse_args()
+    train(args.data, args.out_dir, args.learner, args.sample_rows, args.batch_rows, args.test_fraction,
+          args.n_estimators, args.max_depth, args.epochs, args.seed, export_runtime=not args.no_runtime)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Size-bounded upload handling.
+
+Starlette already streams multipart file parts into SpooledTemporaryFiles
+(memory up to 1 MB, disk beyond), so uploads stay bounded as long as handlers
+never call `await file.read()` on them. This module provides the pieces the
+handlers use instead:
+
+ - UploadLimitMiddleware rejects bodies over a limit with 413, up front from
+   Content-Length, or as soon as a chunked body passes the limit;
+ - check_size() enforces a tighter per-endpoint limit (e.g. images);
+ - spooled_path() copies an upload chunk by chunk into a uniquely named temp
+   file for decoders that need a path (cv2.VideoCapture) and removes it after.
+
+Configuration (env vars):
+ - MAX_UPLOAD_MB        any request body (default 250)
+ - MAX_IMAGE_UPLOAD_MB  image uploads (default 25)
+ - UPLOAD_TMP_DIR       where spooled video files go (default server/temp_upload)
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from fastapi import HTTPException, UploadFile
+
+MB = 1024 * 1024
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "250")) * MB)
+MAX_IMAGE_BYTES = int(float(os.getenv("MAX_IMAGE_UPLOAD_MB", "25")) * MB)
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", os.path.join(os.path.dirname(__file__), "temp_upload"))
+COPY_CHUNK = MB
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def _too_large_body(max_bytes: int) -> bytes:
+    return json.dumps({"detail": f"Upload exceeds the {max_bytes // MB} MB limit"}).encode()
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware: 413 for request bodies larger than max_bytes."""
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.max_bytes = int(max_bytes)
+
+    async def _reject(self, send):
+        body = _too_large_body(self.max_bytes)
+        await send({"type": "http.response.start", "status": 413, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close"),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    if int(value) > self.max_bytes:
+                        await self._reject(send)
+                        return
+                except ValueError:
+                    pass
+                break
+
+        received = 0
+        state = {"too_large": False, "started": False}
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    state["too_large"] = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # the app may turn the receive error into its own response (e.g. a 400 from
+            # form parsing); replace whatever it sends with the 413
+            if state["too_large"]:
+                if not state["started"]:
+                    state["started"] = True
+                    await self._reject(send)
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if not state["started"]:
+                state["started"] = True
+                await self._reject(send)
+
+
+def upload_size(upload: UploadFile) -> int:
+    if upload.size is not None:
+        return int(upload.size)
+    f = upload.file
+    pos = f.tell()
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(pos)
+    return size
+
+
+def check_size(upload: UploadFile, max_bytes: int):
+    if max_bytes > 0 and upload_size(upload) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {max_bytes // MB} MB limit")
+
+
+@contextmanager
+def spooled_path(upload: UploadFile, directory: Optional[str] = None) -> Iterator[str]:
+    """Path of a private copy of the upload, streamed in COPY_CHUNK pieces; deleted on exit.
+
+    The name is unique per call (the client's filename only contributes its extension),
+    so concurrent uploads of e.g. "video.mp4" never overwrite each other.
+    """
+    directory = directory or UPLOAD_TMP_DIR
+    os.makedirs(directory, exist_ok=True)
+    suffix = os.path.splitext(os.path.basename(upload.filename or ""))[1][:16]
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=suffix, dir=directory)
+    try:
+        upload.file.seek(0)
+        with os.fdopen(fd, "wb") as out:
+            shutil.copyfileobj(upload.file, out, COPY_CHUNK)
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass